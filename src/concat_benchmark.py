@@ -0,0 +1,75 @@
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import imageio
+import numpy as np
+from src.utils.file_util import concatenate_mp4s
+
+METHODS = ("copy", "reencode")
+
+def make_segments(folder, segments, frames, width, height, fps):
+  """
+  Write `segments` synthetic videos shaped like Wan output: moving noise, so the encoder
+  has real work to do, encoded with libx264 like `export_to_video`.
+  """
+  rng = np.random.default_rng(0)
+  base = rng.integers(0, 256, size=(height, width * 2, 3), dtype=np.uint8)
+  paths = []
+  for i in range(segments):
+    path = os.path.join(folder, f"segment-{i}.mp4")
+    writer = imageio.get_writer(path, fps=fps, codec="libx264")
+    try:
+      for f in range(frames):
+        offset = (i * frames + f) * 4 % width
+        writer.append_data(base[:, offset:offset + width])
+    finally:
+      writer.close()
+    paths.append(path)
+  return paths
+
+def benchmark(paths, folder, repeat, fps):
+  """Seconds per run of each concat method, `repeat` runs each, alternating methods."""
+  timings = {method: [] for method in METHODS}
+  for run in range(repeat):
+    for method in METHODS:
+      output = os.path.join(folder, f"combined-{method}-{run}.mp4")
+      start = time.perf_counter()
+      _, used = concatenate_mp4s(paths, output, fps=fps, method=method)
+      timings[method].append(time.perf_counter() - start)
+      if used != method:
+        raise RuntimeError(f"Asked for {method} but the concat used {used}")
+      os.remove(output)
+  return timings
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare wall time of stream copy and re-encode when joining video segments.")
+  parser.add_argument("--segments", type=int, default=4, help="Number of segments to join")
+  parser.add_argument("--frames", type=int, default=81, help="Frames per segment")
+  parser.add_argument("--width", type=int, default=832)
+  parser.add_argument("--height", type=int, default=480)
+  parser.add_argument("--fps", type=int, default=16)
+  parser.add_argument("--repeat", type=int, default=3, help="Runs per method; the median is reported")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory(prefix="aapi-concat-") as folder:
+    start = time.perf_counter()
+    paths = make_segments(folder, args.segments, args.frames, args.width, args.height, args.fps)
+    print(
+      f"{args.segments} segments of {args.frames} frames at {args.width}x{args.height}, {args.fps} fps "
+      f"(created in {time.perf_counter() - start:.2f}s)"
+    )
+
+    timings = benchmark(paths, folder, args.repeat, args.fps)
+
+  medians = {method: statistics.median(times) for method, times in timings.items()}
+  print(f"{'method':>10}  {'median s':>9}  {'min s':>7}  {'max s':>7}")
+  for method in METHODS:
+    times = timings[method]
+    print(f"{method:>10}  {medians[method]:>9.3f}  {min(times):>7.3f}  {max(times):>7.3f}")
+  print(f"stream copy is {medians['reencode'] / medians['copy']:.1f}x faster than re-encoding")
+
+if __name__ == "__main__":
+  main()
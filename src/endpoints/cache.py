@@ -0,0 +1,19 @@
+from flask import Blueprint, jsonify
+from src.utils.cache_util import cache_stats
+from src.utils.lazy_util import lazy_import, is_loaded
+from src.utils.ollama_cache_util import ollama_cache_stats
+
+# these import torch, which a stats request should not trigger
+embedding_util = lazy_import("src.utils.embedding_util")
+lora_util = lazy_import("src.utils.lora_util")
+
+cache_bp = Blueprint("cache", __name__, url_prefix="/api")
+
+@cache_bp.route("/cache/stats", methods=["GET"])
+def stats():
+  return jsonify({
+    "models": cache_stats(),
+    "lora_state_dicts": lora_util.get_lora_state_dict_cache().stats() if is_loaded("src.utils.lora_util") else None,
+    "embeddings": embedding_util.embedding_cache_stats() if is_loaded("src.utils.embedding_util") else {},
+    "ollama_responses": ollama_cache_stats()
+  }), 200
@@ -0,0 +1,18 @@
+from flask import Blueprint, jsonify
+from src.utils.job_util import get_job_queue, gpu_status
+from src.utils.lazy_util import warm_up
+
+health_bp = Blueprint("health", __name__, url_prefix="/api")
+
+@health_bp.route("/health", methods=["GET"])
+def health():
+  return jsonify({
+    "status": "ok",
+    "gpu": gpu_status(),
+    "queued_jobs": get_job_queue().pending_count()
+  }), 200
+
+@health_bp.route("/warmup", methods=["POST"])
+def warmup():
+  # imports torch, diffusers and the model utils of the enabled endpoints ahead of the first request
+  return jsonify({"imported": warm_up()}), 200
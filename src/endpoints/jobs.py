@@ -0,0 +1,37 @@
+from flask import Blueprint, request, jsonify
+from src.utils.endpoint_util import int_param
+from src.utils.job_util import get_job_queue
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/api")
+
+@jobs_bp.route("/jobs", methods=["GET"])
+def list_jobs():
+  status = request.args.get("status") or None
+  limit = int_param("limit", request.args.get("limit"), 100, min=1)
+
+  return jsonify({"jobs": get_job_queue().list(status=status, limit=limit)}), 200
+
+@jobs_bp.route("/jobs/scheduler", methods=["GET"])
+def scheduler_stats():
+  queue = get_job_queue()
+
+  return jsonify({"queued": queue.pending_count(), **queue.schedule_stats.stats()}), 200
+
+@jobs_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+  job = get_job_queue().get(job_id)
+  if job is None:
+    return jsonify({"error": "Job not found."}), 404
+
+  return jsonify(job), 200
+
+@jobs_bp.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+  queue = get_job_queue()
+  job = queue.get(job_id)
+  if job is None:
+    return jsonify({"error": "Job not found."}), 404
+  if not queue.cancel(job_id):
+    return jsonify({"error": f"Job is {job['status']} and can no longer be cancelled."}), 409
+
+  return jsonify(queue.get(job_id)), 200
@@ -0,0 +1,45 @@
+from datetime import datetime
+from flask import Blueprint, request, jsonify
+from src.utils.endpoint_util import required_param, normalize_path, int_param
+from src.utils.metadata_util import get_metadata_index
+from werkzeug.exceptions import BadRequest
+
+metadata_bp = Blueprint("metadata", __name__, url_prefix="/api")
+
+@metadata_bp.route("/metadata/search", methods=["GET"])
+def search_metadata():
+  args = request.args
+
+  results = get_metadata_index().search(
+    query=args.get("q") or None,
+    model=args.get("model") or None,
+    kind=args.get("kind") or None,
+    folder=normalize_path(args.get("folder")) if args.get("folder") else None,
+    since=parse_time("since", args.get("since")),
+    until=parse_time("until", args.get("until")),
+    limit=int_param("limit", args.get("limit"), 100, min=1),
+    offset=int_param("offset", args.get("offset"), 0, min=0)
+  )
+
+  return jsonify({"results": results}), 200
+
+@metadata_bp.route("/metadata/scan", methods=["POST"])
+def scan_metadata():
+  payload = request.get_json(silent=True) or {}
+  path = payload.get("path")
+  required_param("path", path)
+
+  return jsonify(get_metadata_index().scan(normalize_path(path), recursive=bool(payload.get("recursive", True)))), 200
+
+def parse_time(name, value):
+  """Accept a unix timestamp or an ISO 8601 date/datetime."""
+  if not value:
+    return None
+  try:
+    return float(value)
+  except ValueError:
+    pass
+  try:
+    return datetime.fromisoformat(value).timestamp()
+  except ValueError:
+    raise BadRequest(f"{name} must be a unix timestamp or an ISO 8601 date")
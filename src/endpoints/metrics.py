@@ -0,0 +1,69 @@
+from flask import Blueprint, Response
+from src.utils.cache_util import get_model_cache
+from src.utils.job_util import get_job_queue, gpu_status
+from src.utils.lazy_util import lazy_import, is_loaded
+from src.utils.metrics_util import collected, render
+import os
+
+# these import torch, which a scrape should not trigger
+embedding_util = lazy_import("src.utils.embedding_util")
+lora_util = lazy_import("src.utils.lora_util")
+
+metrics_bp = Blueprint("metrics", __name__)
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+  return Response(render(), mimetype="text/plain; version=0.0.4")
+
+def cache_stats_by_name():
+  """Stats of every ModelCache that is in use: loaded pipelines, LoRA files and prompt embeddings."""
+  caches = {"models": get_model_cache().stats()}
+  if is_loaded("src.utils.lora_util"):
+    caches["loras"] = lora_util.get_lora_state_dict_cache().stats()
+  if is_loaded("src.utils.embedding_util"):
+    for name, stats in embedding_util.embedding_cache_stats().items():
+      caches[f"embeddings_{name}"] = stats
+  return caches
+
+def cache_stat(field):
+  return lambda: {(name, ): stats[field] for name, stats in cache_stats_by_name().items()}
+
+def process_memory():
+  # resident pages from /proc, Linux only
+  try:
+    with open("/proc/self/statm", "r") as f:
+      return {(): int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")}
+  except (OSError, ValueError, IndexError):
+    return {}
+
+def device_memory(field):
+  def collect():
+    if not is_loaded("torch"):
+      return {}
+    torch = lazy_import("torch")
+    if not torch.cuda.is_available():
+      return {}
+    read = torch.cuda.memory_allocated if field == "allocated" else torch.cuda.memory_reserved
+    return {(str(i), ): read(i) for i in range(torch.cuda.device_count())}
+  return collect
+
+collected("aapi_jobs_queued", "Jobs waiting in the job queue", collect=lambda: {(): get_job_queue().pending_count()})
+collected("aapi_gpu_busy", "1 while the GPU thread is running a generation", collect=lambda: {(): int(gpu_status()["busy"])})
+collected("aapi_gpu_waiting", "Generations waiting for the GPU thread", collect=lambda: {(): gpu_status()["waiting"]})
+
+collected("aapi_cache_entries", "Entries resident in each cache", ("cache", ), cache_stat("slots"))
+collected("aapi_cache_bytes", "Measured size of the entries in each cache", ("cache", ), cache_stat("bytes"))
+collected("aapi_cache_hits_total", "Cache lookups answered from memory", ("cache", ), cache_stat("hits"), kind="counter")
+collected("aapi_cache_misses_total", "Cache lookups that had to load", ("cache", ), cache_stat("misses"), kind="counter")
+collected("aapi_cache_evictions_total", "Entries evicted to stay within the cache limits", ("cache", ), cache_stat("evictions"), kind="counter")
+collected("aapi_cache_hit_ratio", "Hits divided by lookups since startup", ("cache", ), cache_stat("hit_rate"))
+collected(
+  "aapi_model_resident_bytes",
+  "Size of each loaded pipeline",
+  ("key", "pinned"),
+  lambda: {(e["key"], str(e["pinned"]).lower()): e["bytes"] for e in get_model_cache().entries()}
+)
+
+collected("aapi_process_resident_memory_bytes", "Resident memory of the server process", collect=process_memory)
+collected("aapi_device_memory_allocated_bytes", "GPU memory allocated by tensors", ("device", ), device_memory("allocated"))
+collected("aapi_device_memory_reserved_bytes", "GPU memory reserved by the caching allocator", ("device", ), device_memory("reserved"))
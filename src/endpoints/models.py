@@ -0,0 +1,153 @@
+from flask import Blueprint, request, jsonify
+from werkzeug.exceptions import BadRequest, HTTPException
+from src.utils.cache_util import get_model_cache, cache_delete, cache_pin, cache_unpin
+from src.utils.endpoint_util import required_param, normalize_path
+from src.utils.job_util import register_job, run_job
+from src.utils.lazy_util import lazy_import, is_loaded
+from src.utils.model_key_util import sdxl_cache_key, wan_cache_key, normalize_loras
+from src.utils.logger import log
+import json
+import os
+import time
+
+# loaded on first use, see lazy_util
+sdxl_util = lazy_import("src.utils.sdxl_util")
+wan_util = lazy_import("src.utils.wan_util")
+lora_util = lazy_import("src.utils.lora_util")
+
+MODEL_TYPES = ("sdxl", "wan", "lora")
+
+models_bp = Blueprint("models", __name__, url_prefix="/api")
+
+@models_bp.route("/models", methods=["GET"])
+def list_models():
+  return jsonify(resident_models()), 200
+
+@models_bp.route("/models/load", methods=["POST"])
+def load_model():
+  payload = request.get_json() or {}
+  return jsonify(run_job("model_load", payload)), 200
+
+@models_bp.route("/models/pin", methods=["POST"])
+def pin_model():
+  key = (request.get_json() or {}).get("key")
+  required_param("key", key)
+  if not cache_pin(key):
+    return jsonify({"error": "Model not loaded."}), 404
+  return jsonify(resident_models()), 200
+
+@models_bp.route("/models/unpin", methods=["POST"])
+def unpin_model():
+  key = (request.get_json() or {}).get("key")
+  required_param("key", key)
+  if not cache_unpin(key):
+    return jsonify({"error": "Model not loaded."}), 404
+  return jsonify(resident_models()), 200
+
+@models_bp.route("/models/unload", methods=["POST"])
+def unload_model():
+  key = (request.get_json() or {}).get("key")
+  required_param("key", key)
+  if key not in get_model_cache():
+    return jsonify({"error": "Model not loaded."}), 404
+
+  # on the GPU thread, so a model is not freed in the middle of a generation using it
+  return jsonify(run_job("model_unload", {"key": key})), 200
+
+def resident_models():
+  """Loaded pipelines with their measured size, plus device memory once torch is loaded."""
+  cache = get_model_cache()
+  models = [
+    {**entry, "gb": round(entry["bytes"] / 2**30, 2)}
+    for entry in reversed(cache.entries())
+  ]
+
+  response = {"models": models, "cache": cache.stats()}
+  if is_loaded("src.utils.lora_util"):
+    response["loras"] = lora_util.get_lora_state_dict_cache().stats()
+
+  if is_loaded("torch"):
+    torch = lazy_import("torch")
+    if torch.cuda.is_available():
+      response["device"] = {
+        "allocated_bytes": torch.cuda.memory_allocated(),
+        "reserved_bytes": torch.cuda.memory_reserved()
+      }
+  return response
+
+def execute_model_load(payload):
+  """
+  Load the pipeline described by `payload` into the model cache, with its LoRAs applied,
+  and optionally pin it. `type` "lora" only reads the LoRA files into the CPU cache.
+  """
+  model_type = payload.get("type")
+  if model_type not in MODEL_TYPES:
+    raise BadRequest(f"type must be one of {', '.join(MODEL_TYPES)}")
+
+  loras = normalize_loras(payload.get("loras", []), 70)
+  pin = bool(payload.get("pin", False))
+  start = time.perf_counter()
+
+  if model_type == "lora":
+    required_param("loras", loras)
+    for lora in loras:
+      lora_util.load_lora_state_dict(lora["path"])
+    log(f"Loaded {len(loras)} LoRAs in {time.perf_counter() - start:.2f}s")
+    return {"loras": [lora["path"] for lora in loras], "seconds": round(time.perf_counter() - start, 2)}
+
+  if model_type == "sdxl":
+    required_param("checkpoint_file_path", payload.get("checkpoint_file_path"))
+    checkpoint = normalize_path(payload.get("checkpoint_file_path"))
+    refiner = normalize_path(payload.get("refiner_checkpoint_file_path"))
+    key = sdxl_cache_key(checkpoint, refiner)
+    sdxl_util.get_cached_sdxl_pipe(checkpoint, refiner, loras, bool(payload.get("img2img", False)))
+  else:
+    gguf_path = payload.get("gguf_path")
+    required_param("gguf_path", gguf_path)
+    key = wan_cache_key(gguf_path, bool(payload.get("image", False)))
+    wan_util.get_cached_wan_pipe(gguf_path, loras, bool(payload.get("image", False)))
+
+  if pin:
+    cache_pin(key)
+
+  seconds = round(time.perf_counter() - start, 2)
+  log(f"Loaded {key} in {seconds}s" + (" (pinned)" if pin else ""))
+  return {"key": key, "pinned": pin, "seconds": seconds}
+
+def execute_model_unload(payload):
+  if cache_delete(payload["key"]):
+    log(f"Unloaded {payload['key']}")
+  return resident_models()
+
+register_job("model_load", execute_model_load)
+register_job("model_unload", execute_model_unload)
+
+def preload_specs(value=None):
+  """
+  Models to load at startup from AAPI_PRELOAD: a JSON list of `/api/models/load` payloads,
+  or the path of a JSON file holding one.
+  """
+  value = value if value is not None else os.getenv("AAPI_PRELOAD", "")
+  value = value.strip()
+  if not value:
+    return []
+  if not value.startswith("["):
+    with open(value, "r", encoding="utf-8") as f:
+      value = f.read()
+
+  specs = json.loads(value)
+  if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+    raise ValueError("AAPI_PRELOAD must be a JSON list of objects")
+  return specs
+
+def preload_models(specs):
+  """Load every spec in order on the GPU thread; failures are logged and skipped."""
+  loaded = 0
+  for spec in specs:
+    try:
+      run_job("model_load", spec)
+      loaded += 1
+    except Exception as e:
+      error = e.description if isinstance(e, HTTPException) else repr(e)
+      log(f"Could not preload {spec}: {error}")
+  log(f"Preloaded {loaded} of {len(specs)} models")
@@ -1,9 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint, request, jsonify
-from src.utils.ollama_util import call_ollama
+from werkzeug.exceptions import HTTPException
+from src.utils.logger import log
+from src.utils.ollama_pool_util import get_ollama_pool
+from src.utils.ollama_util import get_ollama_client, parse_keep_alive
 from typing import Optional
+import os
+import requests
+import threading
+import time
 
 ollama_bp = Blueprint("ollama", __name__, url_prefix="/api")
 
+DEFAULT_INSTRUCTION = "Provide a concise, usable variation of the base prompt."
+
 @ollama_bp.route("/ollama/prompt_variation", methods=["POST"])
 def ollama():
   payload = request.get_json(silent=True) or {}
@@ -12,45 +22,110 @@ def ollama():
   base_prompt = payload.get("base_prompt") or None
   variation_prompt = payload.get("variation_prompt") or None
   num_variations = int(payload.get("num_variations") or 1)
-  ollama_url = payload.get("ollama_url", "http://localhost:11434/api/generate") or None
+  # without a URL, calls are spread over the OLLAMA_BACKENDS pool (or go to a local Ollama)
+  ollama_url = payload.get("ollama_url") or None
   ollama_model = payload.get("ollama_model", "gemma3:27b") or None
+  keep_alive = parse_keep_alive(payload.get("keep_alive"))
+  unload_model = payload.get("unload_model", os.getenv("OLLAMA_UNLOAD_MODEL", "true").lower() == "true")
+  single_call = bool(payload.get("single_call", False))
+  max_calls = int(payload.get("max_calls") or 3)
+  seed = payload.get("seed")
+  bypass_cache = bool(payload.get("bypass_cache", False))
 
   if not base_prompt:
     return jsonify({"error": "`base_prompt` is required."}), 400
   if not variation_prompt:
     return jsonify({"error": "`variation_prompt` is required."}), 400
+  if max_calls < 1:
+    return jsonify({"error": "`max_calls` must be at least 1."}), 400
+  if seed is not None and not isinstance(seed, int):
+    return jsonify({"error": "`seed` must be an integer."}), 400
 
-  variations = []
+  start = time.perf_counter()
+  client = get_ollama_client()
+  # pool backends this request called, the only ones its model is unloaded from
+  counts = {"ollama_calls": 0, "cache_hits": 0, "backends": set()}
+  error = None
 
-  # generate variations using the util function
-  variations = generate_prompt_variations(
-    base_prompt=base_prompt,
-    variation_prompt=variation_prompt,
-    count=num_variations,
-    ollama_url=ollama_url,
-    ollama_model=ollama_model
-  )
+  try:
+    if single_call:
+      variations = generate_prompt_variation_list(
+        base_prompt=base_prompt,
+        variation_prompt=variation_prompt,
+        count=num_variations,
+        ollama_url=ollama_url,
+        ollama_model=ollama_model,
+        keep_alive=keep_alive,
+        max_calls=max_calls,
+        seed=seed,
+        bypass_cache=bypass_cache,
+        counts=counts
+      )
+    else:
+      variations = generate_prompt_variations(
+        base_prompt=base_prompt,
+        variation_prompt=variation_prompt,
+        count=num_variations,
+        ollama_url=ollama_url,
+        ollama_model=ollama_model,
+        keep_alive=keep_alive,
+        seed=seed,
+        bypass_cache=bypass_cache,
+        counts=counts
+      )
+  except HTTPException as e:
+    # e.g. every pool backend failed
+    error = (e.description, e.code)
+  except requests.RequestException as e:
+    error = (f"Ollama request failed: {repr(e)}", 502)
+  finally:
+    # nothing to unload when every answer came from the cache
+    if unload_model and counts["ollama_calls"]:
+      try:
+        client.unload(ollama_url, ollama_model, backends=counts["backends"])
+      except Exception as e:
+        log(f"Could not unload Ollama model {ollama_model}: {repr(e)}")
+
+  if error is not None:
+    return jsonify({"error": error[0]}), error[1]
 
-  return jsonify({"base_prompt": base_prompt, "variation_prompt": variation_prompt, "variations": variations}), 200
+  return jsonify({
+    "base_prompt": base_prompt,
+    "variation_prompt": variation_prompt,
+    "variations": variations,
+    "ollama_calls": counts["ollama_calls"],
+    "cache_hits": counts["cache_hits"],
+    "latency_ms": round((time.perf_counter() - start) * 1000)
+  }), 200
+
+@ollama_bp.route("/ollama/backends", methods=["GET"])
+def ollama_backends():
+  pool = get_ollama_pool()
+  return jsonify({"backends": pool.metrics() if pool is not None else []}), 200
 
 def generate_prompt_variations(
   base_prompt: str,
   variation_prompt: Optional[str],
   count: int,
-  ollama_url: str = "http://localhost:11434/api/generate",
-  ollama_model: str = "gemma3:27b"
+  ollama_url: Optional[str] = None,
+  ollama_model: str = "gemma3:27b",
+  keep_alive = None,
+  seed: Optional[int] = None,
+  bypass_cache: bool = False,
+  counts: Optional[dict] = None
 ):
   """
-  Generate `count` variations of base_prompt using an Ollama model.
-  Returns a list of {"original": base_prompt, "new": <variation>} items.
-  This function calls Ollama `count` times. It uses a schema to request a single
-  string field `variation` from the model for easier parsing.
+  Generate `count` variations of base_prompt using an Ollama model, one call per variation.
+  Returns the variations in request order.
+  The calls run concurrently through the shared Ollama client, which bounds how many
+  are in flight. The model stays loaded for `keep_alive`; callers unload it when done.
+  Call `i` uses seed `seed + i` and is cached separately from the other calls.
   """
   if not base_prompt:
     return []
 
   # Compose the prompt to instruct model: produce a single short variation per call
-  instruction = variation_prompt or "Provide a concise, usable variation of the base prompt."
+  instruction = variation_prompt or DEFAULT_INSTRUCTION
   # We'll create a small wrapper prompt sending base and instruction
   prompt_template = (
     "Base prompt:\n"
@@ -70,33 +145,157 @@ def generate_prompt_variations(
     "required": ["variation"]
   }
 
-  results = []
-  for i in range(max(0, int(count or 0))):
-    composed = prompt_template.format(base=base_prompt, instruction=instruction)
-    resp = call_ollama(
-      ollama_url=ollama_url,
-      model=ollama_model,
-      prompt=composed,
+  count = max(0, int(count or 0))
+  if count == 0:
+    return []
+
+  client = get_ollama_client()
+  composed = prompt_template.format(base=base_prompt, instruction=instruction)
+
+  def generate_one(i):
+    return extract_variation(generate_counted(
+      client,
+      counts,
+      ollama_url,
+      ollama_model,
+      composed,
       format_schema=schema,
       thinking=False,
-      stream=False,
-      keep_alive=None
+      keep_alive=keep_alive,
+      options={"seed": seed + i} if seed is not None else None,
+      cache_salt=i,
+      bypass_cache=bypass_cache,
+      used_backends=counts.get("backends") if counts is not None else None
+    ))
+
+  with ThreadPoolExecutor(max_workers=min(count, client.max_concurrency), thread_name_prefix="aapi-ollama") as executor:
+    return list(executor.map(generate_one, range(count)))
+
+def generate_prompt_variation_list(
+  base_prompt: str,
+  variation_prompt: Optional[str],
+  count: int,
+  ollama_url: Optional[str] = None,
+  ollama_model: str = "gemma3:27b",
+  keep_alive = None,
+  max_calls: int = 3,
+  seed: Optional[int] = None,
+  bypass_cache: bool = False,
+  counts: Optional[dict] = None
+):
+  """
+  Generate `count` distinct variations of base_prompt, asking for all of them in one call
+  with a schema that requires a `variations` array. If the model returns too few or
+  duplicates, the missing ones are requested in further calls, up to `max_calls` in total.
+  Fewer than `count` variations are returned only if `max_calls` runs out.
+  """
+  count = max(0, int(count or 0))
+  if not base_prompt or count == 0:
+    return []
+
+  instruction = variation_prompt or DEFAULT_INSTRUCTION
+  client = get_ollama_client()
+
+  variations = []
+  seen = set()
+  calls = 0
+
+  while len(variations) < count and calls < max_calls:
+    missing = count - len(variations)
+    schema = {
+      "type": "object",
+      "properties": {
+        "variations": {
+          "type": "array",
+          "items": {"type": "string"},
+          "minItems": missing,
+          "maxItems": missing
+        }
+      },
+      "required": ["variations"]
+    }
+
+    # base prompt and instruction come first so top-up calls share the prompt prefix
+    composed = (
+      "Base prompt:\n"
+      f"{base_prompt}\n\n"
+      "Instruction:\n"
+      f"{instruction}\n\n"
+      f"Return only a JSON object with a field named \"variations\": an array of exactly {missing} strings.\n"
+      "Each variation should be a rephrasing/alternative of the Base prompt suitable for image generation, "
+      "and every variation must be different from the others.\n"
+      "Do not include any extra commentary."
     )
+    if variations:
+      composed += "\n\nDo not repeat any of these existing variations:\n" + "\n".join(f"- {v}" for v in variations)
 
-    variation_text = ""
-    if isinstance(resp, dict) and "variation" in resp and isinstance(resp["variation"], str):
-      variation_text = resp["variation"].strip()
-    else:
-      # Fallback: if resp has a single top-level string field or raw response, try to extract
-      if isinstance(resp, dict):
-        # find first string value
-        for v in resp.values():
-          if isinstance(v, str):
-            variation_text = v.strip()
-            break
-      elif isinstance(resp, str):
-        variation_text = resp.strip()
-
-    results.append(variation_text)
-
-  return results
+    resp = generate_counted(
+      client,
+      counts,
+      ollama_url,
+      ollama_model,
+      composed,
+      format_schema=schema,
+      thinking=False,
+      keep_alive=keep_alive,
+      options={"seed": seed + calls} if seed is not None else None,
+      cache_salt=calls,
+      bypass_cache=bypass_cache,
+      used_backends=counts.get("backends") if counts is not None else None
+    )
+    calls += 1
+
+    items = resp.get("variations") if isinstance(resp, dict) else None
+    if not isinstance(items, list):
+      items = [extract_variation(resp)]
+
+    for item in items:
+      if not isinstance(item, str):
+        continue
+      text = item.strip()
+      key = " ".join(text.lower().split())
+      if text and key not in seen:
+        seen.add(key)
+        variations.append(text)
+
+  if len(variations) < count:
+    log(f"Ollama returned {len(variations)} of {count} distinct variations after {calls} calls")
+
+  return variations[:count]
+
+_counts_lock = threading.Lock()
+
+def generate_counted(client, counts, *args, **kwargs):
+  """
+  `client.generate_cached`, adding the call to `counts` as soon as it returns or fails:
+  a failed call still reached Ollama and may have loaded the model, so it must be unloaded.
+  """
+  try:
+    resp, from_cache = client.generate_cached(*args, **kwargs)
+  except Exception:
+    add_call_counts(counts, [False])
+    raise
+  add_call_counts(counts, [from_cache])
+  return resp
+
+def add_call_counts(counts, from_cache):
+  if counts is not None:
+    # concurrent variation calls count into the same dict
+    with _counts_lock:
+      counts["cache_hits"] += sum(1 for c in from_cache if c)
+      counts["ollama_calls"] += sum(1 for c in from_cache if not c)
+
+def extract_variation(resp):
+  if isinstance(resp, dict) and "variation" in resp and isinstance(resp["variation"], str):
+    return resp["variation"].strip()
+
+  # Fallback: if resp has a single top-level string field or raw response, try to extract
+  if isinstance(resp, dict):
+    # find first string value
+    for v in resp.values():
+      if isinstance(v, str):
+        return v.strip()
+  elif isinstance(resp, str):
+    return resp.strip()
+
+  return ""
@@ -1,25 +1,51 @@
 from flask import Blueprint, request, jsonify
+from werkzeug.exceptions import BadRequest
 from PIL import Image
-from sd_embed.embedding_funcs import get_weighted_text_embeddings_sdxl
 from src.utils.endpoint_util import required_param, divisible_by_x, within_range_inclusive, create_seed, normalize_path
-from src.utils.file_util import get_image_paths, get_image_save_path, get_timestamp
+from src.utils.file_util import get_timestamp
+from src.utils.output_store_util import generation_id, output_path, existing_output, with_file_keys
+from src.utils.input_util import get_input_paths, LazyPaths, prefetch
 from src.utils.logger import log
-from src.utils.sdxl_util import get_sdxl_pipe, normalize_loras
-from src.utils.cache_util import cache_set, cache_get
+from src.utils.lazy_util import lazy_import
+from src.utils.model_key_util import sdxl_cache_key, normalize_loras, lora_cache_key
 from src.utils.image_util import compute_dimensions_from_image
 from src.utils.prompt_util import generate_prompt_variations
+from src.utils.job_util import register_job, run_job, submit_job
+from src.utils.progress_util import emit, step_callback
+from src.utils.metrics_util import pipeline_timer
+from src.utils.stream_util import stream_job
+from src.utils.output_util import OutputWriter, write_image, write_with_sidecar, with_write_errors
 import gc
-import json
-import os
 import random
-import torch
+
+# loaded on first use, see lazy_util
+sdxl_util = lazy_import("src.utils.sdxl_util")
+torch = lazy_import("torch")
 
 sdxl_bp = Blueprint("sdxl", __name__, url_prefix="/api")
 
+# parameters that decide the generated image, hashed into its file name
+SDXL_OUTPUT_KEYS = [
+  "checkpoint_file_path", "refiner_checkpoint_file_path", "refiner_point", "loras",
+  "prompt", "prompt_prefix", "prompt_suffix",
+  "negative_prompt", "negative_prompt_prefix", "negative_prompt_suffix",
+  "seed", "width", "height", "num_steps", "reference_image_path", "input_image_strength"
+]
+
 @sdxl_bp.route("/sdxl", methods=["POST"])
 def sdxl():
   payload = request.get_json() or {}
 
+  if payload.get("async"):
+    return jsonify(submit_job("sdxl", payload)), 202
+
+  return jsonify(run_job("sdxl", payload)), 200
+
+@sdxl_bp.route("/sdxl/stream", methods=["POST"])
+def sdxl_stream():
+  return stream_job("sdxl", request.get_json() or {})
+
+def execute_sdxl(payload):
   params = {
     "checkpoint_file_path": normalize_path(payload.get("checkpoint_file_path", None)),
     "refiner_checkpoint_file_path": normalize_path(payload.get("refiner_checkpoint_file_path", None)),
@@ -42,7 +68,9 @@ def sdxl():
     "input_image_path": payload.get("input_image_path"),
     "input_image_strength": int(payload.get("input_image_strength", 70)),
     "refiner_point": int(payload.get("refiner_point", 80)),
-    "shuffle_prompts": payload.get("shuffle_prompts", False)
+    "shuffle_prompts": payload.get("shuffle_prompts", False),
+    "prefetch_inputs": payload.get("prefetch_inputs", False),
+    "skip_existing": payload.get("skip_existing", False)
   }
 
   required_param("prompt", params["prompt"])
@@ -53,8 +81,10 @@ def sdxl():
     divisible_by_x("width", params["width"], 8)
 
   within_range_inclusive("input_image_strength", params["input_image_strength"], 11, 100)
+  batch_size = parse_batch_size(payload.get("batch_size", 1))
 
-  image_paths = get_image_paths(params["input_image_path"])
+  # input images are discovered lazily so generation starts while large folders are still being scanned
+  image_paths = get_input_paths(params["input_image_path"], payload)
 
   if isinstance(params["prompt"], str):
     prompts = [params["prompt"]]
@@ -76,7 +106,7 @@ def sdxl():
 
   log(f"Number of SDXL prompts to execute: {len(prompts)}")
 
-  sdxl_pipe, refiner_sdxl_pipe = get_sdxl_pipe(
+  sdxl_pipe, refiner_sdxl_pipe = sdxl_util.get_cached_sdxl_pipe(
     params["checkpoint_file_path"],
     params["refiner_checkpoint_file_path"],
     params["loras"],
@@ -84,14 +114,51 @@ def sdxl():
   )
 
   saved_files = []
+  # images finished or skipped, for progress; duplicates count but are only listed once
+  done = 0
+  writer = OutputWriter()
 
   try:
-    generation_targets = []
-    if image_paths:
-      for img_path in image_paths:
-        generation_targets.append({"image_path": img_path})
+    if not image_paths:
+      generation_targets = LazyPaths([{"image_path": None}])
+    elif params["prefetch_inputs"]:
+      generation_targets = LazyPaths(
+        {"image_path": path, "dimensions": dimensions}
+        for path, dimensions in prefetch(image_paths, lambda path: compute_dimensions_from_image(path, max_dim=1024))
+      )
     else:
-      generation_targets.append({"image_path": None})
+      generation_targets = LazyPaths({"image_path": path} for path in image_paths)
+
+    def total():
+      # unknown until the input scan has finished
+      count = generation_targets.known_count()
+      return len(prompts) * count * params["num_images"] if count is not None else None
+
+    # items with the same size, mode and prompt length are denoised together, up to the batch size
+    pending_batches = {}
+    planned_paths = set()
+    encoder_key = sdxl_util.sdxl_text_encoder_key(params["checkpoint_file_path"], params["loras"])
+
+    def run_batch(batch_key):
+      nonlocal done
+      items = pending_batches.pop(batch_key)
+      # decode a batch one image at a time; only for this call, the pipeline is shared through the model cache
+      if len(items) > 1:
+        sdxl_pipe.vae.enable_slicing()
+      try:
+        images = generate_sdxl_images(sdxl_pipe, refiner_sdxl_pipe, items)
+      finally:
+        if len(items) > 1:
+          sdxl_pipe.vae.disable_slicing()
+
+      for item, image in zip(items, images):
+        saved_files.append(save_sdxl_image(writer, image, item["params"], item["path"]))
+        done += 1
+        emit("progress", done=done, total=total())
+
+      gc.collect()
+      torch.cuda.empty_cache()
+      torch.cuda.ipc_collect()
 
     # Outer loop: iterate over each prompt in prompts array
     for pi, prompt_text in enumerate(prompts):
@@ -112,11 +179,7 @@ def sdxl():
 
       log(f"SDXL prompt {pi + 1} / {len(prompts)}: {prompt_to_use}")
 
-      prompt_embeds, prompt_neg_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds = get_weighted_text_embeddings_sdxl(
-        sdxl_pipe,
-        prompt = prompt_to_use,
-        neg_prompt = negative_prompt_to_use
-      )
+      embeds = sdxl_util.get_sdxl_prompt_embeds(sdxl_pipe, encoder_key, prompt_to_use, negative_prompt_to_use)
 
       for target in generation_targets:
         for _ in range(params["num_images"]):
@@ -125,14 +188,16 @@ def sdxl():
             "seed": create_seed(params["seed"]),
             "prompt": prompt_text
           }
-          gen = torch.Generator(device="cuda").manual_seed(image_params["seed"])
 
           # compute per-target width/height if not provided
           width = params.get("width")
           height = params.get("height")
 
           if target.get("image_path") and (width is None or height is None):
-            img_w, img_h = compute_dimensions_from_image(target["image_path"], max_dim=1024)
+            # read once per input image and reused for every prompt
+            if "dimensions" not in target:
+              target["dimensions"] = compute_dimensions_from_image(target["image_path"], max_dim=1024)
+            img_w, img_h = target["dimensions"]
             if img_w and img_h:
               if width is None:
                 width = img_w
@@ -151,121 +216,137 @@ def sdxl():
           width = width - (width % 8)
           height = height - (height % 8)
 
-          image = None
-          if target["image_path"] is None:
-            if refiner_sdxl_pipe:
-              image = sdxl_pipe(
-                prompt_embeds=prompt_embeds,
-                pooled_prompt_embeds=pooled_prompt_embeds,
-                negative_prompt_embeds=prompt_neg_embeds,
-                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-                num_inference_steps=image_params["num_steps"],
-                height=height,
-                width=width,
-                num_images_per_prompt=1,
-                generator=gen,
-                denoising_end=image_params["refiner_point"] / 100,
-                output_type="latent"
-              ).images
-              image = refiner_sdxl_pipe(
-                prompt_embeds=prompt_embeds,
-                pooled_prompt_embeds=pooled_prompt_embeds,
-                negative_prompt_embeds=prompt_neg_embeds,
-                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-                num_inference_steps=image_params["num_steps"],
-                height=height,
-                width=width,
-                num_images_per_prompt=1,
-                generator=gen,
-                denoising_start=image_params["refiner_point"] / 100,
-                image=image
-              ).images[0]
-            else:
-              image = sdxl_pipe(
-                prompt_embeds=prompt_embeds,
-                pooled_prompt_embeds=pooled_prompt_embeds,
-                negative_prompt_embeds=prompt_neg_embeds,
-                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-                num_inference_steps=image_params["num_steps"],
-                height=height,
-                width=width,
-                num_images_per_prompt=1,
-                generator=gen
-              ).images[0]
-          else:
-            init_image = Image.open(target["image_path"]).convert("RGB")
-            target_size = (width, height)
-            init_image = init_image.resize(target_size, resample=Image.LANCZOS)
+          if target["image_path"] is not None:
             image_params["reference_image_path"] = target["image_path"]
 
-            if refiner_sdxl_pipe:
-              image = sdxl_pipe(
-                prompt_embeds=prompt_embeds,
-                pooled_prompt_embeds=pooled_prompt_embeds,
-                negative_prompt_embeds=prompt_neg_embeds,
-                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-                image=init_image,
-                strength=image_params["input_image_strength"] / 100,
-                num_inference_steps=image_params["num_steps"],
-                height=height,
-                width=width,
-                num_images_per_prompt=1,
-                denoising_end=image_params["refiner_point"] / 100,
-                generator=gen,
-                output_type="latent"
-              ).images
-              image = refiner_sdxl_pipe(
-                prompt_embeds=prompt_embeds,
-                pooled_prompt_embeds=pooled_prompt_embeds,
-                negative_prompt_embeds=prompt_neg_embeds,
-                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-                strength=image_params["input_image_strength"] / 100,
-                num_inference_steps=image_params["num_steps"],
-                height=height,
-                width=width,
-                num_images_per_prompt=1,
-                generator=gen,
-                denoising_start=image_params["refiner_point"] / 100,
-                image=image
-              ).images[0]
-            else:  
-              image = sdxl_pipe(
-                prompt_embeds=prompt_embeds,
-                pooled_prompt_embeds=pooled_prompt_embeds,
-                negative_prompt_embeds=prompt_neg_embeds,
-                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-                image=init_image,
-                strength=image_params["input_image_strength"] / 100,
-                num_inference_steps=image_params["num_steps"],
-                height=height,
-                width=width,
-                num_images_per_prompt=1,
-                generator=gen
-              ).images[0]
-
-          path = get_image_save_path(
-            image_params["output_folder_path"],
-            image_params["output_image_prefix"],
-            image_params["output_image_suffix"]
+          image_params["width"] = width
+          image_params["height"] = height
+          path = output_path(
+            params["output_folder_path"],
+            params["output_image_prefix"],
+            params["output_image_suffix"],
+            generation_id(with_file_keys(image_params), SDXL_OUTPUT_KEYS),
+            ".png"
           )
-          image.save(path, format="PNG")
-          saved_files.append(path)
 
-          image_params["saved_image"] = path
-          image_params["timestamp"] = get_timestamp()
-
-          # save JSON metadata next to image with same base name but .json
-          json_path = os.path.splitext(path)[0] + ".json"
-          with open(json_path, "w", encoding="utf-8") as jf:
-            json.dump(image_params, jf, ensure_ascii=False, indent=2)
-
-          gc.collect()
-          torch.cuda.empty_cache()
-          torch.cuda.ipc_collect()
-
-    return jsonify({"saved_files": saved_files}), 200
+          # identical parameters give the same image, so it is only generated once
+          if path in planned_paths or (params["skip_existing"] and existing_output(path)):
+            log(f"Skipping, already generated: {path}")
+            if path not in planned_paths:
+              planned_paths.add(path)
+              saved_files.append(path)
+            done += 1
+            emit("progress", done=done, total=total())
+            continue
+          planned_paths.add(path)
+
+          batch_key = (width, height, target["image_path"] is not None, embeds[0].shape[1])
+          pending_batches.setdefault(batch_key, []).append({
+            "params": image_params,
+            "path": path,
+            "embeds": embeds,
+            "image_path": target["image_path"],
+            "width": width,
+            "height": height
+          })
+
+          limit = batch_size or sdxl_util.auto_batch_size(width, height)
+          if len(pending_batches[batch_key]) >= limit:
+            run_batch(batch_key)
+
+    for batch_key in list(pending_batches):
+      run_batch(batch_key)
+
+    return with_write_errors({"saved_files": saved_files}, writer.wait())
 
   finally:
+    writer.close()
     gc.collect()
     torch.cuda.empty_cache()
     torch.cuda.ipc_collect()
+
+def parse_batch_size(value):
+  """Return the requested batch size, or None for "auto"."""
+  if value == "auto":
+    return None
+  try:
+    batch_size = int(value)
+  except (TypeError, ValueError):
+    raise BadRequest("batch_size must be a positive integer or \"auto\"")
+  within_range_inclusive("batch_size", batch_size, 1, 64)
+  return batch_size
+
+def generate_sdxl_images(sdxl_pipe, refiner_sdxl_pipe, items):
+  """
+  Generate one image per item with a single pipeline call.
+  Items must share width, height, mode and prompt length. Each item keeps its own
+  seeded generator, so every image matches what generating it alone would produce.
+  """
+  first = items[0]
+  image_params = first["params"]
+
+  prompt_embeds, prompt_neg_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds = [
+    torch.cat([item["embeds"][i] for item in items]) for i in range(4)
+  ]
+  generators = [torch.Generator(device="cuda").manual_seed(item["params"]["seed"]) for item in items]
+
+  call_kwargs = dict(
+    prompt_embeds=prompt_embeds,
+    pooled_prompt_embeds=pooled_prompt_embeds,
+    negative_prompt_embeds=prompt_neg_embeds,
+    negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+    num_inference_steps=image_params["num_steps"],
+    height=first["height"],
+    width=first["width"],
+    num_images_per_prompt=1,
+    generator=generators if len(items) > 1 else generators[0]
+  )
+
+  if first["image_path"] is not None:
+    init_images = [
+      Image.open(item["image_path"]).convert("RGB").resize((item["width"], item["height"]), resample=Image.LANCZOS)
+      for item in items
+    ]
+    call_kwargs["image"] = init_images if len(items) > 1 else init_images[0]
+    call_kwargs["strength"] = image_params["input_image_strength"] / 100
+
+  if not refiner_sdxl_pipe:
+    with pipeline_timer() as timer:
+      return sdxl_pipe(**call_kwargs, callback_on_step_end=step_callback(timer, stage="base")).images
+
+  with pipeline_timer(decoded=False) as timer:
+    latents = sdxl_pipe(
+      **call_kwargs,
+      denoising_end=image_params["refiner_point"] / 100,
+      output_type="latent",
+      callback_on_step_end=step_callback(timer, stage="base")
+    ).images
+
+  with pipeline_timer() as timer:
+    return refiner_sdxl_pipe(
+      **{**call_kwargs, "image": latents},
+      denoising_start=image_params["refiner_point"] / 100,
+      callback_on_step_end=step_callback(timer, stage="refiner")
+    ).images
+
+def save_sdxl_image(writer, image, image_params, path):
+  """Queue the image and its JSON metadata for writing and return the image path."""
+  image_params["saved_image"] = path
+  image_params["timestamp"] = get_timestamp()
+
+  # JSON metadata is saved next to the image with same base name but .json
+  writer.submit(path, write_with_sidecar, write_image, image, path, image_params)
+
+  return path
+
+def sdxl_pipeline_key(payload):
+  """Pipeline a /api/sdxl job needs, used by the job scheduler to group jobs."""
+  return "|".join([
+    sdxl_cache_key(
+      normalize_path(payload.get("checkpoint_file_path", None)),
+      normalize_path(payload.get("refiner_checkpoint_file_path", None))
+    ),
+    lora_cache_key(normalize_loras(payload.get("loras", []), 70))
+  ])
+
+register_job("sdxl", execute_sdxl, pipeline_key=sdxl_pipeline_key)
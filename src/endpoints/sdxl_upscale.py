@@ -2,24 +2,46 @@
 
 from flask import Blueprint, request, jsonify
 from PIL import Image
-from sd_embed.embedding_funcs import get_weighted_text_embeddings_sdxl
-from src.utils.endpoint_util import required_param, within_range_inclusive, normalize_path
-from src.utils.file_util import get_image_paths, get_image_save_path, get_timestamp, get_json_value
-from src.utils.sdxl_util import get_sdxl_pipe, normalize_loras
-from src.utils.cache_util import cache_set, cache_get
+from src.utils.endpoint_util import required_param, within_range_inclusive, divisible_by_x, normalize_path
+from src.utils.output_store_util import generation_id, existing_output, with_file_keys
+from src.utils.input_util import get_input_paths, prefetch
+from src.utils.metadata_util import get_output_metadata
 from src.utils.logger import log
+from src.utils.lazy_util import lazy_import
+from src.utils.model_key_util import sdxl_cache_key, normalize_loras, lora_cache_key
+from src.utils.job_util import register_job, run_job, submit_job
+from src.utils.progress_util import emit, step_callback
+from src.utils.metrics_util import pipeline_timer
+from src.utils.stream_util import stream_job
+from src.utils.tile_util import upscale_tiled
+from src.utils.output_util import OutputWriter, write_image, write_with_index, with_write_errors
 import json
 import os
-import torch
-import time
 import gc
 
+# loaded on first use, see lazy_util
+sdxl_util = lazy_import("src.utils.sdxl_util")
+torch = lazy_import("torch")
+
 sdxl_upscale_bp = Blueprint("sdxl_upscale", __name__, url_prefix="/api")
 
+# parameters that decide the upscaled image, hashed into its file name with the source image and prompts
+UPSCALE_OUTPUT_KEYS = ["checkpoint_file_path", "loras", "num_steps", "input_image_strength", "scale", "tile_size", "tile_overlap"]
+
 @sdxl_upscale_bp.route("/sdxl/upscale", methods=["POST"])
 def sdxl_upscale():
   payload = request.get_json() or {}
 
+  if payload.get("async"):
+    return jsonify(submit_job("sdxl_upscale", payload)), 202
+
+  return jsonify(run_job("sdxl_upscale", payload)), 200
+
+@sdxl_upscale_bp.route("/sdxl/upscale/stream", methods=["POST"])
+def sdxl_upscale_stream():
+  return stream_job("sdxl_upscale", request.get_json() or {})
+
+def execute_sdxl_upscale(payload):
   params = {
     "checkpoint_file_path": normalize_path(payload.get("checkpoint_file_path", None)),
     "loras": normalize_loras(payload.get("loras", []), 70),
@@ -34,7 +56,12 @@ def sdxl_upscale():
     "num_steps": int(payload.get("num_steps", 30)),
     "input_image_strength": int(payload.get("input_image_strength", 51)),
     "scale": payload.get("scale", 1.5),
-    "force_upscale": payload.get("force_upscale", False)
+    "force_upscale": payload.get("force_upscale", False),
+    "prefetch_inputs": payload.get("prefetch_inputs", False),
+    "tile_size": payload.get("tile_size", None),
+    "tile_overlap": int(payload.get("tile_overlap", 128)),
+    "tile_batch_size": int(payload.get("tile_batch_size", 1)),
+    "skip_existing": payload.get("skip_existing", False)
   }
 
   required_param("checkpoint_file_path", params["checkpoint_file_path"])
@@ -42,40 +69,53 @@ def sdxl_upscale():
 
   within_range_inclusive("input_image_strength", params["input_image_strength"], 1, 100)
 
-  image_paths = get_image_paths(params["upscale_path"])
+  if params["tile_size"] is not None:
+    params["tile_size"] = int(params["tile_size"])
+    divisible_by_x("tile_size", params["tile_size"], 8)
+    within_range_inclusive("tile_size", params["tile_size"], 256, 2048)
+    within_range_inclusive("tile_overlap", params["tile_overlap"], 0, params["tile_size"] // 2)
+    within_range_inclusive("tile_batch_size", params["tile_batch_size"], 1, 16)
+
+  # input images are discovered lazily so upscaling starts while large folders are still being scanned
+  image_paths = get_input_paths(params["upscale_path"], payload)
   saved_files = []
 
   if not image_paths:
-    return jsonify({"saved_files": saved_files}), 200
+    return {"saved_files": saved_files}
+
+  writer = OutputWriter()
 
   try:
-    generation_targets = []
-    for img_path in image_paths:
-      generation_targets.append({"image_path": img_path})
+    needs_metadata = not (params["prompt"] and params["negative_prompt"])
+
+    def load_target(path):
+      # one index lookup per image for whatever the request doesn't provide
+      return {"image_path": path, "source": get_output_metadata(path) if needs_metadata else {}}
 
-    log(f"Number of SDXL UPSCALE prompts to execute: {len(generation_targets)}")
+    if params["prefetch_inputs"]:
+      generation_targets = (target for _, target in prefetch(image_paths, load_target))
+    else:
+      generation_targets = (load_target(path) for path in image_paths)
 
-    cache_key = "SDXL UPSCALE" + params["checkpoint_file_path"] + ",".join(f"{lora["path"]}-{lora["strength"]}" for lora in params["loras"])
-    sdxl_pipe = cache_get(cache_key)
-    if sdxl_pipe is None:
-      sdxl_pipe, refiner_pipe = get_sdxl_pipe(params["checkpoint_file_path"], None, params["loras"], "upscale")
-      cache_set(cache_key, sdxl_pipe)
+    sdxl_pipe, refiner_pipe = sdxl_util.get_cached_sdxl_pipe(params["checkpoint_file_path"], None, params["loras"], True)
+    encoder_key = sdxl_util.sdxl_text_encoder_key(params["checkpoint_file_path"], params["loras"])
 
     for ti, target in enumerate(generation_targets):
-      log(f"SDXL UPSCALE prompt {ti + 1} / {len(generation_targets)}: {target["image_path"]}")
+      # the total is unknown until the input scan has finished
+      count = image_paths.known_count()
+      log(f"SDXL UPSCALE prompt {ti + 1} / {count or '?'}: {target['image_path']}")
+      source = target["source"]
 
-      for _ in range(params["num_images"]):
-        if not target["image_path"].lower().endswith(".png"):
-          continue
+      for i in range(params["num_images"]):
+        emit("progress", done=ti * params["num_images"] + i, total=count * params["num_images"] if count else None)
 
         lower = target["image_path"].lower()
         if "_upscale" in lower and not params["force_upscale"]:
           log("Skipping already upscaled image")
           continue
 
-        prompt = params["prompt"]
-        if not prompt:
-          prompt = get_json_value(os.path.splitext(target["image_path"])[0], "prompt")
+        prompt = params["prompt"] or source.get("prompt")
+        source_prompt = prompt
 
         # if still no prompt, skip this image
         if not prompt:
@@ -88,9 +128,8 @@ def sdxl_upscale():
         if params["prompt_suffix"]:
           prompt = prompt + params["prompt_suffix"]
 
-        negative_prompt = params["negative_prompt"]
-        if not negative_prompt:
-          negative_prompt = get_json_value(os.path.splitext(target["image_path"])[0], "negative_prompt")
+        negative_prompt = params["negative_prompt"] or source.get("negative_prompt")
+        source_negative_prompt = negative_prompt
 
         if params["negative_prompt_prefix"]:
           negative_prompt = params["negative_prompt_prefix"] + negative_prompt
@@ -98,43 +137,104 @@ def sdxl_upscale():
         if params["negative_prompt_suffix"]:
           negative_prompt = negative_prompt + params["negative_prompt_suffix"]
 
-        prompt_embeds, prompt_neg_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds = get_weighted_text_embeddings_sdxl(
+        base, _ = os.path.splitext(target["image_path"])
+        gen_id = generation_id({
+          **with_file_keys({k: params[k] for k in UPSCALE_OUTPUT_KEYS}),
+          "source": [os.path.abspath(target["image_path"]), os.path.getmtime(target["image_path"])],
+          "prompt": prompt,
+          "negative_prompt": negative_prompt,
+          "image_index": i
+        })
+        out_path = f"{base}_upscaled_{gen_id}.png"
+
+        if params["skip_existing"] and existing_output(out_path):
+          log(f"Skipping, already upscaled: {out_path}")
+          saved_files.append(out_path)
+          continue
+
+        prompt_embeds, prompt_neg_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds = sdxl_util.get_sdxl_prompt_embeds(
           sdxl_pipe,
-          prompt = prompt,
-          neg_prompt = negative_prompt
+          encoder_key,
+          prompt,
+          negative_prompt
         )
 
-        base, _ = os.path.splitext(target["image_path"])
-        ts = str(int(time.time()))
-        out_path = f"{base}_upscaled_{ts}.png"
-
         img = Image.open(target["image_path"]).convert("RGB")
         orig_w, orig_h = img.size
         new_w, new_h = int(orig_w * params["scale"]), int(orig_h * params["scale"])
-        big_img = img.resize((new_w, new_h), resample=Image.LANCZOS)
-
-        output = sdxl_pipe(
-          prompt_embeds=prompt_embeds,
-          pooled_prompt_embeds=pooled_prompt_embeds,
-          negative_prompt_embeds=prompt_neg_embeds,
-          negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
-          image=big_img,
-          num_inference_steps=(params["num_steps"]),
-          original_size=(orig_h, orig_w),
-          target_size=(new_h, new_w),
-          num_images_per_prompt=1,
-          strength=params["input_image_strength"] / 100,
-        )
-        image = output.images[0]
-        image.save(out_path)
+
+        if params["tile_size"]:
+          # tiles need sizes divisible by 8; memory is bounded by the tile size, not the output size
+          new_w, new_h = new_w - (new_w % 8), new_h - (new_h % 8)
+          big_img = img.resize((new_w, new_h), resample=Image.LANCZOS)
+
+          def process_tiles(tiles):
+            n = len(tiles)
+            with pipeline_timer() as timer:
+              return sdxl_pipe(
+                prompt_embeds=prompt_embeds.repeat(n, 1, 1),
+                pooled_prompt_embeds=pooled_prompt_embeds.repeat(n, 1),
+                negative_prompt_embeds=prompt_neg_embeds.repeat(n, 1, 1),
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds.repeat(n, 1),
+                image=tiles,
+                num_inference_steps=(params["num_steps"]),
+                num_images_per_prompt=1,
+                strength=params["input_image_strength"] / 100,
+                callback_on_step_end=step_callback(timer)
+              ).images
+
+          image = upscale_tiled(
+            big_img,
+            process_tiles,
+            params["tile_size"],
+            params["tile_overlap"],
+            batch_size=params["tile_batch_size"],
+            on_tile=lambda done, total: emit("tile", done=done, total=total)
+          )
+        else:
+          big_img = img.resize((new_w, new_h), resample=Image.LANCZOS)
+
+          with pipeline_timer() as timer:
+            output = sdxl_pipe(
+              prompt_embeds=prompt_embeds,
+              pooled_prompt_embeds=pooled_prompt_embeds,
+              negative_prompt_embeds=prompt_neg_embeds,
+              negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+              image=big_img,
+              num_inference_steps=(params["num_steps"]),
+              original_size=(orig_h, orig_w),
+              target_size=(new_h, new_w),
+              num_images_per_prompt=1,
+              strength=params["input_image_strength"] / 100,
+              callback_on_step_end=step_callback(timer)
+            )
+          image = output.images[0]
+        writer.submit(out_path, write_with_index, write_image, image, out_path, {
+          "prompt": source_prompt,
+          "negative_prompt": source_negative_prompt,
+          "width": new_w,
+          "height": new_h,
+          "model": params["checkpoint_file_path"],
+          "parent": target["image_path"]
+        })
         saved_files.append(out_path)
 
         gc.collect()
         torch.cuda.empty_cache()
         torch.cuda.ipc_collect()
 
-    return jsonify({"saved_files": saved_files}), 200
+    return with_write_errors({"saved_files": saved_files}, writer.wait())
   finally:
+    writer.close()
     gc.collect()
     torch.cuda.empty_cache()
     torch.cuda.ipc_collect()
+
+def sdxl_upscale_pipeline_key(payload):
+  """Pipeline a /api/sdxl/upscale job needs, used by the job scheduler to group jobs."""
+  return "|".join([
+    sdxl_cache_key(normalize_path(payload.get("checkpoint_file_path", None)), None),
+    lora_cache_key(normalize_loras(payload.get("loras", []), 70))
+  ])
+
+register_job("sdxl_upscale", execute_sdxl_upscale, pipeline_key=sdxl_upscale_pipeline_key)
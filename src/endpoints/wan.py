@@ -1,39 +1,85 @@
-from diffusers.utils import export_to_video, load_image
 from flask import Blueprint, request, jsonify
+from werkzeug.exceptions import BadRequest
 from src.utils.endpoint_util import required_param, divisible_by_x_minus_one, divisible_by_x, create_seed, normalize_path
-from src.utils.file_util import get_image_paths, get_video_save_path, get_timestamp, get_json_value, concatenate_mp4s
-from src.utils.wan_util import get_wan_pipe, load_loras
-from src.utils.sdxl_util import normalize_loras
-from src.utils.image_util import compute_dimensions_from_image
-from src.utils.cache_util import cache_set, cache_get
+from src.utils.file_util import get_timestamp, concatenate_mp4s, read_last_frame
+from src.utils.output_store_util import generation_id, output_path, existing_output, with_file_keys
+from src.utils.input_util import get_input_paths, LazyPaths, prefetch
+from src.utils.metadata_util import get_output_metadata
+from src.utils.image_util import compute_dimensions_from_image, compute_dimensions
 from src.utils.logger import log
+from src.utils.lazy_util import lazy_import
+from src.utils.model_key_util import wan_cache_key, normalize_loras, lora_cache_key
 from src.utils.prompt_util import prompt_contains_any
+from src.utils.job_util import register_job, run_job, submit_job
+from src.utils.progress_util import emit, step_callback
+from src.utils.metrics_util import pipeline_timer
+from src.utils.stream_util import stream_job
+from src.utils.output_util import OutputWriter, write_image, write_video, write_with_sidecar, with_write_errors
 import gc
-import json
 import os
 import re
-import torch
+import time
 from PIL import Image
-import cv2
 import random
 
+# loaded on first use, see lazy_util
+diffusers_utils = lazy_import("diffusers.utils")
+wan_util = lazy_import("src.utils.wan_util")
+torch = lazy_import("torch")
+
 wan_bp = Blueprint("wan", __name__, url_prefix="/api")
 
+# parameters that decide the generated video, hashed into its file name
+WAN_OUTPUT_KEYS = [
+  "gguf_path", "loras", "prompt", "negative_prompt", "seed", "width", "height",
+  "num_frames", "num_steps", "guidance_scale", "fps", "image_key"
+]
+
 @wan_bp.route("/wan", methods=["POST"])
 def wan():
   payload = request.get_json() or {}
-  saved_files, pipeline = execute_wan(payload)
 
-  return jsonify({ "saved_files": saved_files }), 200
+  if payload.get("async"):
+    return jsonify(submit_job("wan", payload)), 202
+
+  return jsonify(run_job("wan", payload)), 200
+
+@wan_bp.route("/wan/stream", methods=["POST"])
+def wan_stream():
+  return stream_job("wan", request.get_json() or {})
 
 @wan_bp.route("/wan/segments", methods=["POST"])
 def wan_segments():
   payload = request.get_json() or {}
+
+  if payload.get("async"):
+    return jsonify(submit_job("wan_segments", payload)), 202
+
+  return jsonify(run_job("wan_segments", payload)), 200
+
+@wan_bp.route("/wan/segments/stream", methods=["POST"])
+def wan_segments_stream():
+  return stream_job("wan_segments", request.get_json() or {})
+
+def execute_wan_videos(payload):
+  saved_files, write_errors, _ = execute_wan(payload)
+
+  return with_write_errors({"saved_files": saved_files}, write_errors)
+
+def execute_wan_segments(payload):
   segments = payload.get("segments", [])
+  concat_method = payload.get("concat_method", "auto")
+  if concat_method not in ("auto", "copy", "reencode"):
+    raise BadRequest("concat_method must be one of auto, copy, reencode")
+
+  save_last_frame = bool(payload.get("save_last_frame", False))
 
   base_params = None
   all_files = []
-  pipeline = None
+  write_errors = []
+  response = {}
+  last_frame = None
+  last_video = None
 
   for i, segment in enumerate(segments):
     if i == 0:
@@ -45,64 +91,55 @@ def wan_segments():
         merged["input_image_path"] = None
       segment = merged
 
-    if all_files and segment.get("input_image_path") is None:
-      prev = all_files[-1]
-      if prev.lower().endswith(".mp4") and os.path.exists(prev):
-        # create output image path next to video
-        base, _ = os.path.splitext(prev)
-        img_path = f"{base}_lastframe.png"
-
-        cap = cv2.VideoCapture(prev)
-        # seek to last frame
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if frame_count <= 0:
-          # fallback: read until end
-          frame = None
-          while True:
-            ret, frame = cap.read()
-            if not ret:
-              break
-          if frame is None:
-            cap.release()
-            raise RuntimeError(f"No frames found in {prev}")
-        else:
-          # set to last frame index (frame_count - 1)
-          cap.set(cv2.CAP_PROP_POS_FRAMES, max(frame_count - 1, 0))
-          ret, frame = cap.read()
-          if not ret or frame is None:
-            # fallback: try one before last
-            cap.set(cv2.CAP_PROP_POS_FRAMES, max(frame_count - 2, 0))
-            ret, frame = cap.read()
-            if not ret:
-              cap.release()
-              raise RuntimeError(f"Failed to read last frame from {prev}")
-        # write image as PNG
-        cv2.imwrite(img_path, frame)
-        cap.release()
-
-        segment["input_image_path"] = img_path
-
-    segment["pipeline"] = pipeline
+    if last_frame is not None and segment.get("input_image_path") is None:
+      # the next segment starts from the previous segment's final frame, straight from memory
+      segment["input_image"] = last_frame
+      segment["input_image_source"] = last_video
+      if save_last_frame:
+        img_path = f"{os.path.splitext(last_video)[0]}_lastframe.png"
+        write_image(last_frame, img_path)
+        segment["input_image_source"] = img_path
+
     segment["segment_index"] = i
+    emit("segment", index=i, total=len(segments))
 
-    saved_files, pipeline = execute_wan(segment)
+    saved_files, segment_write_errors, segment_last_frame = execute_wan(segment, want_last_frame=True)
+    write_errors.extend(segment_write_errors)
+    if segment_last_frame is not None:
+      last_frame, last_video = segment_last_frame
 
     if saved_files:
       all_files.extend(saved_files)
 
   mp4s = [f for f in all_files if f.lower().endswith(".mp4")]
   if len(mp4s) > 1:
-    combined_file_path = get_video_save_path(
-      segments[0].get("output_folder_path"),
-      segments[0].get("output_video_prefix"),
-      segments[0].get("output_video_suffix")
+    combined_file_path = output_path(
+      normalize_path(segments[0].get("output_folder_path", "output")),
+      str(segments[0].get("output_video_prefix", "")),
+      str(segments[0].get("output_video_suffix", "")),
+      generation_id({"segments": [os.path.abspath(f) for f in mp4s]}),
+      ".mp4"
     )
-    concat_output_path = concatenate_mp4s(mp4s, combined_file_path)
-    all_files.extend(concat_output_path)
-
-  return jsonify({"all_files": all_files}), 200
-
-def execute_wan(payload):
+    if payload.get("skip_existing") and existing_output(combined_file_path):
+      log(f"Skipping concat, already combined: {combined_file_path}")
+      all_files.append(combined_file_path)
+    else:
+      start = time.perf_counter()
+      concat_output_path, used_method = concatenate_mp4s(mp4s, combined_file_path, method=concat_method)
+      seconds = round(time.perf_counter() - start, 3)
+      log(f"Concatenated {len(mp4s)} segments with {used_method} in {seconds}s")
+      emit("file", path=concat_output_path)
+      all_files.append(concat_output_path)
+      response["concat"] = {"path": concat_output_path, "method": used_method, "seconds": seconds}
+
+  return with_write_errors({"all_files": all_files, **response}, write_errors)
+
+def execute_wan(payload, want_last_frame=False):
+  """
+  Generate the requested videos. Returns (saved files, write errors, last frame), where the
+  last frame is (PIL image, video path) of the final video with `want_last_frame`, or None.
+  `payload["input_image"]` may hold an in-memory PIL image to start from instead of input files.
+  """
   params = {
     "gguf_path": payload.get("gguf_path", None),
     "loras": normalize_loras(payload.get("loras", []), 70),
@@ -126,7 +163,9 @@ def execute_wan(payload):
     "input_image_path": payload.get("input_image_path"),
     "shuffle_input_images": payload.get("shuffle_input_images", False),
     "segment_index": payload.get("segment_index", -1),
-    "only_include_prompts_with_keywords": payload.get("only_include_prompts_with_keywords")
+    "only_include_prompts_with_keywords": payload.get("only_include_prompts_with_keywords"),
+    "prefetch_inputs": payload.get("prefetch_inputs", False),
+    "skip_existing": payload.get("skip_existing", False)
   }
 
   required_param("gguf_path", params["gguf_path"])
@@ -141,47 +180,62 @@ def execute_wan(payload):
     divisible_by_x("width", int(params["width"]), 16)
     params["width"] = int(params["width"])
 
-  image_paths = get_image_paths(params["input_image_path"])
+  # input images are discovered lazily so generation starts while large folders are still being scanned
+  image_paths = get_input_paths(params["input_image_path"], payload)
+  input_image = payload.get("input_image")
   if image_paths and (params["shuffle_input_images"]):
-    random.shuffle(image_paths)
+    # shuffling needs the whole list
+    shuffled = list(image_paths)
+    random.shuffle(shuffled)
+    image_paths = LazyPaths(shuffled)
 
   saved_files = []
+  # (final frame, path) of the latest video, for segments to continue from; the frame is
+  # None for a skipped video until it is decoded from disk at the end
+  last_frame = None
+  # decoded videos are large, so only keep a couple waiting to be encoded
+  writer = OutputWriter(max_pending=2)
 
   try:
-    pipeline = None
-    if payload.get("pipeline"):
-      pipeline = payload.get("pipeline")
-      load_loras(pipeline, params["loras"], params["segment_index"])
+    pipeline = wan_util.get_cached_wan_pipe(params["gguf_path"], params["loras"], bool(image_paths) or input_image is not None)
+
+    needs_metadata = not (params["prompt"] and params["negative_prompt"])
+    needs_dimensions = params["width"] is None or params["height"] is None
+
+    def load_target(path):
+      # everything read from an input image is read once and reused for all num_videos
+      return {
+        "image_path": path,
+        "image": diffusers_utils.load_image(path),
+        "source": get_output_metadata(path) if needs_metadata else {},
+        "dimensions": compute_dimensions_from_image(path, max_dim=720) if needs_dimensions else (None, None)
+      }
+
+    if input_image is not None:
+      generation_targets = [{
+        "image_path": None,
+        "image": input_image,
+        "source": {},
+        "dimensions": compute_dimensions(*input_image.size, max_dim=720)
+      }]
+    elif not image_paths:
+      generation_targets = [{"image_path": None, "image": None, "source": {}, "dimensions": (None, None)}]
+    elif params["prefetch_inputs"]:
+      generation_targets = (target for _, target in prefetch(image_paths, load_target))
     else:
-      cache_key = "WAN" + ",".join(f"{lora["path"]}-{lora["strength"]}" for lora in params["loras"]) + str(bool(image_paths))
-      pipeline = cache_get(cache_key)
-      if pipeline is None:
-        pipeline = get_wan_pipe(
-          params["gguf_path"],
-          params["loras"],
-          bool(image_paths),
-          params["segment_index"]
-        )
-        cache_set(cache_key, pipeline)
-
-    generation_targets = []
-    if image_paths:
-      for img_path in image_paths:
-        generation_targets.append({"image_path": img_path})
-    else:
-      generation_targets.append({"image_path": None})
-
-    log(f"Number of WAN prompts to execute: {len(generation_targets)}")
+      generation_targets = (load_target(path) for path in image_paths)
 
     for ti, target in enumerate(generation_targets):
-      log(f"Starting generation {ti + 1}/{len(generation_targets)}: ")
+      # the total is unknown until the input scan has finished
+      count = image_paths.known_count() if image_paths and input_image is None else 1
+      log(f"Starting generation {ti + 1}/{count or '?'}: ")
+      source = target["source"]
 
-      for _ in range(params["num_videos"]):
-        # determine prompt: use request prompt if provided, otherwise look for same-name .json with prompt field
-        prompt = params["prompt"]
-        if not prompt and target["image_path"]:
-          base = os.path.splitext(target["image_path"])[0]
-          prompt = get_json_value(base, "prompt")
+      for i in range(params["num_videos"]):
+        emit("progress", done=ti * params["num_videos"] + i, total=count * params["num_videos"] if count else None)
+
+        # determine prompt: use request prompt if provided, otherwise the prompt the input image was generated with
+        prompt = params["prompt"] or source.get("prompt")
 
         if not prompt and not params["prompt"]:
           log("No prompt found, skipping")
@@ -200,10 +254,7 @@ def execute_wan(payload):
 
         log(f"prompt: {prompt}")
 
-        negative_prompt = params["negative_prompt"]
-        if not negative_prompt and target["image_path"]:
-          base = os.path.splitext(target["image_path"])[0]
-          negative_prompt = get_json_value(base, "negative_prompt")
+        negative_prompt = params["negative_prompt"] or source.get("negative_prompt")
 
         if params["negative_prompt_prefix"]:
           negative_prompt = params["negative_prompt_prefix"] + negative_prompt
@@ -214,8 +265,8 @@ def execute_wan(payload):
         # compute per-target width/height if not provided
         width = params["width"]
         height = params["height"]
-        if target["image_path"] and (width is None or height is None):
-          img_w, img_h = compute_dimensions_from_image(target["image_path"], max_dim=720)
+        if target["image"] is not None and (width is None or height is None):
+          img_w, img_h = target["dimensions"]
           if img_w and img_h:
             # use image dims for whichever missing, otherwise keep provided
             if width is None:
@@ -241,16 +292,42 @@ def execute_wan(payload):
           "width": width,
           "height": height
         }
+        image_arg = target["image"]
+        image_key = None
+        if image_arg is not None:
+          video_params["image"] = target["image_path"] or payload.get("input_image_source")
+          image_key = wan_util.image_file_key(target["image_path"]) if target["image_path"] else wan_util.image_content_key(image_arg)
+
+        path = output_path(
+          video_params["output_folder_path"],
+          video_params["output_video_prefix"],
+          video_params["output_video_suffix"],
+          generation_id(with_file_keys({**video_params, "image_key": image_key}), WAN_OUTPUT_KEYS),
+          ".mp4"
+        )
+
+        # identical parameters give the same video, so it is only generated once
+        if path in saved_files or (params["skip_existing"] and existing_output(path)):
+          log(f"Skipping, already generated: {path}")
+          if last_frame is None or last_frame[1] != path:
+            last_frame = (None, path)
+          if path not in saved_files:
+            saved_files.append(path)
+          continue
+
         gen = torch.Generator(device="cuda").manual_seed(video_params["seed"])
 
-        image_arg = None
-        if target["image_path"]:
-          image_arg = load_image(target["image_path"])
-          video_params["image"] = target["image_path"]
+        # text and image embeds are reused across num_videos and segments sharing a prompt
+        prompt_embeds, negative_prompt_embeds = wan_util.get_wan_prompt_embeds(
+          pipeline,
+          video_params["prompt"],
+          video_params["negative_prompt"],
+          video_params["guidance_scale"] > 1
+        )
 
         call_kwargs = dict(
-          prompt=video_params["prompt"],
-          negative_prompt=video_params["negative_prompt"],
+          prompt_embeds=prompt_embeds,
+          negative_prompt_embeds=negative_prompt_embeds,
           height=video_params["height"],
           width=video_params["width"],
           num_frames=video_params["num_frames"],
@@ -261,31 +338,53 @@ def execute_wan(payload):
 
         if image_arg is not None:
           call_kwargs["image"] = image_arg
-        output = pipeline(**call_kwargs).frames[0]
+          image_embeds = wan_util.get_wan_image_embeds(pipeline, image_key, image_arg)
+          if image_embeds is not None:
+            call_kwargs["image_embeds"] = image_embeds
+
+        with pipeline_timer() as timer:
+          output = pipeline(**call_kwargs, callback_on_step_end=step_callback(timer)).frames[0]
 
-        path = get_video_save_path(
-          video_params["output_folder_path"],
-          video_params["output_video_prefix"],
-          video_params["output_video_suffix"]
-        )
-        export_to_video(output, path, fps=video_params["fps"])
         saved_files.append(path)
+        last_frame = (wan_util.last_frame_image(output) if want_last_frame else None, path)
 
         video_params["saved_video"] = path
         video_params["timestamp"] = get_timestamp()
 
-        # save JSON metadata next to video with same base name but .json
-        json_path_out = os.path.splitext(path)[0] + ".json"
-        with open(json_path_out, "w", encoding="utf-8") as jf:
-          json.dump(video_params, jf, ensure_ascii=False, indent=2)
+        # video is encoded in the background; JSON metadata is saved next to it with same base name but .json
+        writer.submit(path, write_with_sidecar, write_video, output, path, video_params, video_params["fps"])
 
         gc.collect()
         torch.cuda.empty_cache()
         torch.cuda.ipc_collect()
 
-    return saved_files, pipeline
+    write_errors = writer.wait()
+    failed = {e["path"] for e in write_errors}
+
+    if not want_last_frame:
+      last_frame = None
+    elif last_frame is not None and last_frame[0] is None:
+      # the final video was skipped, so it is only on disk (and fully written by now)
+      last_frame = (read_last_frame(last_frame[1]), last_frame[1]) if last_frame[1] not in failed else None
+
+    return [f for f in saved_files if f not in failed], write_errors, last_frame
 
   finally:
+    writer.close()
     gc.collect()
     torch.cuda.empty_cache()
     torch.cuda.ipc_collect()
+
+def wan_pipeline_key(payload):
+  """Pipeline a /api/wan job needs, used by the job scheduler to group jobs."""
+  return "|".join([
+    wan_cache_key(payload.get("gguf_path", None), bool(payload.get("input_image_path"))),
+    lora_cache_key(normalize_loras(payload.get("loras", []), 70))
+  ])
+
+def wan_segments_pipeline_key(payload):
+  segments = payload.get("segments", [])
+  return wan_pipeline_key(segments[0]) if segments else None
+
+register_job("wan", execute_wan_videos, pipeline_key=wan_pipeline_key)
+register_job("wan_segments", execute_wan_segments, pipeline_key=wan_segments_pipeline_key)
@@ -0,0 +1,54 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+def measure(endpoints):
+  """
+  Create the app in a fresh interpreter with `-X importtime` and the given AAPI_ENDPOINTS.
+  Returns (seconds to create the app, rows of (self_us, cumulative_us, module)).
+  """
+  env = {**os.environ, "AAPI_ENDPOINTS": endpoints}
+  start = time.perf_counter()
+  result = subprocess.run(
+    [sys.executable, "-X", "importtime", "-c", "from src.init import create_app; create_app()"],
+    env=env,
+    capture_output=True,
+    text=True
+  )
+  seconds = time.perf_counter() - start
+  if result.returncode != 0:
+    raise RuntimeError(f"Creating the app with AAPI_ENDPOINTS={endpoints} failed:\n{result.stderr[-2000:]}")
+
+  rows = []
+  for line in result.stderr.splitlines():
+    if not line.startswith("import time:"):
+      continue
+    parts = line[len("import time:"):].split("|")
+    if len(parts) != 3 or not parts[0].strip().isdigit():
+      continue
+    rows.append((int(parts[0]), int(parts[1]), parts[2].strip()))
+  return seconds, rows
+
+def main():
+  parser = argparse.ArgumentParser(description="Report which imports make server startup slow.")
+  parser.add_argument("--endpoints", default=os.getenv("AAPI_ENDPOINTS", "all"), help="AAPI_ENDPOINTS to measure, e.g. ollama,jobs")
+  parser.add_argument("--top", type=int, default=20, help="Number of slowest top-level packages to list")
+  args = parser.parse_args()
+
+  seconds, rows = measure(args.endpoints)
+  # top-level packages only: their cumulative time includes every submodule they import
+  packages = {}
+  for _, cumulative, module in rows:
+    name = module.split(".")[0]
+    if module == name:
+      packages[name] = max(packages.get(name, 0), cumulative)
+
+  print(f"AAPI_ENDPOINTS={args.endpoints}: app created in {seconds:.2f}s, {len(rows)} modules imported")
+  print(f"{'cumulative ms':>14}  package")
+  for name, cumulative in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:args.top]:
+    print(f"{cumulative / 1000:>14.1f}  {name}")
+
+if __name__ == "__main__":
+  main()
@@ -1,18 +1,42 @@
 from flask import Flask
-from src.endpoints.sdxl import sdxl_bp
-from src.endpoints.sdxl_upscale import sdxl_upscale_bp
-from src.endpoints.ollama import ollama_bp
-from src.endpoints.wan import wan_bp
+from src.endpoints.health import health_bp
+import importlib
+import os
 
-def create_app(config_object = None):
+# name -> (module, blueprint), imported only when enabled in AAPI_ENDPOINTS
+ENDPOINTS = {
+  "sdxl": ("src.endpoints.sdxl", "sdxl_bp"),
+  "sdxl_upscale": ("src.endpoints.sdxl_upscale", "sdxl_upscale_bp"),
+  "wan": ("src.endpoints.wan", "wan_bp"),
+  "ollama": ("src.endpoints.ollama", "ollama_bp"),
+  "jobs": ("src.endpoints.jobs", "jobs_bp"),
+  "cache": ("src.endpoints.cache", "cache_bp"),
+  "metadata": ("src.endpoints.metadata", "metadata_bp"),
+  "models": ("src.endpoints.models", "models_bp"),
+  "metrics": ("src.endpoints.metrics", "metrics_bp")
+}
+
+def enabled_endpoints(value = None):
+  """Endpoint names from a comma separated list (default `AAPI_ENDPOINTS`), "all" for every one."""
+  value = value if value is not None else os.getenv("AAPI_ENDPOINTS", "all")
+  names = [n.strip() for n in value.split(",") if n.strip()]
+  if not names or "all" in names:
+    return list(ENDPOINTS)
+
+  unknown = [n for n in names if n not in ENDPOINTS]
+  if unknown:
+    raise ValueError(f"Unknown endpoints in AAPI_ENDPOINTS: {', '.join(unknown)}. Use any of: all, {', '.join(ENDPOINTS)}")
+  return names
+
+def create_app(config_object = None, endpoints = None):
   app = Flask(__name__, instance_relative_config = False)
 
   if config_object:
     app.config.from_object(config_object)
 
-  app.register_blueprint(sdxl_bp)
-  app.register_blueprint(sdxl_upscale_bp)
-  app.register_blueprint(ollama_bp)
-  app.register_blueprint(wan_bp)
+  for name in enabled_endpoints(endpoints):
+    module, blueprint = ENDPOINTS[name]
+    app.register_blueprint(getattr(importlib.import_module(module), blueprint))
+  app.register_blueprint(health_bp)
 
   return app
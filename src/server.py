@@ -1,16 +1,53 @@
 import os
 from dotenv import load_dotenv
-from src.init import create_app
+from src.init import create_app, enabled_endpoints
+from src.utils.job_util import start_job_worker
+from src.utils.lazy_util import warm_up
+from src.utils.logger import log
+from waitress import serve
+import threading
 
 load_dotenv()
 
+SERVERS = ("waitress", "dev")
+
 def main():
+  host = os.getenv("AAPI_HOST", "0.0.0.0")
+  port = int(os.getenv("AAPI_PORT", "5700"))
+  threads = int(os.getenv("AAPI_THREADS", "8"))
+  server = os.getenv("AAPI_SERVER", "waitress").lower()
+  debug = os.getenv("AAPI_DEBUG", "false").lower() == "true"
+  warmup = os.getenv("AAPI_WARMUP", "false").lower() == "true"
+
+  if server not in SERVERS:
+    raise ValueError(f"AAPI_SERVER must be one of {', '.join(SERVERS)}")
+
   app = create_app()
-  host = "0.0.0.0"
-  port = 5700
-  debug = True
 
-  app.run(host = host, port = port, debug = debug)
+  specs = []
+  if "models" in enabled_endpoints() or os.getenv("AAPI_PRELOAD", "").strip():
+    # imported here because it registers the model jobs, which start the job worker
+    from src.endpoints.models import preload_specs, preload_models
+    specs = preload_specs()
+
+  start_job_worker()
+
+  if specs:
+    # queued on the GPU thread ahead of the first generation, the server answers right away
+    threading.Thread(target=preload_models, args=(specs,), name="aapi-preload", daemon=True).start()
+
+  if warmup:
+    # heavy imports happen in the background, the server answers right away
+    threading.Thread(target=warm_up, name="aapi-warmup", daemon=True).start()
+
+  if server == "dev":
+    # the reloader would import torch and diffusers a second time in a child process
+    log(f"Serving with the Flask development server on {host}:{port}")
+    app.run(host = host, port = port, debug = debug, use_reloader = False, threaded = True)
+    return
+
+  log(f"Serving on {host}:{port} with {threads} threads")
+  serve(app, host = host, port = port, threads = threads, ident = "ArtificialAPI")
 
 if __name__ == "__main__":
   main()
@@ -1,20 +1,304 @@
-_cache = None
-_cache_key = None
+import gc
+import os
+import sys
+import threading
+from collections import OrderedDict
+from src.utils.logger import log
 
-def cache_set(key, value):
-  global _cache_key, _cache
-  if _cache_key != key:
-    _cache_key = key
-    _cache = value
+class ModelCache:
+  """
+  LRU cache for loaded pipelines and models.
+  Holds up to `max_slots` entries and evicts least recently used entries once the
+  measured size of all entries exceeds `max_bytes`. Pinned entries are never evicted.
+  Concurrent `get_or_load` calls for the same key run the loader only once.
+  """
+
+  def __init__(self, max_slots=2, max_bytes=None, size_fn=None, on_evict=None, name="Model cache"):
+    self.name = name
+    self.max_slots = max(1, int(max_slots))
+    self.max_bytes = int(max_bytes) if max_bytes else None
+    self.size_fn = size_fn or measure_bytes
+    self.on_evict = on_evict
+
+    self._lock = threading.Lock()
+    self._entries = OrderedDict()
+    self._bytes = 0
+    self._loading = {}
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return default
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return entry.value
+
+  def set(self, key, value, pin=False):
+    size = self.size_fn(value)
+    with self._lock:
+      evicted = self._insert(key, value, size, pin)
+    self._evicted(evicted)
+
+  def get_or_load(self, key, loader, pin=False):
+    """
+    Return the cached value for `key`, calling `loader()` on a miss.
+    If another thread is already loading `key`, wait for it instead of loading twice.
+    Older entries are only evicted once the load has succeeded, so a failed load (e.g. a
+    bad checkpoint path) leaves the resident pipelines in place.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if pin:
+          entry.pinned = True
+        return entry.value
+
+      flight = self._loading.get(key)
+      if flight is None:
+        flight = _Flight()
+        self._loading[key] = flight
+        self.misses += 1
+        owner = True
+      else:
+        self.hits += 1
+        owner = False
+
+    if not owner:
+      flight.event.wait()
+      if flight.error is not None:
+        raise flight.error
+      return flight.value
+
+    try:
+      value = loader()
+    except BaseException as e:
+      with self._lock:
+        self._loading.pop(key, None)
+      flight.error = e
+      flight.event.set()
+      raise
+
+    size = self.size_fn(value)
+    with self._lock:
+      self._loading.pop(key, None)
+      evicted = self._insert(key, value, size, pin)
+    self._evicted(evicted)
+
+    flight.value = value
+    flight.event.set()
+    return value
+
+  def delete(self, key):
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is not None:
+        self._bytes -= entry.size
+    if entry is None:
+      return False
+    evicted = [(key, entry)]
+    entry = None
+    self._evicted(evicted)
+    return True
+
+  def pin(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return False
+      entry.pinned = True
+      return True
+
+  def unpin(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return False
+      entry.pinned = False
+      evicted = self._evict()
+    self._evicted(evicted)
+    return True
+
+  def clear(self, include_pinned=False):
+    with self._lock:
+      evicted = [(k, e) for k, e in self._entries.items() if include_pinned or not e.pinned]
+      for k, e in evicted:
+        del self._entries[k]
+        self._bytes -= e.size
+    self._evicted(evicted)
+
+  def __contains__(self, key):
+    with self._lock:
+      return key in self._entries
+
+  def __len__(self):
+    with self._lock:
+      return len(self._entries)
+
+  def total_bytes(self):
+    with self._lock:
+      return self._bytes
+
+  def entries(self):
+    """Return resident entries from least to most recently used."""
+    with self._lock:
+      return [
+        {"key": k, "bytes": e.size, "pinned": e.pinned}
+        for k, e in self._entries.items()
+      ]
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        "slots": len(self._entries),
+        "max_slots": self.max_slots,
+        "bytes": self._bytes,
+        "max_bytes": self.max_bytes,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        "loading": len(self._loading)
+      }
+
+  def _insert(self, key, value, size, pin):
+    # called with lock held
+    old = self._entries.pop(key, None)
+    if old is not None:
+      self._bytes -= old.size
+    self._entries[key] = _Entry(value, size, pin or bool(old and old.pinned))
+    self._bytes += size
+    return self._evict(keep=key)
+
+  def _evict(self, keep=None):
+    # called with lock held; returns evicted (key, entry) pairs
+    evicted = []
+
+    def over_budget():
+      if len(self._entries) > self.max_slots:
+        return True
+      return self.max_bytes is not None and self._bytes > self.max_bytes
+
+    while over_budget():
+      victim = next((k for k, e in self._entries.items() if not e.pinned and k != keep), None)
+      if victim is None:
+        break
+      entry = self._entries.pop(victim)
+      self._bytes -= entry.size
+      evicted.append((victim, entry))
+      self.evictions += 1
+
+    return evicted
+
+  def _evicted(self, evicted):
+    # called without lock so callbacks can be slow; references are dropped first
+    # so on_evict can actually release the memory
+    while evicted:
+      key, entry = evicted.pop(0)
+      log(f"{self.name} evicted {key} ({entry.size / 2**30:.2f} GiB)")
+      entry = None
+      if self.on_evict:
+        self.on_evict(key)
+
+class _Entry:
+  __slots__ = ("value", "size", "pinned")
+
+  def __init__(self, value, size, pinned):
+    self.value = value
+    self.size = size
+    self.pinned = pinned
+
+class _Flight:
+  __slots__ = ("event", "value", "error")
+
+  def __init__(self):
+    self.event = threading.Event()
+    self.value = None
+    self.error = None
+
+def measure_bytes(value):
+  """
+  Sum the parameter and buffer sizes of every module/tensor reachable from value.
+  Understands diffusers pipelines (`components`), modules, tensors and containers.
+  Shared modules and tensors are only counted once.
+  """
+  seen = set()
+  total = 0
+
+  def visit(obj):
+    nonlocal total
+    if obj is None or id(obj) in seen:
+      return
+    seen.add(id(obj))
+
+    if hasattr(obj, "element_size") and hasattr(obj, "numel"):
+      total += obj.numel() * obj.element_size()
+    elif callable(getattr(obj, "parameters", None)) and callable(getattr(obj, "buffers", None)):
+      for tensor in obj.parameters():
+        visit(tensor)
+      for tensor in obj.buffers():
+        visit(tensor)
+    elif isinstance(getattr(obj, "components", None), dict):
+      for component in obj.components.values():
+        visit(component)
+    elif isinstance(obj, dict):
+      for v in obj.values():
+        visit(v)
+    elif isinstance(obj, (list, tuple)):
+      for v in obj:
+        visit(v)
+
+  visit(value)
+  return total
+
+def release_memory(key=None):
+  gc.collect()
+  torch = sys.modules.get("torch")
+  if torch is not None and torch.cuda.is_available():
+    torch.cuda.empty_cache()
+    torch.cuda.ipc_collect()
+
+_model_cache = None
+_model_cache_lock = threading.Lock()
+
+def get_model_cache():
+  """Return the process-wide pipeline cache, configured from the environment on first use."""
+  global _model_cache
+  with _model_cache_lock:
+    if _model_cache is None:
+      max_gb = os.getenv("MODEL_CACHE_MAX_GB")
+      _model_cache = ModelCache(
+        max_slots=int(os.getenv("MODEL_CACHE_MAX_SLOTS", "2")),
+        max_bytes=int(float(max_gb) * 2**30) if max_gb else None,
+        on_evict=release_memory
+      )
+    return _model_cache
+
+def cache_set(key, value, pin=False):
+  get_model_cache().set(key, value, pin=pin)
 
 def cache_get(key, default=None):
-  global _cache_key, _cache
-  if _cache_key == key:
-    return _cache
-  return default
+  return get_model_cache().get(key, default)
+
+def cache_get_or_load(key, loader, pin=False):
+  return get_model_cache().get_or_load(key, loader, pin=pin)
 
 def cache_delete(key):
-  global _cache_key, _cache
-  if _cache_key == key:
-    _cache = None
-    _cache_key = None
+  return get_model_cache().delete(key)
+
+def cache_pin(key):
+  return get_model_cache().pin(key)
+
+def cache_unpin(key):
+  return get_model_cache().unpin(key)
+
+def cache_stats():
+  return get_model_cache().stats()
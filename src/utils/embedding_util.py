@@ -0,0 +1,98 @@
+from safetensors.torch import load_file, save_file
+from src.utils.cache_util import ModelCache
+from src.utils.logger import log
+import hashlib
+import os
+import threading
+import torch
+
+class EmbeddingCache:
+  """
+  Byte-bounded LRU of encoder outputs (tuples of tensors, entries may be None).
+  With `disk_dir` set, computed entries are also written as safetensors files so later
+  runs can skip the encoder entirely.
+  """
+
+  def __init__(self, name, max_bytes, disk_dir=None):
+    self.name = name
+    self.memory = ModelCache(max_slots=1_000_000, max_bytes=max_bytes, name=f"{name} embedding cache")
+    self.disk_dir = os.path.join(disk_dir, name) if disk_dir else None
+    self.disk_hits = 0
+    self.disk_errors = 0
+
+    if self.disk_dir:
+      os.makedirs(self.disk_dir, exist_ok=True)
+
+  def get_or_compute(self, key, compute, device=None):
+    """Return the cached tensors for `key`, running `compute()` only when neither tier has them."""
+    def load():
+      tensors = self._read_disk(key, device)
+      if tensors is not None:
+        self.disk_hits += 1
+        return tensors
+
+      tensors = tuple(compute())
+      self._write_disk(key, tensors)
+      return tensors
+
+    return self.memory.get_or_load(key, load)
+
+  def stats(self):
+    return {**self.memory.stats(), "disk_hits": self.disk_hits, "disk_errors": self.disk_errors}
+
+  def _disk_path(self, key):
+    return os.path.join(self.disk_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".safetensors")
+
+  def _read_disk(self, key, device):
+    if not self.disk_dir:
+      return None
+
+    path = self._disk_path(key)
+    if not os.path.isfile(path):
+      return None
+
+    try:
+      data = load_file(path, device=str(device) if device is not None else "cpu")
+      count = int(data.pop("__count__").item())
+      return tuple(data.get(str(i)) for i in range(count))
+    except Exception as e:
+      self.disk_errors += 1
+      log(f"Could not read cached embeddings {path}: {repr(e)}")
+      return None
+
+  def _write_disk(self, key, tensors):
+    if not self.disk_dir:
+      return
+
+    data = {str(i): t.detach().contiguous() for i, t in enumerate(tensors) if t is not None}
+    data["__count__"] = torch.tensor(len(tensors))
+
+    path = self._disk_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+      save_file(data, tmp_path)
+      os.replace(tmp_path, path)
+    except Exception as e:
+      self.disk_errors += 1
+      log(f"Could not write cached embeddings {path}: {repr(e)}")
+      if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+_embedding_caches = {}
+_embedding_caches_lock = threading.Lock()
+
+def get_embedding_cache(name):
+  """Return the named embedding cache, configured from the environment on first use."""
+  with _embedding_caches_lock:
+    if name not in _embedding_caches:
+      _embedding_caches[name] = EmbeddingCache(
+        name,
+        max_bytes=int(float(os.getenv("EMBED_CACHE_MAX_MB", "512")) * 2**20),
+        disk_dir=os.getenv("EMBED_CACHE_DIR") or None
+      )
+    return _embedding_caches[name]
+
+def embedding_cache_stats():
+  with _embedding_caches_lock:
+    caches = dict(_embedding_caches)
+  return {name: cache.stats() for name, cache in caches.items()}
@@ -32,6 +32,20 @@ def within_range_inclusive(key, value, min, max):
   if (value < min or value > max):
     raise BadRequest(f"{key} must be between {min} and {max} inclusive")
 
+def int_param(key, value, default, min=None, max=None):
+  """Parse an integer request or query parameter, `default` when it is missing."""
+  if value is None or value == "":
+    return default
+  try:
+    value = int(value)
+  except (TypeError, ValueError):
+    raise BadRequest(f"{key} must be an integer")
+  if min is not None and value < min:
+    raise BadRequest(f"{key} must be at least {min}")
+  if max is not None and value > max:
+    raise BadRequest(f"{key} must be at most {max}")
+  return value
+
 def create_seed(provided_seed):
   if provided_seed in (None, "", -1):
     return random.randrange(2**31)
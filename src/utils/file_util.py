@@ -1,80 +1,14 @@
 import os
-import time
 import tzlocal
-import re
 from datetime import datetime
 import subprocess
 import imageio
+import imageio_ffmpeg
+import numpy as np
+from PIL import Image
+from src.utils.logger import log
 from pathlib import Path
-import json
-
-def get_image_paths(input_image_path):
-  image_paths = []
-  if input_image_path is not None:
-    def _abs_input_path(p):
-      # normalize the provided path (leave absolute paths unchanged)
-      return os.path.normpath(p)
-
-    # Normalize payload value into a list
-    candidates = []
-    if isinstance(input_image_path, list):
-      candidates = input_image_path
-    else:
-      candidates = [input_image_path]
-
-    for cand in candidates:
-      if not isinstance(cand, str):
-        continue
-      abs_path = _abs_input_path(cand)
-      # If path is a directory, collect all .png files inside (non-recursive)
-      if os.path.isdir(abs_path):
-        try:
-          for fn in sorted(os.listdir(abs_path)):
-            if fn.lower().endswith(".png"):
-              image_paths.append(os.path.join(abs_path, fn))
-        except Exception:
-          # skip folder if cannot read
-          continue
-      else:
-        # If file exists and is a png, add it.
-        if os.path.isfile(abs_path) and abs_path.lower().endswith(".png"):
-          image_paths.append(abs_path)
-        # else skip silently (non-existent or non-png)
-
-  print(f"image_paths: {image_paths}")
-  return image_paths
-
-def get_image_save_path(folder, prefix, suffix):
-  parts = []
-
-  if prefix:
-    parts.append(prefix)
-  ts = str(int(time.time()))
-  parts.append(ts)
-  if suffix:
-    parts.append(suffix)
-  filename = "-".join(parts) + ".png"
-
-  os.makedirs(folder, exist_ok=True)
-  path = os.path.join(folder, filename)
-
-  return path
-
-def get_video_save_path(folder, prefix, suffix):
-  parts = []
-
-  if prefix:
-    parts.append(prefix)
-  ts = str(int(time.time()))
-  parts.append(ts)
-  if suffix:
-    parts.append(suffix)
-  filename = "-".join(parts) + ".mp4"
-
-  os.makedirs(folder, exist_ok=True)
-  path = os.path.join(folder, filename)
-
-  return path
+from src.utils.output_util import atomic_write
 
 def get_timestamp():
   local_tz = tzlocal.get_localzone()
@@ -85,34 +19,104 @@ def get_timestamp():
 
   return timestamp_str
 
-def get_json_value(base, key):
-  value = None
-  m = re.match(r"^(.*)_upscaled_\d+$", base)
-
-  if m:
-    json_path = m.group(1) + ".json"
-  else:
-    json_path = base + ".json"
+def probe_video(path):
+  """Codec, frame size, fps and pixel format from the header of a video, without decoding frames."""
+  frames = imageio_ffmpeg.read_frames(path)
+  try:
+    meta = next(frames)
+  finally:
+    frames.close()
+  return {
+    "codec": meta.get("codec"),
+    "size": tuple(meta.get("size") or ()),
+    "fps": meta.get("fps"),
+    "pix_fmt": meta.get("pix_fmt")
+  }
+
+def _concat_stream_copy(paths, output_path):
+  # the concat demuxer reads a list file; single quotes in paths are escaped as '\''
+  list_path = f"{output_path}.concat.txt"
+  with open(list_path, "w", encoding="utf-8") as f:
+    for p in paths:
+      escaped = p.replace("'", "'\\''")
+      f.write(f"file '{escaped}'\n")
+
+  try:
+    subprocess.run(
+      [
+        imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", list_path,
+        "-c", "copy", "-movflags", "+faststart",
+        str(output_path)
+      ],
+      check=True,
+      capture_output=True
+    )
+  finally:
+    os.remove(list_path)
+
+def _concat_reencode(paths, output_path, fps):
+  writer = None
+  size = None
+  try:
+    for p in paths:
+      reader = imageio.get_reader(p)
+      try:
+        for frame in reader:
+          if writer is None:
+            size = (frame.shape[1], frame.shape[0])
+            writer = imageio.get_writer(str(output_path), fps=fps, codec="libx264")
+          elif (frame.shape[1], frame.shape[0]) != size:
+            frame = np.asarray(Image.fromarray(frame).resize(size, resample=Image.LANCZOS))
+          writer.append_data(frame)
+      finally:
+        reader.close()
+  finally:
+    if writer is not None:
+      writer.close()
+
+def concatenate_mp4s(file_paths, output_path, fps=None, method="auto"):
+  """
+  Concatenate videos into `output_path` and return (absolute output path, method used).
+  "copy" joins the streams with the ffmpeg concat demuxer without re-encoding, which
+  needs every input to share codec, frame size, fps and pixel format. "reencode" decodes
+  and re-encodes frame by frame, resizing to the first video. "auto" copies when it can.
+  """
+  paths = [str(Path(p).resolve()) for p in file_paths]
 
-  if os.path.isfile(json_path):
+  if method == "auto":
     try:
-      with open(json_path, "r", encoding="utf-8") as jf:
-        j = json.load(jf)
-        if isinstance(j, dict) and j.get(key):
-          value = j.get(key)
+      probes = [probe_video(p) for p in paths]
+      method = "copy" if all(probe == probes[0] for probe in probes) else "reencode"
     except Exception as e:
-      print("Error reading/parsing JSON:", repr(e))
-      value = None
-
-  return value
+      log(f"Could not probe videos for stream copy, re-encoding: {repr(e)}")
+      method = "reencode"
 
-def concatenate_mp4s(file_paths, output_path, fps=None):
-  paths = [str(Path(p).resolve()) for p in file_paths]
-  writer = imageio.get_writer(str(output_path), fps=fps or 30, codec='libx264')
-  for p in paths:
-    reader = imageio.get_reader(p)
-    for frame in reader:
-      writer.append_data(frame)
-    reader.close()
-  writer.close()
-  return str(Path(output_path).resolve())
+  # written under a temporary name, so a crash or failed concat never leaves a partial
+  # video that skip_existing would take for a finished one
+  if method == "copy":
+    try:
+      atomic_write(output_path, lambda tmp_path: _concat_stream_copy(paths, tmp_path))
+    except subprocess.CalledProcessError as e:
+      log(f"Stream copy concat failed, re-encoding: {e.stderr.decode(errors='replace').strip()}")
+      method = "reencode"
+
+  if method == "reencode":
+    if fps is None:
+      fps = probe_video(paths[0])["fps"] or 30
+    atomic_write(output_path, lambda tmp_path: _concat_reencode(paths, tmp_path, fps))
+
+  return str(Path(output_path).resolve()), method
+
+def read_last_frame(path):
+  """Decode a video to its final frame, as an RGB image."""
+  frames = imageio_ffmpeg.read_frames(path)
+  meta = next(frames)
+  width, height = meta["size"]
+  last = None
+  for last in frames:
+    pass
+  if last is None:
+    raise RuntimeError(f"No frames found in {path}")
+  pixels = np.frombuffer(last, dtype=np.uint8).reshape(height, width, 3)
+  return Image.fromarray(pixels)
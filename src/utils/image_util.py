@@ -6,6 +6,9 @@ def compute_dimensions_from_image(img_path, max_dim=720):
       w, h = im.size
   except Exception:
     return None, None
+  return compute_dimensions(w, h, max_dim)
+
+def compute_dimensions(w, h, max_dim=720):
   # if both <= max_dim, keep as-is
   if w <= max_dim and h <= max_dim:
     return w - (w % 16), h - (h % 16)
@@ -0,0 +1,157 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.output_store_util import is_temp_output
+from werkzeug.exceptions import BadRequest
+import fnmatch
+import os
+
+INPUT_ORDERS = ("name", "mtime", "none")
+
+def iter_input_paths(input_path, recursive=False, pattern=None, extensions=(".png",), order="name"):
+  """
+  Yield input files lazily from a path or list of paths. Directories are read with
+  `os.scandir` one at a time. Files are filtered by extension and an optional glob `pattern`
+  matched against the file name. `order` sorts the files of each directory by "name" or
+  "mtime", which lists the whole directory before its first file is yielded, or keeps the
+  filesystem's order with "none", which yields each file as soon as it is listed.
+  Subdirectories are visited by name after the files of their parent.
+  """
+  if input_path is None:
+    return
+
+  candidates = input_path if isinstance(input_path, list) else [input_path]
+  extensions = tuple(e.lower() for e in extensions) if extensions else None
+
+  def matches(name):
+    if extensions is not None and not name.lower().endswith(extensions):
+      return False
+    if is_temp_output(name):
+      return False
+    return pattern is None or fnmatch.fnmatch(name, pattern)
+
+  def walk(folder):
+    files = []
+    subfolders = []
+    try:
+      with os.scandir(folder) as it:
+        for entry in it:
+          if entry.is_file() and matches(entry.name):
+            if order == "none":
+              yield entry.path
+            else:
+              # sort key taken from the scandir entry, so each file is stat'ed at most once
+              files.append((entry.stat().st_mtime if order == "mtime" else entry.name, entry.path))
+          elif recursive and entry.is_dir():
+            subfolders.append(entry.path)
+    except OSError:
+      # skip folder if cannot read
+      return
+
+    files.sort()
+    for _, path in files:
+      yield path
+
+    subfolders.sort()
+    for subfolder in subfolders:
+      yield from walk(subfolder)
+
+  for cand in candidates:
+    if not isinstance(cand, str):
+      continue
+    path = os.path.normpath(cand)
+    if os.path.isdir(path):
+      yield from walk(path)
+    elif os.path.isfile(path) and matches(os.path.basename(path)):
+      yield path
+    # else skip silently (non-existent or filtered out)
+
+class LazyPaths:
+  """
+  Re-iterable view of an iterator that only pulls items as they are needed and remembers
+  them, so a folder scan can feed generation while it is still running. `len` finishes
+  the scan; `known_count` only reports the length once the scan is done.
+  """
+
+  def __init__(self, iterable):
+    self._items = []
+    if isinstance(iterable, (list, tuple)):
+      self._items.extend(iterable)
+      self._source = None
+    else:
+      self._source = iter(iterable)
+
+  @property
+  def complete(self):
+    return self._source is None
+
+  def _pull(self):
+    try:
+      self._items.append(next(self._source))
+      return True
+    except StopIteration:
+      self._source = None
+      return False
+
+  def __iter__(self):
+    i = 0
+    while True:
+      if i < len(self._items):
+        yield self._items[i]
+        i += 1
+      elif self._source is None or not self._pull():
+        return
+
+  def __bool__(self):
+    return bool(self._items) or (self._source is not None and self._pull())
+
+  def __len__(self):
+    while self._source is not None:
+      self._pull()
+    return len(self._items)
+
+  def known_count(self):
+    return len(self._items) if self.complete else None
+
+def input_options(payload):
+  """Read the input discovery options shared by every endpoint that takes input images."""
+  order = payload.get("input_order", "name")
+  if order not in INPUT_ORDERS:
+    raise BadRequest(f"input_order must be one of {', '.join(INPUT_ORDERS)}")
+
+  extensions = payload.get("input_extensions") or [".png"]
+  if isinstance(extensions, str):
+    extensions = [extensions]
+  if not isinstance(extensions, list) or not all(isinstance(e, str) and e for e in extensions):
+    raise BadRequest("input_extensions must be a string or a list of strings")
+
+  pattern = payload.get("input_glob") or None
+  if pattern is not None and not isinstance(pattern, str):
+    raise BadRequest("input_glob must be a string")
+
+  return {
+    "recursive": bool(payload.get("input_recursive", False)),
+    "pattern": pattern,
+    "extensions": [e if e.startswith(".") else f".{e}" for e in extensions],
+    "order": order
+  }
+
+def get_input_paths(input_path, payload):
+  """Lazily discovered input paths for `input_path`, using the discovery options in `payload`."""
+  return LazyPaths(iter_input_paths(input_path, **input_options(payload)))
+
+def prefetch(items, fetch, lookahead=4):
+  """
+  Yield (item, fetch(item)) in order, running `fetch` on a background thread up to
+  `lookahead` items ahead of the consumer, e.g. to read image sizes and metadata for the
+  next inputs while the GPU works on the current one.
+  """
+  with ThreadPoolExecutor(max_workers=1, thread_name_prefix="aapi-prefetch") as executor:
+    pending = deque()
+    for item in items:
+      pending.append((item, executor.submit(fetch, item)))
+      if len(pending) > lookahead:
+        done_item, future = pending.popleft()
+        yield done_item, future.result()
+    while pending:
+      done_item, future = pending.popleft()
+      yield done_item, future.result()
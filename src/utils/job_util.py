@@ -0,0 +1,330 @@
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.endpoint_util import int_param
+from src.utils.logger import log
+from src.utils.metrics_util import JOB_SECONDS, JOBS_TOTAL, endpoint_context
+from src.utils.profile_util import RequestProfile, run_profiled
+from src.utils.progress_util import get_listener, listen
+from src.utils.scheduler_util import pick_next_job, ScheduleStats
+from werkzeug.exceptions import HTTPException
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+# Single thread that owns the models: all GPU work from queued jobs and synchronous
+# requests runs here, so HTTP threads only wait on it and stay free for other endpoints
+_gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aapi-gpu")
+_gpu_state_lock = threading.Lock()
+_gpu_state = {"running": None, "started_at": None, "waiting": 0}
+
+_job_handlers = {}
+_job_pipeline_keys = {}
+
+def register_job(job_type, handler, pipeline_key=None):
+  """
+  Register `handler(payload) -> dict` as the executor for jobs of `job_type`.
+  `pipeline_key(payload) -> str` names the pipeline the job needs so the scheduler can group jobs.
+  """
+  _job_handlers[job_type] = handler
+  if pipeline_key is not None:
+    _job_pipeline_keys[job_type] = pipeline_key
+
+def run_job(job_type, payload):
+  """
+  Run a job on the GPU thread and wait for its result, queueing behind the job it is
+  running. Progress events still go to the caller's listener. With `"profile": true` in
+  the payload the job is profiled, see `run_profiled`.
+  """
+  handler = _job_handlers[job_type]
+  listener = get_listener()
+  profile = RequestProfile() if payload.get("profile") else None
+  pipeline_key = job_pipeline_key(job_type, payload)
+
+  def execute():
+    with _gpu_state_lock:
+      _gpu_state["waiting"] -= 1
+      _gpu_state["running"] = job_type
+      _gpu_state["started_at"] = time.time()
+    if pipeline_key is not None and _job_queue is not None:
+      # synchronous requests load pipelines too, queued jobs for the same one should follow
+      _job_queue.set_current_key(pipeline_key)
+    start = time.perf_counter()
+    status = "failed"
+    try:
+      with listen(listener), endpoint_context(job_type, profile):
+        if profile is None:
+          result = handler(payload)
+        else:
+          result = run_profiled(job_type, payload, handler, profile)
+      status = "completed"
+      return result
+    finally:
+      JOB_SECONDS.observe(time.perf_counter() - start, endpoint=job_type)
+      JOBS_TOTAL.inc(endpoint=job_type, status=status)
+      with _gpu_state_lock:
+        _gpu_state["running"] = None
+        _gpu_state["started_at"] = None
+
+  with _gpu_state_lock:
+    _gpu_state["waiting"] += 1
+  return _gpu_executor.submit(execute).result()
+
+def gpu_status():
+  """What the GPU thread is running, since when, and how many jobs wait for it."""
+  with _gpu_state_lock:
+    return {
+      "busy": _gpu_state["running"] is not None,
+      "running": _gpu_state["running"],
+      "running_seconds": round(time.time() - _gpu_state["started_at"], 1) if _gpu_state["started_at"] else None,
+      "waiting": _gpu_state["waiting"]
+    }
+
+class JobQueue:
+  """
+  Queue of GPU jobs persisted to SQLite so queued jobs survive a restart.
+  A single worker thread runs jobs one at a time on the GPU thread, see `run_job`. Jobs are
+  reordered by priority and pipeline key to avoid model swaps, see `pick_next_job`.
+  """
+
+  def __init__(self, db_path, max_skips=8):
+    self.db_path = db_path
+    self.max_skips = max_skips
+    self.schedule_stats = ScheduleStats()
+    self._db_lock = threading.Lock()
+    self._wakeup = threading.Event()
+    self._worker = None
+    self._current_key = None
+
+    folder = os.path.dirname(db_path)
+    if folder:
+      os.makedirs(folder, exist_ok=True)
+
+    with self._connect() as conn:
+      conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+          id TEXT PRIMARY KEY,
+          type TEXT NOT NULL,
+          payload TEXT NOT NULL,
+          status TEXT NOT NULL,
+          progress REAL NOT NULL DEFAULT 0,
+          progress_info TEXT,
+          result TEXT,
+          error TEXT,
+          created_at REAL NOT NULL,
+          started_at REAL,
+          finished_at REAL
+        )
+        """
+      )
+      columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+      for column, definition in (
+        ("pipeline_key", "TEXT"),
+        ("priority", "INTEGER NOT NULL DEFAULT 0"),
+        ("skips", "INTEGER NOT NULL DEFAULT 0")
+      ):
+        if column not in columns:
+          conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+      conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+  def _connect(self):
+    return sqlite3.connect(self.db_path, timeout=30)
+
+  def _execute(self, sql, args=()):
+    with self._db_lock, self._connect() as conn:
+      conn.row_factory = sqlite3.Row
+      return conn.execute(sql, args).fetchall()
+
+  def submit(self, job_type, payload):
+    if job_type not in _job_handlers:
+      raise ValueError(f"Unknown job type: {job_type}")
+
+    priority = int_param("priority", payload.get("priority"), 0, min=-2**31, max=2**31 - 1)
+    pipeline_key = job_pipeline_key(job_type, payload)
+
+    job_id = uuid.uuid4().hex
+    self._execute(
+      "INSERT INTO jobs (id, type, payload, status, pipeline_key, priority, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+      (job_id, job_type, json.dumps(payload), pipeline_key, priority, time.time())
+    )
+    self._wakeup.set()
+    log(f"Queued {job_type} job {job_id}")
+    return self.get(job_id)
+
+  def get(self, job_id):
+    rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    return _row_to_job(rows[0]) if rows else None
+
+  def list(self, status=None, limit=100):
+    if status:
+      rows = self._execute(
+        "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?",
+        (status, limit)
+      )
+    else:
+      rows = self._execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+    return [_row_to_job(row) for row in rows]
+
+  def cancel(self, job_id):
+    """Cancel a job that has not started yet. Returns False if it is already running or done."""
+    with self._db_lock, self._connect() as conn:
+      cur = conn.execute(
+        "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+        (time.time(), job_id)
+      )
+      return cur.rowcount > 0
+
+  def set_current_key(self, pipeline_key):
+    """Record the pipeline that is loaded now, so the scheduler prefers jobs that need it."""
+    with self._db_lock:
+      self._current_key = pipeline_key
+
+  def pending_count(self):
+    return self._execute("SELECT COUNT(*) AS n FROM jobs WHERE status = 'queued'")[0]["n"]
+
+  def start(self):
+    if self._worker is not None:
+      return
+
+    # jobs that were running when the server stopped cannot be resumed mid-generation
+    self._execute(
+      "UPDATE jobs SET status = 'failed', error = 'Server restarted while job was running', finished_at = ? WHERE status = 'running'",
+      (time.time(),)
+    )
+
+    self._worker = threading.Thread(target=self._run, name="aapi-job-worker", daemon=True)
+    self._worker.start()
+    log(f"Job worker started, {self.pending_count()} queued jobs")
+
+  def _claim_next(self):
+    with self._db_lock, self._connect() as conn:
+      conn.row_factory = sqlite3.Row
+      pending = [
+        {"row": row, "key": row["pipeline_key"], "priority": row["priority"], "skips": row["skips"]}
+        for row in conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at")
+        # jobs of endpoints that are not enabled (AAPI_ENDPOINTS) stay queued
+        if row["type"] in _job_handlers
+      ]
+      job = pick_next_job(pending, self._current_key, self.max_skips)
+      if job is None:
+        return None
+
+      row = job["row"]
+      # every older job that was passed over moves closer to the starvation bound
+      conn.execute(
+        "UPDATE jobs SET skips = skips + 1 WHERE status = 'queued' AND created_at < ?",
+        (row["created_at"],)
+      )
+      conn.execute(
+        "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?",
+        (time.time(), row["id"])
+      )
+
+    self.schedule_stats.record(row["created_at"], row["pipeline_key"], job is not pending[0])
+    if row["pipeline_key"] is not None:
+      self._current_key = row["pipeline_key"]
+    return row
+
+  def _run(self):
+    while True:
+      row = self._claim_next()
+      if row is None:
+        self._wakeup.wait(timeout=5)
+        self._wakeup.clear()
+        continue
+
+      self._run_job(row)
+
+  def _run_job(self, row):
+    job_id = row["id"]
+    log(f"Running {row['type']} job {job_id}")
+    info = {}
+    last_step_write = [0.0]
+
+    def on_event(event, data):
+      info[event] = data
+      if event == "step":
+        # denoising steps can fire several times a second, polling clients don't need every one
+        now = time.monotonic()
+        if now - last_step_write[0] < 1:
+          return
+        last_step_write[0] = now
+      progress = None
+      if event == "progress" and data.get("total"):
+        progress = data["done"] / data["total"]
+      if progress is None:
+        self._execute("UPDATE jobs SET progress_info = ? WHERE id = ?", (json.dumps(info), job_id))
+      else:
+        self._execute(
+          "UPDATE jobs SET progress = ?, progress_info = ? WHERE id = ?",
+          (progress, json.dumps(info), job_id)
+        )
+
+    try:
+      with listen(on_event):
+        result = run_job(row["type"], json.loads(row["payload"]))
+      self._execute(
+        "UPDATE jobs SET status = 'completed', progress = 1, result = ?, finished_at = ? WHERE id = ?",
+        (json.dumps(result), time.time(), job_id)
+      )
+      log(f"Completed job {job_id}")
+    except Exception as e:
+      error = e.description if isinstance(e, HTTPException) else repr(e)
+      log(f"Job {job_id} failed: {error}\n{traceback.format_exc()}")
+      self._execute(
+        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+        (error, time.time(), job_id)
+      )
+
+def job_pipeline_key(job_type, payload):
+  """Pipeline a job of `job_type` needs, or None when it has none or it cannot be computed."""
+  if job_type not in _job_pipeline_keys:
+    return None
+  try:
+    return _job_pipeline_keys[job_type](payload)
+  except Exception as e:
+    # invalid payloads fail when the job runs, they just can't be grouped
+    log(f"Could not compute pipeline key for {job_type} job: {repr(e)}")
+    return None
+
+def _row_to_job(row):
+  return {
+    "id": row["id"],
+    "type": row["type"],
+    "status": row["status"],
+    "priority": row["priority"],
+    "pipeline_key": row["pipeline_key"],
+    "progress": row["progress"],
+    "progress_info": json.loads(row["progress_info"]) if row["progress_info"] else None,
+    "result": json.loads(row["result"]) if row["result"] else None,
+    "error": row["error"],
+    "created_at": row["created_at"],
+    "started_at": row["started_at"],
+    "finished_at": row["finished_at"]
+  }
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue():
+  """Return the process-wide job queue, created from the environment on first use."""
+  global _job_queue
+  with _job_queue_lock:
+    if _job_queue is None:
+      _job_queue = JobQueue(
+        os.getenv("JOB_DB_PATH", "data/jobs.sqlite3"),
+        max_skips=int(os.getenv("JOB_MAX_SKIPS", "8"))
+      )
+    return _job_queue
+
+def submit_job(job_type, payload):
+  return get_job_queue().submit(job_type, payload)
+
+def start_job_worker():
+  if not _job_handlers:
+    log("No job types registered, job worker not started")
+    return
+  get_job_queue().start()
@@ -0,0 +1,64 @@
+from src.utils.logger import log
+import importlib
+import sys
+import threading
+import time
+
+class LazyModule:
+  """
+  Stand-in for a module that is imported on first attribute access, so torch, diffusers
+  and the model utils are only loaded by the first request that uses them (or `warm_up`).
+  """
+
+  def __init__(self, name):
+    self._name = name
+    self._module = None
+    self._lock = threading.Lock()
+
+  def _load(self):
+    if self._module is None:
+      with self._lock:
+        if self._module is None:
+          start = time.perf_counter()
+          module = importlib.import_module(self._name)
+          log(f"Imported {self._name} in {time.perf_counter() - start:.2f}s")
+          self._module = module
+    return self._module
+
+  def __getattr__(self, attr):
+    return getattr(self._load(), attr)
+
+  def __repr__(self):
+    state = "loaded" if self._module is not None else "not loaded"
+    return f"<lazy module {self._name} ({state})>"
+
+_lazy_modules = {}
+_lazy_modules_lock = threading.Lock()
+
+def lazy_import(name):
+  """Return a `LazyModule` for `name`, shared by every caller."""
+  with _lazy_modules_lock:
+    if name not in _lazy_modules:
+      _lazy_modules[name] = LazyModule(name)
+    return _lazy_modules[name]
+
+def is_loaded(name):
+  return name in sys.modules
+
+def warm_up(names=None):
+  """
+  Import `names` (default: every module requested through `lazy_import` so far) and
+  return the seconds each took; modules that were already loaded take 0.
+  """
+  if names:
+    modules = [lazy_import(name) for name in names]
+  else:
+    with _lazy_modules_lock:
+      modules = list(_lazy_modules.values())
+
+  timings = {}
+  for module in modules:
+    start = time.perf_counter()
+    module._load()
+    timings[module._name] = round(time.perf_counter() - start, 3)
+  return timings
@@ -0,0 +1,76 @@
+from safetensors.torch import load_file
+from src.utils.cache_util import ModelCache
+from src.utils.logger import log
+import os
+import threading
+
+_state_dict_cache = None
+_state_dict_cache_lock = threading.Lock()
+
+def get_lora_state_dict_cache():
+  """Return the LRU of LoRA state dicts kept in CPU memory, configured from the environment on first use."""
+  global _state_dict_cache
+  with _state_dict_cache_lock:
+    if _state_dict_cache is None:
+      _state_dict_cache = ModelCache(
+        max_slots=int(os.getenv("LORA_CACHE_MAX_SLOTS", "16")),
+        max_bytes=int(float(os.getenv("LORA_CACHE_MAX_GB", "4")) * 2**30)
+      )
+    return _state_dict_cache
+
+def load_lora_state_dict(path):
+  """
+  Return the LoRA weights for `path`, reading the file only on a cache miss.
+  Non-safetensors files are returned as the path so diffusers can load them itself.
+  """
+  if not path.lower().endswith(".safetensors") or not os.path.isfile(path):
+    return path
+
+  key = f"{os.path.abspath(path)}|{os.path.getmtime(path)}"
+  state_dict = get_lora_state_dict_cache().get_or_load(key, lambda: load_file(path, device="cpu"))
+  # diffusers converts and pops keys from the dict it is given, so hand it a copy
+  return dict(state_dict)
+
+def lora_adapter_name(path):
+  return "".join(ch for ch in path if ch.isalnum())
+
+def get_loaded_adapters(pipeline):
+  loaded = set()
+  for names in pipeline.get_list_adapters().values():
+    loaded.update(names)
+  return loaded
+
+def apply_loras(pipeline, loras, lora_device="cuda:0"):
+  """
+  Make the pipeline's active adapters match `loras` without reloading the base model.
+  Only adapters that are not resident yet are loaded, adapters that are no longer
+  requested are deleted, and strengths are updated with set_adapters.
+  Returns True if any adapter was loaded or deleted.
+  """
+  wanted = {}
+  for lora in loras or []:
+    wanted[lora_adapter_name(lora["path"])] = lora
+
+  loaded = get_loaded_adapters(pipeline)
+  to_delete = [name for name in loaded if name not in wanted]
+  to_load = [name for name in wanted if name not in loaded]
+
+  if to_delete:
+    log(f"Unloading LoRA adapters: {to_delete}")
+    pipeline.delete_adapters(to_delete)
+
+  for name in to_load:
+    path = wanted[name]["path"]
+    log(f"Loading LoRA adapter: {path}")
+    pipeline.load_lora_weights(load_lora_state_dict(path), adapter_name=name)
+
+  if to_load:
+    pipeline.set_lora_device(adapter_names=to_load, device=lora_device)
+
+  if wanted:
+    pipeline.set_adapters(
+      list(wanted.keys()),
+      adapter_weights=[lora["strength"] / 100 for lora in wanted.values()]
+    )
+
+  return bool(to_load or to_delete)
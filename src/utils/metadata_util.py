@@ -0,0 +1,263 @@
+from src.utils.logger import log
+from src.utils.output_store_util import is_temp_output
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+OUTPUT_KINDS = {".png": "image", ".jpg": "image", ".jpeg": "image", ".webp": "image", ".mp4": "video"}
+
+class MetadataIndex:
+  """
+  SQLite index of generated outputs and their sidecar metadata (prompt, seed, size, model,
+  and the image they were generated from). Outputs are recorded as they are written;
+  `scan` picks up sidecars written elsewhere or edited since, by comparing mtimes.
+  """
+
+  def __init__(self, db_path):
+    self.db_path = db_path
+    self._db_lock = threading.Lock()
+
+    folder = os.path.dirname(db_path)
+    if folder:
+      os.makedirs(folder, exist_ok=True)
+
+    with self._connect() as conn:
+      conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outputs (
+          path TEXT PRIMARY KEY,
+          folder TEXT NOT NULL,
+          kind TEXT NOT NULL,
+          prompt TEXT,
+          negative_prompt TEXT,
+          seed INTEGER,
+          width INTEGER,
+          height INTEGER,
+          model TEXT,
+          parent TEXT,
+          created_at REAL NOT NULL,
+          sidecar_mtime REAL
+        )
+        """
+      )
+      conn.execute("CREATE INDEX IF NOT EXISTS outputs_folder ON outputs (folder, created_at)")
+      conn.execute("CREATE INDEX IF NOT EXISTS outputs_model ON outputs (model, created_at)")
+      conn.execute("CREATE INDEX IF NOT EXISTS outputs_created ON outputs (created_at)")
+
+  def _connect(self):
+    return sqlite3.connect(self.db_path, timeout=30)
+
+  def _execute(self, sql, args=()):
+    with self._db_lock, self._connect() as conn:
+      conn.row_factory = sqlite3.Row
+      return conn.execute(sql, args).fetchall()
+
+  def record(self, path, metadata, sidecar_mtime=None):
+    """Add or update the entry for the output at `path` from its metadata dict."""
+    path = os.path.abspath(path)
+    kind = OUTPUT_KINDS.get(os.path.splitext(path)[1].lower())
+    if kind is None or not isinstance(metadata, dict):
+      return None
+
+    created_at = os.path.getmtime(path) if os.path.exists(path) else time.time()
+    parent = metadata.get("parent") or metadata.get("reference_image_path") or metadata.get("image")
+    row = (
+      path,
+      os.path.dirname(path),
+      kind,
+      _text(metadata.get("prompt")),
+      _text(metadata.get("negative_prompt")),
+      _int(metadata.get("seed")),
+      _int(metadata.get("width")),
+      _int(metadata.get("height")),
+      _text(metadata.get("model") or metadata.get("checkpoint_file_path") or metadata.get("gguf_path")),
+      os.path.abspath(parent) if isinstance(parent, str) else None,
+      created_at,
+      sidecar_mtime
+    )
+    self._execute(
+      """
+      INSERT OR REPLACE INTO outputs
+        (path, folder, kind, prompt, negative_prompt, seed, width, height, model, parent, created_at, sidecar_mtime)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+      """,
+      row
+    )
+    return self.get(path)
+
+  def get(self, path):
+    rows = self._execute("SELECT * FROM outputs WHERE path = ?", (os.path.abspath(path),))
+    return dict(rows[0]) if rows else None
+
+  def lookup(self, path):
+    """
+    Return the entry for `path`, (re)indexing it from its sidecar first if the sidecar
+    is new or changed since it was indexed.
+    """
+    row = self.get(path)
+    sidecar = sidecar_path(path)
+    if not os.path.isfile(sidecar):
+      return row
+
+    mtime = os.path.getmtime(sidecar)
+    if row is not None and row["sidecar_mtime"] == mtime:
+      return row
+
+    metadata = read_sidecar(sidecar)
+    if metadata is None:
+      return row
+    return self.record(path, metadata, sidecar_mtime=mtime)
+
+  def scan(self, folder, recursive=True):
+    """
+    Index every output with a sidecar under `folder` whose sidecar changed since it was
+    last indexed, and drop entries for outputs that no longer exist.
+    """
+    folder = os.path.abspath(folder)
+    known = {
+      row["path"]: row["sidecar_mtime"]
+      for row in self._execute(
+        "SELECT path, sidecar_mtime FROM outputs WHERE folder = ? OR folder LIKE ? ESCAPE '\\'",
+        (folder, _like_prefix(folder + os.sep))
+      )
+    }
+
+    scanned = 0
+    indexed = 0
+    seen = set()
+    for path in _walk_outputs(folder, recursive):
+      scanned += 1
+      seen.add(path)
+      sidecar = sidecar_path(path)
+      try:
+        mtime = os.path.getmtime(sidecar)
+      except OSError:
+        continue
+      if known.get(path) == mtime:
+        continue
+
+      metadata = read_sidecar(sidecar)
+      if metadata is not None:
+        self.record(path, metadata, sidecar_mtime=mtime)
+        indexed += 1
+
+    removed = [p for p in known if p not in seen and not os.path.exists(p)]
+    for path in removed:
+      self._execute("DELETE FROM outputs WHERE path = ?", (path,))
+
+    log(f"Metadata scan of {folder}: {scanned} outputs, {indexed} indexed, {len(removed)} removed")
+    return {"folder": folder, "scanned": scanned, "indexed": indexed, "removed": len(removed)}
+
+  def search(self, query=None, model=None, kind=None, folder=None, since=None, until=None, limit=100, offset=0):
+    """Find outputs whose prompt contains `query`, newest first."""
+    where = []
+    args = []
+    if query:
+      where.append("prompt LIKE ? ESCAPE '\\'")
+      args.append(f"%{_escape_like(query)}%")
+    if model:
+      where.append("model LIKE ? ESCAPE '\\'")
+      args.append(f"%{_escape_like(model)}%")
+    if kind:
+      where.append("kind = ?")
+      args.append(kind)
+    if folder:
+      folder = os.path.abspath(folder)
+      where.append("(folder = ? OR folder LIKE ? ESCAPE '\\')")
+      args.extend([folder, _like_prefix(folder + os.sep)])
+    if since is not None:
+      where.append("created_at >= ?")
+      args.append(since)
+    if until is not None:
+      where.append("created_at < ?")
+      args.append(until)
+
+    sql = "SELECT * FROM outputs"
+    if where:
+      sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+    args.extend([limit, offset])
+
+    return [dict(row) for row in self._execute(sql, args)]
+
+def _text(value):
+  return value if isinstance(value, str) else None
+
+def _int(value):
+  try:
+    return int(value) if value is not None else None
+  except (TypeError, ValueError):
+    return None
+
+def _escape_like(value):
+  return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _like_prefix(prefix):
+  return _escape_like(prefix) + "%"
+
+def _walk_outputs(folder, recursive):
+  try:
+    entries = list(os.scandir(folder))
+  except OSError:
+    return
+
+  for entry in entries:
+    if entry.is_dir(follow_symlinks=False):
+      if recursive:
+        yield from _walk_outputs(entry.path, recursive)
+    elif os.path.splitext(entry.name)[1].lower() in OUTPUT_KINDS and not is_temp_output(entry.name):
+      yield os.path.abspath(entry.path)
+
+def sidecar_path(path):
+  return os.path.splitext(path)[0] + ".json"
+
+def read_sidecar(sidecar):
+  try:
+    with open(sidecar, "r", encoding="utf-8") as jf:
+      data = json.load(jf)
+    return data if isinstance(data, dict) else None
+  except Exception as e:
+    log(f"Error reading/parsing JSON {sidecar}: {repr(e)}")
+    return None
+
+def upscaled_source_path(path):
+  """Path of the image an `_upscaled_` image was made from, or None for other paths."""
+  base, ext = os.path.splitext(path)
+  m = re.match(r"^(.*)_upscaled_\w+$", base)
+  return m.group(1) + ext if m else None
+
+_metadata_index = None
+_metadata_index_lock = threading.Lock()
+
+def get_metadata_index():
+  """Return the process-wide metadata index, created from the environment on first use."""
+  global _metadata_index
+  with _metadata_index_lock:
+    if _metadata_index is None:
+      _metadata_index = MetadataIndex(os.getenv("METADATA_DB_PATH", "data/metadata.sqlite3"))
+    return _metadata_index
+
+def get_output_metadata(path):
+  """
+  Metadata for an input image: its own entry, or the entry of the image it was upscaled from.
+  Returns {} when neither has any.
+  """
+  index = get_metadata_index()
+  for candidate in (path, upscaled_source_path(path)):
+    if candidate is None:
+      continue
+    row = index.lookup(candidate)
+    if row is not None and (row["prompt"] or row["negative_prompt"]):
+      return row
+  return {}
+
+def index_output(path, metadata, sidecar=None):
+  """Record a freshly written output; indexing problems are logged, never raised."""
+  try:
+    mtime = os.path.getmtime(sidecar) if sidecar else None
+    get_metadata_index().record(path, metadata, sidecar_mtime=mtime)
+  except Exception as e:
+    log(f"Could not index {path}: {repr(e)}")
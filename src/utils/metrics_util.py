@@ -0,0 +1,225 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+# seconds, from a cached prompt encode up to a cold Wan checkpoint load
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+class Metric:
+  """
+  Base of the in-process Prometheus metrics. Values are kept per tuple of label values,
+  in `labelnames` order. Recording is a dict lookup and an add under a lock, so it is
+  cheap enough for per-image and per-step code.
+  """
+
+  kind = None
+
+  def __init__(self, name, help, labelnames=()):
+    self.name = name
+    self.help = help
+    self.labelnames = tuple(labelnames)
+    self._lock = threading.Lock()
+    self._values = {}
+
+  def _key(self, labels):
+    return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+  def samples(self):
+    """Yield (suffix, label pairs, value) for the text exposition format."""
+    with self._lock:
+      values = list(self._values.items())
+    for key, value in values:
+      yield "", list(zip(self.labelnames, key)), value
+
+class Counter(Metric):
+  kind = "counter"
+
+  def inc(self, amount=1, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+  kind = "gauge"
+
+  def set(self, value, **labels):
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = value
+
+class Histogram(Metric):
+  kind = "histogram"
+
+  def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    super().__init__(name, help, labelnames)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value, **labels):
+    key = self._key(labels)
+    # index of the first bucket the value fits in; counts are made cumulative on export
+    i = bisect_left(self.buckets, value)
+    with self._lock:
+      entry = self._values.get(key)
+      if entry is None:
+        entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+      entry[0][i] += 1
+      entry[1] += value
+      entry[2] += 1
+
+  def samples(self):
+    with self._lock:
+      values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+    for key, (counts, total, count) in values:
+      labels = list(zip(self.labelnames, key))
+      cumulative = 0
+      for bound, n in zip(self.buckets, counts):
+        cumulative += n
+        yield "_bucket", labels + [("le", _format_value(bound))], cumulative
+      yield "_bucket", labels + [("le", "+Inf")], count
+      yield "_sum", labels, total
+      yield "_count", labels, count
+
+class Collected(Metric):
+  """Gauge or counter read from elsewhere at scrape time by `collect() -> {label tuple: value}`."""
+
+  def __init__(self, name, help, labelnames=(), collect=None, kind="gauge"):
+    super().__init__(name, help, labelnames)
+    self.kind = kind
+    self.collect = collect
+
+  def samples(self):
+    for key, value in self.collect().items():
+      yield "", list(zip(self.labelnames, key)), value
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def register(metric):
+  with _registry_lock:
+    _registry.append(metric)
+  return metric
+
+def counter(name, help, labelnames=()):
+  return register(Counter(name, help, labelnames))
+
+def gauge(name, help, labelnames=()):
+  return register(Gauge(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+  return register(Histogram(name, help, labelnames, buckets))
+
+def collected(name, help, labelnames=(), collect=None, kind="gauge"):
+  return register(Collected(name, help, labelnames, collect, kind))
+
+def render():
+  """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+  with _registry_lock:
+    metrics = list(_registry)
+
+  lines = []
+  for metric in metrics:
+    try:
+      samples = list(metric.samples())
+    except Exception as e:
+      # one failing collector should not take down the whole scrape
+      lines.append(f"# {metric.name} not collected: {repr(e)}")
+      continue
+    lines.append(f"# HELP {metric.name} {metric.help}")
+    lines.append(f"# TYPE {metric.name} {metric.kind}")
+    for suffix, labels, value in samples:
+      label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+      lines.append(f"{metric.name}{suffix}{{{label_text}}} {_format_value(value)}" if label_text else f"{metric.name}{suffix} {_format_value(value)}")
+  return "\n".join(lines) + "\n"
+
+def _escape(value):
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value):
+  if isinstance(value, bool):
+    return "1" if value else "0"
+  if isinstance(value, int):
+    return str(value)
+  return repr(float(value))
+
+STAGE_SECONDS = histogram(
+  "aapi_stage_seconds",
+  "Time spent per generation stage: model_load, prompt_encode, image_embed, denoise, vae_decode, image_encode, video_encode, file_write",
+  ("endpoint", "stage")
+)
+OUTPUTS_TOTAL = counter("aapi_outputs_total", "Images and videos written", ("endpoint", "kind"))
+JOB_SECONDS = histogram("aapi_job_seconds", "Time from a generation starting on the GPU thread to its result", ("endpoint",))
+JOBS_TOTAL = counter("aapi_jobs_total", "Generations run on the GPU thread, by outcome", ("endpoint", "status"))
+
+_local = threading.local()
+
+def current_endpoint():
+  return getattr(_local, "endpoint", "")
+
+def current_profile():
+  return getattr(_local, "profile", None)
+
+@contextmanager
+def endpoint_context(endpoint, profile=None):
+  """
+  Label stage timings and outputs recorded on this thread with `endpoint`, and also
+  hand them to `profile` (see profile_util.RequestProfile) when the request is profiled.
+  """
+  previous = (current_endpoint(), current_profile())
+  _local.endpoint = endpoint
+  _local.profile = profile
+  try:
+    yield
+  finally:
+    _local.endpoint, _local.profile = previous
+
+def observe_stage(stage, seconds, endpoint=None):
+  STAGE_SECONDS.observe(seconds, endpoint=endpoint or current_endpoint(), stage=stage)
+  profile = current_profile()
+  if profile is not None:
+    profile.stage(stage, seconds)
+
+@contextmanager
+def timed(stage):
+  """Record the duration of the block as `stage`; blocks that raise are not recorded."""
+  start = time.perf_counter()
+  yield
+  observe_stage(stage, time.perf_counter() - start)
+
+class PipelineTimer:
+  """
+  Splits one diffusers pipeline call into denoise and VAE decode time: `step` is called
+  from the step callback, so denoising ends at the last step and the rest of the call is
+  decoding the latents (and converting them to images).
+  """
+
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.last_step = None
+    self.profile = current_profile()
+    if self.profile is not None:
+      self.profile.pipeline_call()
+
+  def step(self):
+    now = time.perf_counter()
+    if self.profile is not None:
+      # the first step also includes the pipeline's setup before denoising
+      self.profile.step(now - (self.last_step or self.start))
+    self.last_step = now
+
+  def finish(self, decoded=True):
+    end = time.perf_counter()
+    denoised = self.last_step or end
+    observe_stage("denoise", denoised - self.start)
+    if decoded:
+      observe_stage("vae_decode", end - denoised)
+
+@contextmanager
+def pipeline_timer(decoded=True):
+  """Time a pipeline call made in the block; pass `timer` to `step_callback`. `decoded=False` for latent output."""
+  timer = PipelineTimer()
+  yield timer
+  timer.finish(decoded)
+
+def count_output(kind, endpoint=None):
+  OUTPUTS_TOTAL.inc(endpoint=endpoint or current_endpoint(), kind=kind)
@@ -0,0 +1,40 @@
+# Pipeline cache keys and LoRA parsing, kept out of sdxl_util and wan_util so request threads
+# (job submission, the models API) can use them without importing torch and diffusers
+
+def sdxl_cache_key(checkpoint_path, refiner_checkpoint_file_path):
+  return "|".join(["SDXL", checkpoint_path or "", refiner_checkpoint_file_path or ""])
+
+def wan_cache_key(gguf_path, is_image):
+  return "|".join(["WAN", gguf_path or "", "i2v" if is_image else "t2v"])
+
+def normalize_loras(raw_loras, default_strength):
+  if not raw_loras:
+    return []
+  normalized = []
+  for idx, item in enumerate(raw_loras):
+    if isinstance(item, str):
+      path = item
+      strength = default_strength
+    elif isinstance(item, dict):
+      path = item.get("path")
+      if path is None:
+        raise ValueError(f"loras[{idx}]: 'path' is required")
+      strength = item.get("strength", default_strength)
+    else:
+      raise ValueError(f"loras[{idx}]: must be a string or object")
+
+    if not isinstance(path, str) or not path:
+      raise ValueError(f"loras[{idx}]: 'path' must be a non-empty string")
+    try:
+      strength = int(strength)
+    except Exception:
+      raise ValueError(f"loras[{idx}]: 'strength' must be an integer")
+    if not (0 <= strength <= 100):
+      raise ValueError(f"loras[{idx}]: 'strength' must be between 0 and 100")
+
+    normalized.append({"path": path, "strength": strength})
+  return normalized
+
+def lora_cache_key(loras):
+  """Stable string for a normalized LoRA list, used in pipeline cache keys."""
+  return ",".join(f"{lora['path']}-{lora['strength']}" for lora in loras)
@@ -0,0 +1,136 @@
+from src.utils.logger import log
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class OllamaResponseCache:
+  """
+  SQLite cache of parsed Ollama responses, keyed by model, prompt, format schema and
+  options but not by URL, so every backend shares it. Entries expire after `ttl` seconds
+  (0 keeps them forever) and the least recently used are evicted above `max_entries`.
+  """
+
+  def __init__(self, db_path, ttl=7 * 24 * 3600, max_entries=10000):
+    self.db_path = db_path
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._db_lock = threading.Lock()
+
+    folder = os.path.dirname(db_path)
+    if folder:
+      os.makedirs(folder, exist_ok=True)
+
+    with self._connect() as conn:
+      conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS responses (
+          key TEXT PRIMARY KEY,
+          model TEXT NOT NULL,
+          response TEXT NOT NULL,
+          created_at REAL NOT NULL,
+          accessed_at REAL NOT NULL
+        )
+        """
+      )
+      conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+  def _connect(self):
+    return sqlite3.connect(self.db_path, timeout=30)
+
+  def get(self, key):
+    """Return the cached response for `key`, or None if missing or expired."""
+    now = time.time()
+    with self._db_lock, self._connect() as conn:
+      row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+      if row is not None and self.ttl and now - row[1] > self.ttl:
+        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        row = None
+
+      if row is None:
+        self.misses += 1
+        return None
+
+      conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+      self.hits += 1
+      return json.loads(row[0])
+
+  def set(self, key, model, response):
+    now = time.time()
+    with self._db_lock, self._connect() as conn:
+      conn.execute(
+        "INSERT OR REPLACE INTO responses (key, model, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+        (key, model, json.dumps(response), now, now)
+      )
+      count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+      if count > self.max_entries:
+        evicted = conn.execute(
+          "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+          (count - self.max_entries,)
+        ).rowcount
+        self.evictions += evicted
+
+  def clear(self):
+    with self._db_lock, self._connect() as conn:
+      conn.execute("DELETE FROM responses")
+
+  def stats(self):
+    with self._db_lock, self._connect() as conn:
+      entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    lookups = self.hits + self.misses
+    return {
+      "entries": entries,
+      "max_entries": self.max_entries,
+      "ttl": self.ttl,
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+      "hit_rate": self.hits / lookups if lookups else None
+    }
+
+def ollama_cache_key(model, prompt, format_schema=None, options=None, thinking=None, salt=None):
+  """
+  Cache key for an Ollama generation. `salt` tells apart calls that are otherwise identical
+  but are expected to give different answers, e.g. the n-th of several unseeded variations.
+  """
+  data = json.dumps(
+    {
+      "model": model,
+      "prompt": prompt,
+      "format": format_schema,
+      "options": options or {},
+      "thinking": thinking,
+      "salt": salt
+    },
+    sort_keys=True
+  )
+  return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_ollama_response_cache():
+  """Return the process-wide Ollama response cache, or None when OLLAMA_CACHE_PATH is not set."""
+  global _response_cache
+  db_path = os.getenv("OLLAMA_CACHE_PATH")
+  if not db_path:
+    return None
+
+  with _response_cache_lock:
+    if _response_cache is None:
+      _response_cache = OllamaResponseCache(
+        db_path,
+        ttl=float(os.getenv("OLLAMA_CACHE_TTL_HOURS", "168")) * 3600,
+        max_entries=int(os.getenv("OLLAMA_CACHE_MAX_ENTRIES", "10000"))
+      )
+      log(f"Ollama response cache at {db_path}")
+    return _response_cache
+
+def ollama_cache_stats():
+  cache = get_ollama_response_cache()
+  return cache.stats() if cache is not None else None
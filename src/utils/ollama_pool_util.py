@@ -0,0 +1,214 @@
+from contextlib import contextmanager
+from src.utils.logger import log
+from werkzeug.exceptions import ServiceUnavailable
+import os
+import requests
+import threading
+import time
+
+class OllamaBackend:
+  def __init__(self, url):
+    self.url = url
+    self.healthy = True
+    self.outstanding = 0
+    self.requests = 0
+    self.errors = 0
+    self.total_latency = 0.0
+    self.consecutive_failures = 0
+    self.loaded_models = set()
+    self.last_error = None
+    self.last_checked = None
+
+  @property
+  def generate_url(self):
+    return f"{self.url}/api/generate"
+
+  def has_model(self, model):
+    return model in self.loaded_models or f"{model}:latest" in self.loaded_models
+
+  def metrics(self):
+    completed = self.requests - self.errors
+    return {
+      "url": self.url,
+      "healthy": self.healthy,
+      "outstanding": self.outstanding,
+      "requests": self.requests,
+      "errors": self.errors,
+      "avg_latency_ms": round(self.total_latency / completed * 1000) if completed else None,
+      "loaded_models": sorted(self.loaded_models),
+      "last_error": self.last_error,
+      "last_checked": self.last_checked
+    }
+
+class OllamaPool:
+  """
+  Spreads Ollama calls over several backends. Each call goes to the healthy backend with
+  the fewest outstanding requests, where a backend that would have to load the model
+  first counts as `cold_penalty` extra requests.
+  A background thread polls /api/ps on every backend: after `max_failures` consecutive
+  failed checks or requests (errors other than 4xx responses) a backend is ejected, and it
+  is re-admitted on the next successful check.
+  """
+
+  def __init__(self, urls, health_interval=10, max_failures=3, cold_penalty=2, timeout=5):
+    self.backends = [OllamaBackend(normalize_backend_url(url)) for url in urls]
+    self.health_interval = health_interval
+    self.max_failures = max_failures
+    self.cold_penalty = cold_penalty
+    self.timeout = timeout
+    self._lock = threading.Lock()
+    self._session = requests.Session()
+    self._health_thread = None
+
+  def start(self):
+    if self._health_thread is not None:
+      return
+    self._health_thread = threading.Thread(target=self._health_loop, name="aapi-ollama-health", daemon=True)
+    self._health_thread.start()
+
+  def _pick(self, model, exclude=()):
+    healthy = [b for b in self.backends if b.healthy and b.url not in exclude]
+    if not healthy:
+      raise ServiceUnavailable("No healthy Ollama backends")
+    return min(healthy, key=lambda b: (
+      b.outstanding + (0 if b.has_model(model) else self.cold_penalty),
+      not b.has_model(model),
+      b.requests
+    ))
+
+  def call(self, model, send, used=None):
+    """
+    Return `send(backend)` from the best backend for `model`. On a refused connection,
+    timeout or 5xx the call is retried on the next healthy backend, once per backend,
+    and ServiceUnavailable is raised when every one has failed. 4xx errors are raised
+    right away. The URL of every backend tried is added to the `used` set.
+    """
+    tried = set()
+    while True:
+      try:
+        with self.backend(model, exclude=tried) as backend:
+          if used is not None:
+            used.add(backend.url)
+          return send(backend)
+      except ServiceUnavailable:
+        if not tried:
+          raise
+        raise ServiceUnavailable(f"All Ollama backends failed, last error: {backend.last_error}")
+      except requests.RequestException as e:
+        if is_client_error(e):
+          raise
+        tried.add(backend.url)
+        log(f"Ollama call to {backend.url} failed, trying another backend: {repr(e)}")
+
+  @contextmanager
+  def backend(self, model, exclude=()):
+    """Reserve a backend for one call to `model`, recording its latency and errors."""
+    with self._lock:
+      backend = self._pick(model, exclude)
+      backend.outstanding += 1
+      backend.requests += 1
+
+    start = time.perf_counter()
+    try:
+      yield backend
+    except requests.RequestException as e:
+      with self._lock:
+        backend.errors += 1
+        backend.last_error = repr(e)
+        # refused connections, timeouts and 5xx responses count towards ejection like failed
+        # health checks; 4xx responses are the caller's fault, not the backend's
+        if not is_client_error(e):
+          self._record_failure(backend)
+      raise
+    else:
+      with self._lock:
+        backend.total_latency += time.perf_counter() - start
+        backend.loaded_models.add(model)
+        backend.consecutive_failures = 0
+    finally:
+      with self._lock:
+        backend.outstanding -= 1
+
+  def unload(self, model, urls=None, timeout=None):
+    """
+    Unload `model` on the healthy backends in `urls` (default all of them), e.g. only those
+    one request used, so models other requests are using elsewhere stay loaded.
+    Ollama ignores this for models that are not loaded.
+    """
+    for backend in [b for b in self.backends if b.healthy and (urls is None or b.url in urls)]:
+      try:
+        self._session.post(backend.generate_url, json={"model": model, "keep_alive": 0}, timeout=timeout or self.timeout)
+        with self._lock:
+          backend.loaded_models.discard(model)
+      except requests.RequestException as e:
+        log(f"Could not unload {model} on {backend.url}: {repr(e)}")
+
+  def _record_failure(self, backend):
+    backend.consecutive_failures += 1
+    if backend.healthy and backend.consecutive_failures >= self.max_failures:
+      backend.healthy = False
+      log(f"Ejected Ollama backend {backend.url}: {backend.last_error}")
+
+  def check(self, backend):
+    """Poll /api/ps on `backend`, updating its health and loaded models."""
+    try:
+      resp = self._session.get(f"{backend.url}/api/ps", timeout=self.timeout)
+      resp.raise_for_status()
+      models = {m.get("name") or m.get("model") for m in resp.json().get("models", [])}
+    except Exception as e:
+      with self._lock:
+        backend.last_checked = time.time()
+        backend.last_error = repr(e)
+        self._record_failure(backend)
+      return False
+
+    with self._lock:
+      backend.last_checked = time.time()
+      backend.loaded_models = {m for m in models if m}
+      backend.consecutive_failures = 0
+      if not backend.healthy:
+        backend.healthy = True
+        log(f"Re-admitted Ollama backend {backend.url}")
+    return True
+
+  def _health_loop(self):
+    while True:
+      for backend in self.backends:
+        self.check(backend)
+      time.sleep(self.health_interval)
+
+  def metrics(self):
+    with self._lock:
+      return [b.metrics() for b in self.backends]
+
+def is_client_error(e):
+  response = getattr(e, "response", None)
+  return isinstance(e, requests.HTTPError) and response is not None and 400 <= response.status_code < 500
+
+def normalize_backend_url(url):
+  url = url.strip().rstrip("/")
+  if url.endswith("/api/generate"):
+    url = url[:-len("/api/generate")]
+  return url
+
+_ollama_pool = None
+_ollama_pool_lock = threading.Lock()
+
+def get_ollama_pool():
+  """Return the process-wide Ollama pool built from OLLAMA_BACKENDS, or None when it is not set."""
+  global _ollama_pool
+  urls = [u for u in os.getenv("OLLAMA_BACKENDS", "").split(",") if u.strip()]
+  if not urls:
+    return None
+
+  with _ollama_pool_lock:
+    if _ollama_pool is None:
+      _ollama_pool = OllamaPool(
+        urls,
+        health_interval=float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10")),
+        max_failures=int(os.getenv("OLLAMA_MAX_FAILURES", "3")),
+        cold_penalty=float(os.getenv("OLLAMA_COLD_PENALTY", "2"))
+      )
+      _ollama_pool.start()
+      log(f"Ollama pool with {len(urls)} backends")
+    return _ollama_pool
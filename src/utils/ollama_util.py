@@ -1,51 +1,152 @@
 # https://docs.ollama.com/api#generate-a-completion
 
-from flask import request, jsonify
+from requests.adapters import HTTPAdapter
+from src.utils.ollama_cache_util import get_ollama_response_cache, ollama_cache_key
+from src.utils.ollama_pool_util import get_ollama_pool
 import json
+import os
 import requests
-from typing import Optional
+import threading
 
-def call_ollama(
-  ollama_url: str,
-  model: str,
-  prompt: str,
-  format_schema = None,
-  thinking: bool = True,
-  stream: bool = False,
-  timeout: int = 300,
-  keep_alive: int = None
-):
+DEFAULT_OLLAMA_URL = "http://localhost:11434/api/generate"
+
+class OllamaClient:
   """
-  Call Ollama /api/generate endpoint with a prompt and optional format schema.
-  Returns parsed JSON response (raises for HTTP errors or JSON parsing issues).
+  Client for the Ollama /api/generate endpoint. Requests share a pooled session so
+  connections are reused, and at most `max_concurrency` requests are in flight at once
+  across all threads using the client.
+  Calls without an `ollama_url` go to the OLLAMA_BACKENDS pool when it is configured,
+  otherwise to a local Ollama.
   """
-  payload = {
-    "model": model,
-    "prompt": prompt,
-    "thinking": thinking,
-    "stream": stream
-  }
-  if format_schema is not None:
-    payload["format"] = format_schema
-  if keep_alive is not None:
-    payload["keep_alive"] = keep_alive
-
-  headers = {"Content-Type": "application/json"}
-  resp = requests.post(ollama_url, headers=headers, json=payload, timeout=timeout)
-  resp.raise_for_status()
-  resp_json = resp.json()
-
-  ## unload model before returning
-  requests.post(
-    ollama_url,
-    headers=headers,
-    json={
+
+  def __init__(self, max_concurrency=None, keep_alive=None, timeout=300):
+    self.max_concurrency = max_concurrency or int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+    self.keep_alive = keep_alive if keep_alive is not None else parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE"))
+    self.timeout = timeout
+
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_concurrency)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+    self._slots = threading.BoundedSemaphore(self.max_concurrency)
+
+  def generate(
+    self,
+    ollama_url: str,
+    model: str,
+    prompt: str,
+    format_schema = None,
+    thinking: bool = True,
+    stream: bool = False,
+    timeout: int = None,
+    keep_alive = None,
+    options: dict = None,
+    used_backends: set = None
+  ):
+    """
+    Call /api/generate with a prompt and optional format schema, blocking while the
+    client is at its concurrency limit. Returns the parsed response, see `parse_ollama_response`.
+    Pool backends the call went to are added to `used_backends`, see `OllamaPool.call`.
+    """
+    payload = {
       "model": model,
-      "keep_alive": 0
-    },
-    timeout=timeout
-  )
+      "prompt": prompt,
+      "thinking": thinking,
+      "stream": stream
+    }
+    if format_schema is not None:
+      payload["format"] = format_schema
+    if options:
+      payload["options"] = options
+
+    keep_alive = keep_alive if keep_alive is not None else self.keep_alive
+    if keep_alive is not None:
+      payload["keep_alive"] = keep_alive
+
+    with self._slots:
+      pool = get_ollama_pool() if not ollama_url else None
+      if pool is None:
+        return self._post_generate(ollama_url or DEFAULT_OLLAMA_URL, payload, timeout)
+
+      return pool.call(
+        model,
+        lambda backend: self._post_generate(backend.generate_url, payload, timeout),
+        used=used_backends
+      )
+
+  def _post_generate(self, url, payload, timeout):
+    resp = self.session.post(url, json=payload, timeout=timeout or self.timeout)
+    resp.raise_for_status()
+    return parse_ollama_response(resp.json())
+
+  def generate_cached(
+    self,
+    ollama_url: str,
+    model: str,
+    prompt: str,
+    format_schema = None,
+    thinking: bool = True,
+    timeout: int = None,
+    keep_alive = None,
+    options: dict = None,
+    cache_salt = None,
+    bypass_cache: bool = False,
+    used_backends: set = None
+  ):
+    """
+    Like `generate`, but served from the response cache when it is enabled.
+    Returns (response, from_cache). With `bypass_cache` the cache is neither read nor written.
+    """
+    cache = None if bypass_cache else get_ollama_response_cache()
+    if cache is not None:
+      key = ollama_cache_key(model, prompt, format_schema, options, thinking, cache_salt)
+      cached = cache.get(key)
+      if cached is not None:
+        return cached, True
 
+    response = self.generate(
+      ollama_url,
+      model,
+      prompt,
+      format_schema=format_schema,
+      thinking=thinking,
+      timeout=timeout,
+      keep_alive=keep_alive,
+      options=options,
+      used_backends=used_backends
+    )
+    if cache is not None:
+      cache.set(key, model, response)
+    return response, False
+
+  def unload(self, ollama_url: str, model: str, timeout: int = None, backends: set = None):
+    """
+    Ask Ollama to unload `model` now instead of waiting for its keep-alive to expire.
+    With a pool, only the `backends` given (URLs collected through `used_backends`) are asked.
+    """
+    pool = get_ollama_pool() if not ollama_url else None
+    if pool is not None:
+      pool.unload(model, urls=backends, timeout=timeout)
+      return True
+
+    with self._slots:
+      resp = self.session.post(
+        ollama_url or DEFAULT_OLLAMA_URL,
+        json={"model": model, "keep_alive": 0},
+        timeout=timeout or self.timeout
+      )
+    return resp.ok
+
+def parse_keep_alive(value):
+  """Ollama accepts durations like "5m" or a number of seconds (negative keeps the model loaded)."""
+  if value is None or value == "":
+    return None
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return str(value)
+
+def parse_ollama_response(resp_json):
   # Ollama returns a field like resp_json["response"] which is a stringified JSON when using format
   # If format was provided try to parse resp_json["response"], otherwise return entire resp_json
   if isinstance(resp_json, dict) and "response" in resp_json:
@@ -55,3 +156,65 @@ def call_ollama(
       # If it's not JSON, return the raw response field
       return {"response": resp_json["response"]}
   return resp_json
+
+_ollama_client = None
+_ollama_client_lock = threading.Lock()
+
+def get_ollama_client():
+  """Return the process-wide Ollama client, configured from the environment on first use."""
+  global _ollama_client
+  with _ollama_client_lock:
+    if _ollama_client is None:
+      _ollama_client = OllamaClient()
+    return _ollama_client
+
+def call_ollama(
+  ollama_url: str,
+  model: str,
+  prompt: str,
+  format_schema = None,
+  thinking: bool = True,
+  stream: bool = False,
+  timeout: int = 300,
+  keep_alive: int = None,
+  unload: bool = True,
+  bypass_cache: bool = False
+):
+  """
+  Call Ollama /api/generate endpoint with a prompt and optional format schema.
+  Returns parsed JSON response (raises for HTTP errors or JSON parsing issues).
+  With `unload` the model is unloaded before returning; batch callers should use
+  `get_ollama_client()` directly and unload once at the end.
+  Non-streaming calls go through the response cache when it is enabled.
+  """
+  client = get_ollama_client()
+  used_backends = set()
+  if stream:
+    result = client.generate(
+      ollama_url,
+      model,
+      prompt,
+      format_schema=format_schema,
+      thinking=thinking,
+      stream=stream,
+      timeout=timeout,
+      keep_alive=keep_alive,
+      used_backends=used_backends
+    )
+  else:
+    result, from_cache = client.generate_cached(
+      ollama_url,
+      model,
+      prompt,
+      format_schema=format_schema,
+      thinking=thinking,
+      timeout=timeout,
+      keep_alive=keep_alive,
+      bypass_cache=bypass_cache,
+      used_backends=used_backends
+    )
+    if from_cache:
+      return result
+  if unload:
+    client.unload(ollama_url, model, timeout=timeout, backends=used_backends)
+  return result
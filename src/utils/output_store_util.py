@@ -0,0 +1,57 @@
+import hashlib
+import json
+import os
+import re
+import uuid
+
+# `<base>.tmp-<32 hex><ext>`, see temp_output_path
+_TEMP_NAME = re.compile(r"\.tmp-[0-9a-f]{32}\.[^.]+$")
+
+def generation_id(params, keys=None):
+  """
+  Deterministic id for a generation: a hash of the parameters that decide its output
+  (`keys` of `params`, or all of them). The same model, LoRAs, prompt, seed, size and steps
+  always give the same id, and any difference gives a different one.
+  """
+  if keys is not None:
+    params = {k: params.get(k) for k in keys}
+  data = json.dumps(params, sort_keys=True, default=str, ensure_ascii=False)
+  return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+# parameters holding input file paths; their file's modification time is hashed with them
+INPUT_FILE_KEYS = ("checkpoint_file_path", "refiner_checkpoint_file_path", "gguf_path", "reference_image_path")
+
+def file_key(path):
+  """[absolute path, mtime] of an input file, so an edited or replaced file gives a new id."""
+  if not path or not os.path.isfile(path):
+    return [path, None]
+  return [os.path.abspath(path), os.path.getmtime(path)]
+
+def with_file_keys(params):
+  """Copy of `params` with model, LoRA and input image paths replaced by their `file_key`."""
+  params = dict(params)
+  for key in INPUT_FILE_KEYS:
+    if params.get(key):
+      params[key] = file_key(params[key])
+  if params.get("loras"):
+    params["loras"] = [{**lora, "path": file_key(lora["path"])} for lora in params["loras"]]
+  return params
+
+def output_path(folder, prefix, suffix, gen_id, ext):
+  """`<prefix>-<id>-<suffix><ext>` inside `folder`, creating the folder if needed."""
+  parts = [p for p in (prefix, gen_id, suffix) if p]
+  os.makedirs(folder, exist_ok=True)
+  return os.path.join(folder, "-".join(parts) + ext)
+
+def temp_output_path(path):
+  """Temporary name next to `path` for writing it atomically; the extension is kept so encoders can still infer the format."""
+  base, ext = os.path.splitext(path)
+  return f"{base}.tmp-{uuid.uuid4().hex}{ext}"
+
+def is_temp_output(name):
+  """True for a temporary file left by an interrupted write, which input and metadata scans skip."""
+  return _TEMP_NAME.search(name) is not None
+
+def existing_output(path):
+  """True when a finished output is already at `path`; writes are atomic so a file there is complete."""
+  return os.path.isfile(path) and os.path.getsize(path) > 0
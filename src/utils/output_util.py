@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.logger import log
+from src.utils.lazy_util import lazy_import
+from src.utils.metadata_util import OUTPUT_KINDS, index_output
+from src.utils.output_store_util import temp_output_path
+from src.utils.metrics_util import count_output, current_endpoint, current_profile, endpoint_context, timed
+from src.utils.progress_util import get_listener
+import io
+import json
+import os
+import threading
+
+diffusers_utils = lazy_import("diffusers.utils")
+
+class OutputWriter:
+  """
+  Encodes and writes finished outputs on a small thread pool so the GPU can start the
+  next generation right away. At most `max_pending` outputs are held in memory: `submit`
+  blocks until a slot frees up. `wait` blocks until everything is written and returns
+  the writes that failed. A "file" event is emitted to the creating thread's progress
+  listener as each output finishes writing.
+  """
+
+  def __init__(self, max_workers=None, max_pending=None):
+    max_workers = max_workers or int(os.getenv("OUTPUT_WRITER_THREADS", "2"))
+    max_pending = max_pending or int(os.getenv("OUTPUT_WRITER_MAX_PENDING", "4"))
+
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="aapi-writer")
+    self._slots = threading.BoundedSemaphore(max_pending)
+    self._pending = []
+    self._listener = get_listener()
+    self._endpoint = current_endpoint()
+    self._profile = current_profile()
+
+  def submit(self, path, fn, *args, **kwargs):
+    """Run `fn(*args, **kwargs)` in the background; `path` identifies the output in errors."""
+    self._slots.acquire()
+    try:
+      future = self._executor.submit(self._run, path, fn, args, kwargs)
+    except BaseException:
+      self._slots.release()
+      raise
+    self._pending.append((path, future))
+    return future
+
+  def _run(self, path, fn, args, kwargs):
+    try:
+      with endpoint_context(self._endpoint, self._profile):
+        result = fn(*args, **kwargs)
+    finally:
+      self._slots.release()
+
+    if self._listener is not None:
+      self._listener("file", {"path": path})
+    return result
+
+  def wait(self):
+    """Wait for all submitted writes and return [{"path", "error"}] for the ones that failed."""
+    errors = []
+    pending, self._pending = self._pending, []
+    for path, future in pending:
+      try:
+        future.result()
+      except Exception as e:
+        log(f"Failed to write {path}: {repr(e)}")
+        errors.append({"path": path, "error": repr(e)})
+    return errors
+
+  def close(self):
+    errors = self.wait()
+    self._executor.shutdown(wait=True)
+    return errors
+
+def atomic_write(path, write):
+  """
+  Call `write(tmp_path)` for a temporary file next to `path` and rename it into place, so
+  `path` only ever holds a complete file. The temporary file is removed if `write` fails.
+  """
+  tmp_path = temp_output_path(path)
+  try:
+    write(tmp_path)
+    os.replace(tmp_path, path)
+  finally:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+
+def write_bytes(data, path):
+  def write(tmp_path):
+    with open(tmp_path, "wb") as f:
+      f.write(data)
+
+  with timed("file_write"):
+    atomic_write(path, write)
+
+def write_image(image, path):
+  # encoded in memory first so PNG compression and disk time are measured separately
+  with timed("image_encode"):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+  write_bytes(buffer.getvalue(), path)
+
+def write_json(data, path):
+  write_bytes(json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"), path)
+
+def write_video(frames, path, fps):
+  # the encoder streams to the file, so this includes writing it
+  with timed("video_encode"):
+    atomic_write(path, lambda tmp_path: diffusers_utils.export_to_video(frames, tmp_path, fps=fps))
+
+def write_with_sidecar(write_output, output, path, metadata, *args):
+  """Write an output file, then its metadata to a .json file with the same base name, and index it."""
+  write_output(output, path, *args)
+  sidecar = os.path.splitext(path)[0] + ".json"
+  write_json(metadata, sidecar)
+  index_output(path, metadata, sidecar)
+  count_output(OUTPUT_KINDS.get(os.path.splitext(path)[1].lower(), "other"))
+
+def write_with_index(write_output, output, path, metadata, *args):
+  """Write an output file and add its metadata to the index without writing a sidecar."""
+  write_output(output, path, *args)
+  index_output(path, metadata)
+  count_output(OUTPUT_KINDS.get(os.path.splitext(path)[1].lower(), "other"))
+
+def with_write_errors(response, write_errors):
+  """Drop outputs that failed to write from the response lists and report the errors."""
+  if not write_errors:
+    return response
+
+  failed = {e["path"] for e in write_errors}
+  for key, value in response.items():
+    if isinstance(value, list):
+      response[key] = [f for f in value if f not in failed]
+  response["write_errors"] = write_errors
+  return response
@@ -0,0 +1,113 @@
+from src.utils.endpoint_util import normalize_path
+from src.utils.lazy_util import lazy_import
+from src.utils.logger import log
+import cProfile
+import os
+import threading
+import time
+
+# step timings are listed for this many pipeline calls, later calls are only summarized
+MAX_LISTED_CALLS = 8
+
+class RequestProfile:
+  """
+  Collects the stage timings and per-step denoise timings of one profiled request, fed by
+  metrics_util while the request runs (on the GPU thread and in its output writers).
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.stages = {}
+    self.calls = []
+
+  def stage(self, stage, seconds):
+    with self._lock:
+      count, total = self.stages.get(stage, (0, 0.0))
+      self.stages[stage] = (count + 1, total + seconds)
+
+  def pipeline_call(self):
+    with self._lock:
+      self.calls.append([])
+
+  def step(self, seconds):
+    with self._lock:
+      if self.calls:
+        self.calls[-1].append(seconds)
+
+  def summary(self, total_seconds):
+    with self._lock:
+      stages = dict(self.stages)
+      calls = [list(c) for c in self.calls]
+
+    steps = [s for call in calls for s in call]
+    return {
+      "total_seconds": round(total_seconds, 3),
+      "phases": {
+        stage: {"count": count, "seconds": round(total, 3)}
+        for stage, (count, total) in sorted(stages.items(), key=lambda item: item[1][1], reverse=True)
+      },
+      "steps": {
+        "pipeline_calls": len(calls),
+        "count": len(steps),
+        "mean_ms": round(sum(steps) / len(steps) * 1000, 1) if steps else None,
+        "min_ms": round(min(steps) * 1000, 1) if steps else None,
+        "max_ms": round(max(steps) * 1000, 1) if steps else None,
+        # the first step of each call includes the pipeline's setup
+        "per_call_ms": [[round(s * 1000, 1) for s in call] for call in calls[:MAX_LISTED_CALLS]]
+      }
+    }
+
+def run_profiled(job_type, payload, handler, profile):
+  """
+  Run `handler(payload)` under cProfile and, when available, torch.profiler, write both
+  next to the outputs, and add a timing breakdown and the artifact paths to the result.
+  """
+  folder = normalize_path(payload.get("output_folder_path") or "output")
+  os.makedirs(folder, exist_ok=True)
+  base = os.path.join(folder, f"profile-{job_type}-{int(time.time() * 1000)}")
+
+  torch_profiler = _torch_profiler()
+  profiler = cProfile.Profile()
+  start = time.perf_counter()
+
+  if torch_profiler is not None:
+    torch_profiler.start()
+  profiler.enable()
+  try:
+    result = handler(payload)
+  finally:
+    profiler.disable()
+    if torch_profiler is not None:
+      torch_profiler.stop()
+  total_seconds = time.perf_counter() - start
+
+  artifacts = {}
+  try:
+    profiler.dump_stats(f"{base}.prof")
+    artifacts["cprofile"] = f"{base}.prof"
+  except Exception as e:
+    log(f"Could not write cProfile stats {base}.prof: {repr(e)}")
+  if torch_profiler is not None:
+    try:
+      torch_profiler.export_chrome_trace(f"{base}.trace.json")
+      artifacts["torch_trace"] = f"{base}.trace.json"
+    except Exception as e:
+      log(f"Could not write torch trace {base}.trace.json: {repr(e)}")
+
+  summary = profile.summary(total_seconds)
+  log(f"Profiled {job_type} in {summary['total_seconds']}s: {artifacts}")
+  if isinstance(result, dict):
+    result["profile"] = {**summary, **artifacts}
+  return result
+
+def _torch_profiler():
+  """A torch.profiler recording CPU (and CUDA, if present) activity, or None without torch."""
+  try:
+    torch = lazy_import("torch")
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+      activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(activities=activities)
+  except ImportError as e:
+    log(f"torch.profiler not available, only cProfile is captured: {repr(e)}")
+    return None
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+import threading
+
+_local = threading.local()
+
+def get_listener():
+  return getattr(_local, "listener", None)
+
+@contextmanager
+def listen(listener):
+  """
+  Route `emit` calls made on this thread to `listener(event, data)` for the duration of the block.
+  Used by the job worker to record progress; outside of a listener `emit` is a no-op.
+  """
+  previous = get_listener()
+  _local.listener = listener
+  try:
+    yield
+  finally:
+    _local.listener = previous
+
+def emit(event, **data):
+  listener = get_listener()
+  if listener is not None:
+    listener(event, data)
+
+def step_callback(timer=None, **info):
+  """
+  Return a diffusers `callback_on_step_end` that emits a "step" event after every
+  denoising step and marks the step on `timer` (see metrics_util.PipelineTimer),
+  or None when there is neither a listener nor a timer so the pipeline skips the hook.
+  """
+  listener = get_listener()
+  if listener is None and timer is None:
+    return None
+
+  def callback(pipe, step, timestep, callback_kwargs):
+    if timer is not None:
+      timer.step()
+    if listener is not None:
+      listener("step", {"step": step + 1, "total": getattr(pipe, "num_timesteps", None), **info})
+    return callback_kwargs
+
+  return callback
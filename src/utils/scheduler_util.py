@@ -0,0 +1,73 @@
+from collections import deque
+import threading
+
+def pick_next_job(pending, current_key, max_skips):
+  """
+  Choose which queued job runs next.
+  `pending` is a list of dicts with `key`, `priority` and `skips`, ordered by submission.
+  Jobs passed over `max_skips` times run first (oldest first) so no group starves.
+  Otherwise the highest priority wins, and within it jobs sharing the currently loaded
+  pipeline key run before others so each group of jobs runs back to back.
+  """
+  if not pending:
+    return None
+
+  for job in pending:
+    if job["skips"] >= max_skips:
+      return job
+
+  top = max(job["priority"] for job in pending)
+  candidates = [job for job in pending if job["priority"] == top]
+
+  if current_key is not None:
+    for job in candidates:
+      if job["key"] == current_key:
+        return job
+
+  return candidates[0]
+
+def count_switches(keys):
+  """Number of pipeline changes needed to run jobs with these keys in order."""
+  switches = 0
+  previous = None
+  for key in keys:
+    if key is not None and key != previous:
+      switches += 1
+    previous = key
+  return switches
+
+class ScheduleStats:
+  """
+  Tracks the pipeline keys of executed jobs to report how many pipeline switches
+  (model loads) the reordering saved compared with running the same jobs in submission order.
+  """
+
+  def __init__(self, history=1000):
+    self._lock = threading.Lock()
+    self._executed = deque(maxlen=history)
+    self.jobs = 0
+    self.reordered = 0
+
+  def record(self, submitted_at, key, reordered):
+    with self._lock:
+      self._executed.append((submitted_at, key))
+      self.jobs += 1
+      if reordered:
+        self.reordered += 1
+
+  def stats(self):
+    with self._lock:
+      executed = list(self._executed)
+      jobs = self.jobs
+      reordered = self.reordered
+
+    switches = count_switches(key for _, key in executed)
+    fifo_switches = count_switches(key for _, key in sorted(executed, key=lambda item: item[0]))
+    return {
+      "jobs": jobs,
+      "reordered_jobs": reordered,
+      "window": len(executed),
+      "pipeline_switches": switches,
+      "fifo_pipeline_switches": fifo_switches,
+      "model_loads_saved": fifo_switches - switches
+    }
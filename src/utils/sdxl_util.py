@@ -1,10 +1,49 @@
 # https://huggingface.co/docs/diffusers/api/pipelines/stable_diffusion/stable_diffusion_xl
 
 from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline, KDPM2DiscreteScheduler
+from sd_embed.embedding_funcs import get_weighted_text_embeddings_sdxl
+from src.utils.cache_util import cache_get_or_load
+from src.utils.embedding_util import get_embedding_cache
+from src.utils.lora_util import apply_loras
+from src.utils.metrics_util import timed
+from src.utils.model_key_util import sdxl_cache_key, lora_cache_key
 from typing import Optional, List
+import json
 import os
+import threading
 import torch
 
+_sdxl_mode_lock = threading.Lock()
+
+def get_cached_sdxl_pipe(checkpoint_path, refiner_checkpoint_file_path, loras, is_img2img):
+  """
+  Return (sdxl_pipe, refiner_sdxl_pipe) for the requested mode from the model cache.
+  Checkpoints are parsed once per cache entry; the txt2img and img2img pipelines are
+  built with `from_pipe` so both modes share the same UNet, VAE and text encoders.
+  LoRAs are not part of the cache key, they are swapped in place on the cached pipeline.
+  """
+  mode = "img2img" if is_img2img else "txt2img"
+
+  def load():
+    with timed("model_load"):
+      return {mode: get_sdxl_pipe(checkpoint_path, refiner_checkpoint_file_path, loras, is_img2img)}
+
+  pipes = cache_get_or_load(sdxl_cache_key(checkpoint_path, refiner_checkpoint_file_path), load)
+
+  with _sdxl_mode_lock:
+    if mode not in pipes:
+      sdxl_pipe, refiner_sdxl_pipe = next(iter(pipes.values()))
+      pipe_class = StableDiffusionXLImg2ImgPipeline if is_img2img else StableDiffusionXLPipeline
+      pipes[mode] = (
+        pipe_class.from_pipe(sdxl_pipe),
+        pipe_class.from_pipe(refiner_sdxl_pipe) if refiner_sdxl_pipe else None
+      )
+    sdxl_pipe, refiner_sdxl_pipe = pipes[mode]
+
+  apply_loras(sdxl_pipe, loras)
+
+  return sdxl_pipe, refiner_sdxl_pipe
+
 def get_sdxl_pipe(checkpoint_path, refiner_checkpoint_file_path, loras, is_img2img):
   sdxl_pipe = None
   refiner_sdxl_pipe = None
@@ -16,16 +55,7 @@ def get_sdxl_pipe(checkpoint_path, refiner_checkpoint_file_path, loras, is_img2i
 
   sdxl_pipe.scheduler = KDPM2DiscreteScheduler.from_config(sdxl_pipe.scheduler.config)
 
-  adapter_names = []
-  adapter_weights = []
-  for lora in loras:
-    sdxl_pipe.load_lora_weights(lora["path"], adapter_name=keep_alnum(lora["path"]))
-    adapter_names.append(keep_alnum(lora["path"]))
-    adapter_weights.append(lora["strength"] / 100)
-  
-  if loras:
-    sdxl_pipe.set_adapters(adapter_names, adapter_weights=adapter_weights)
-    sdxl_pipe.set_lora_device(adapter_names=adapter_names, device="cuda:0")
+  apply_loras(sdxl_pipe, loras)
 
   sdxl_pipe.to(device="cuda", dtype=torch.float16)
 
@@ -47,34 +77,40 @@ def get_sdxl_pipe(checkpoint_path, refiner_checkpoint_file_path, loras, is_img2i
 
   return sdxl_pipe, refiner_sdxl_pipe
 
-def normalize_loras(raw_loras, default_strength):
-  if not raw_loras:
-    return []
-  normalized = []
-  for idx, item in enumerate(raw_loras):
-    if isinstance(item, str):
-      path = item
-      strength = default_strength
-    elif isinstance(item, dict):
-      path = item.get("path")
-      if path is None:
-        raise ValueError(f"loras[{idx}]: 'path' is required")
-      strength = item.get("strength", default_strength)
-    else:
-      raise ValueError(f"loras[{idx}]: must be a string or object")
-
-    if not isinstance(path, str) or not path:
-      raise ValueError(f"loras[{idx}]: 'path' must be a non-empty string")
-    try:
-      strength = int(strength)
-    except Exception:
-      raise ValueError(f"loras[{idx}]: 'strength' must be an integer")
-    if not (0 <= strength <= 100):
-      raise ValueError(f"loras[{idx}]: 'strength' must be between 0 and 100")
-
-    normalized.append({"path": path, "strength": strength})
-  return normalized
-
-def keep_alnum(s: str) -> str:
-  """Return string with only ASCII letters and digits preserved."""
-  return "".join(ch for ch in s if ch.isalnum())
\ No newline at end of file
+def get_sdxl_prompt_embeds(sdxl_pipe, encoder_key, prompt, negative_prompt):
+  """
+  Cached `get_weighted_text_embeddings_sdxl`, returning
+  (prompt_embeds, negative_prompt_embeds, pooled_prompt_embeds, negative_pooled_prompt_embeds).
+  `encoder_key` identifies the text encoder weights, see `sdxl_text_encoder_key`.
+  """
+  def encode():
+    with timed("prompt_encode"):
+      return get_weighted_text_embeddings_sdxl(sdxl_pipe, prompt = prompt, neg_prompt = negative_prompt)
+
+  return get_embedding_cache("sdxl").get_or_compute(
+    json.dumps([encoder_key, prompt, negative_prompt]),
+    encode,
+    device=sdxl_pipe.device
+  )
+
+def sdxl_text_encoder_key(checkpoint_path, loras):
+  """Identity of the text encoders: checkpoint file plus the LoRA set, since LoRAs can patch the encoders."""
+  mtime = os.path.getmtime(checkpoint_path) if checkpoint_path and os.path.isfile(checkpoint_path) else None
+  return "|".join([os.path.abspath(checkpoint_path or ""), str(mtime), lora_cache_key(loras)])
+
+def auto_batch_size(width, height, max_batch_size=8):
+  """
+  Pick how many images of this size to denoise in one pipeline call.
+  The memory budget is SDXL_BATCH_MEMORY_GB when set, otherwise 80% of free device memory,
+  divided by an estimated SDXL_BATCH_GB_PER_MEGAPIXEL per image.
+  """
+  budget_gb = os.getenv("SDXL_BATCH_MEMORY_GB")
+  if budget_gb:
+    budget = float(budget_gb) * 2**30
+  else:
+    free, _ = torch.cuda.mem_get_info()
+    budget = free * 0.8
+
+  per_image = float(os.getenv("SDXL_BATCH_GB_PER_MEGAPIXEL", "1.5")) * 2**30 * (width * height / 2**20)
+
+  return max(1, min(max_batch_size, int(budget // per_image)))
@@ -0,0 +1,47 @@
+from flask import Response
+from src.utils.job_util import run_job
+from src.utils.progress_util import listen
+from werkzeug.exceptions import HTTPException
+import json
+import queue
+import threading
+import time
+
+def stream_job(job_type, payload):
+  """
+  Run a job on a background thread and stream its progress as Server-Sent Events.
+  Every event emitted while the job runs (progress, step, file, segment) is forwarded
+  with the seconds elapsed since the request started, followed by a final "result"
+  or "error" event.
+  """
+  events = queue.Queue()
+  started = time.perf_counter()
+
+  def on_event(event, data):
+    events.put((event, {**data, "elapsed": round(time.perf_counter() - started, 3)}))
+
+  def run():
+    try:
+      with listen(on_event):
+        result = run_job(job_type, payload)
+      on_event("result", result)
+    except Exception as e:
+      on_event("error", {"error": e.description if isinstance(e, HTTPException) else repr(e)})
+    finally:
+      events.put(None)
+
+  threading.Thread(target=run, name=f"aapi-stream-{job_type}", daemon=True).start()
+
+  def generate():
+    while True:
+      item = events.get()
+      if item is None:
+        return
+      event, data = item
+      yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+  return Response(
+    generate(),
+    mimetype="text/event-stream",
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+  )
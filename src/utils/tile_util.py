@@ -0,0 +1,103 @@
+from PIL import Image
+import numpy as np
+
+def tile_starts(length, tile, overlap):
+  """Start offsets of tiles of size `tile` covering `length`, the last one flush with the end."""
+  if tile >= length:
+    return [0]
+  if overlap >= tile:
+    raise ValueError(f"Tile overlap {overlap} must be smaller than the tile size {tile}")
+  stride = tile - overlap
+  starts = list(range(0, length - tile, stride))
+  starts.append(length - tile)
+  return starts
+
+def compute_tiles(width, height, tile_size, overlap, multiple=8):
+  """
+  Split a width x height canvas into overlapping (x, y, w, h) tiles. Every tile has the
+  same size, at most `tile_size` and a multiple of `multiple`, so tiles can be batched.
+  The canvas must be a multiple of `multiple` too, or the tiles could not cover it exactly.
+  """
+  if width % multiple or height % multiple:
+    raise ValueError(f"Image size {width}x{height} must be a multiple of {multiple} to be tiled")
+
+  tile_w = max(multiple, min(tile_size, width) // multiple * multiple)
+  tile_h = max(multiple, min(tile_size, height) // multiple * multiple)
+
+  return [
+    (x, y, tile_w, tile_h)
+    for y in tile_starts(height, tile_h, overlap)
+    for x in tile_starts(width, tile_w, overlap)
+  ]
+
+def feather_weights(box, width, height, overlap):
+  """
+  Per-pixel blend weights for a tile: a linear ramp across the overlap on every side that
+  borders another tile, and flat weight on sides at the canvas edge.
+  """
+  x, y, w, h = box
+
+  def ramp(size, fade_start, fade_end):
+    weights = np.ones(size, dtype=np.float32)
+    if overlap <= 0:
+      return weights
+    n = min(overlap, size)
+    # never exactly 0 so pixels covered by a single tile keep a valid weight
+    fade = (np.arange(n, dtype=np.float32) + 1) / (n + 1)
+    if fade_start:
+      weights[:n] = np.minimum(weights[:n], fade)
+    if fade_end:
+      weights[-n:] = np.minimum(weights[-n:], fade[::-1])
+    return weights
+
+  wx = ramp(w, x > 0, x + w < width)
+  wy = ramp(h, y > 0, y + h < height)
+  return np.outer(wy, wx)
+
+class TileBlender:
+  """Accumulates processed tiles into a canvas, averaging overlaps with feathered weights."""
+
+  def __init__(self, width, height, overlap, channels=3):
+    self.width = width
+    self.height = height
+    self.overlap = overlap
+    self.total = np.zeros((height, width, channels), dtype=np.float32)
+    self.weight = np.zeros((height, width, 1), dtype=np.float32)
+
+  def add(self, box, tile):
+    x, y, w, h = box
+    tile = np.asarray(tile, dtype=np.float32)
+    if tile.shape[:2] != (h, w):
+      raise ValueError(f"Tile is {tile.shape[1]}x{tile.shape[0]}, expected {w}x{h}")
+    if tile.ndim == 2:
+      tile = tile[:, :, None]
+
+    weights = feather_weights(box, self.width, self.height, self.overlap)[:, :, None]
+    self.total[y:y + h, x:x + w] += tile * weights
+    self.weight[y:y + h, x:x + w] += weights
+
+  def result(self):
+    return self.total / np.maximum(self.weight, 1e-8)
+
+def upscale_tiled(image, process_tiles, tile_size, overlap, batch_size=1, on_tile=None):
+  """
+  Run `process_tiles(list of PIL tiles) -> list of PIL tiles` over overlapping tiles of
+  `image` in batches of `batch_size` and blend the results back into one image, so memory
+  in `process_tiles` depends on the tile size rather than the image size.
+  """
+  width, height = image.size
+  tiles = compute_tiles(width, height, tile_size, overlap)
+  blender = TileBlender(width, height, overlap, channels=len(image.getbands()))
+
+  for start in range(0, len(tiles), batch_size):
+    boxes = tiles[start:start + batch_size]
+    crops = [image.crop((x, y, x + w, y + h)) for x, y, w, h in boxes]
+    for box, tile in zip(boxes, process_tiles(crops)):
+      blender.add(box, tile)
+    if on_tile is not None:
+      on_tile(min(start + batch_size, len(tiles)), len(tiles))
+
+  pixels = np.clip(np.rint(blender.result()), 0, 255).astype(np.uint8)
+  if pixels.shape[2] == 1:
+    pixels = pixels[:, :, 0]
+  return Image.fromarray(pixels)
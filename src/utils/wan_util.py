@@ -10,15 +10,100 @@ import torch
 from diffusers.hooks.group_offloading import apply_group_offloading
 from diffusers import WanPipeline, WanImageToVideoPipeline, AutoencoderKLWan, GGUFQuantizationConfig, WanTransformer3DModel
 from transformers import UMT5EncoderModel, CLIPVisionModel
-
+from src.utils.cache_util import cache_get_or_load
+from src.utils.embedding_util import get_embedding_cache
+from src.utils.lora_util import apply_loras
+from src.utils.metrics_util import timed
+from src.utils.model_key_util import wan_cache_key
+from PIL import Image
+
+import hashlib
+import json
+import numpy as np
 import os
 os.environ["TOKENIZERS_PARALLELISM"]="false"
 
+# Both Wan pipelines load these encoders, and Wan LoRAs only patch the transformer,
+# so cached embeddings are shared across gguf files and LoRA sets
+WAN_TEXT_ENCODER = "chatpig/umt5xxl-encoder-gguf/umt5xxl-encoder-q8_0.gguf"
+WAN_IMAGE_ENCODER = "Wan-AI/Wan2.1-I2V-14B-720P-Diffusers/image_encoder"
+
+def get_wan_prompt_embeds(pipeline, prompt, negative_prompt, do_classifier_free_guidance, max_sequence_length=512):
+  """
+  Cached `pipeline.encode_prompt`, returning (prompt_embeds, negative_prompt_embeds).
+  negative_prompt_embeds is None without classifier free guidance, like the pipeline itself.
+  """
+  def encode():
+    with timed("prompt_encode"):
+      return pipeline.encode_prompt(
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        do_classifier_free_guidance=do_classifier_free_guidance,
+        num_videos_per_prompt=1,
+        max_sequence_length=max_sequence_length,
+        device=pipeline._execution_device
+      )
+
+  return get_embedding_cache("wan_text").get_or_compute(
+    json.dumps([WAN_TEXT_ENCODER, prompt, negative_prompt, do_classifier_free_guidance, max_sequence_length]),
+    encode,
+    device=pipeline._execution_device
+  )
+
+def get_wan_image_embeds(pipeline, image_key, image):
+  """
+  Cached CLIP vision embeds for an I2V conditioning image, or None when the pipeline
+  does not use an image encoder. `image_key` must identify the image contents.
+  """
+  if getattr(pipeline, "image_encoder", None) is None:
+    return None
+
+  def encode():
+    with timed("image_embed"):
+      return (pipeline.encode_image(image, pipeline._execution_device),)
+
+  image_embeds, = get_embedding_cache("wan_image").get_or_compute(
+    json.dumps([WAN_IMAGE_ENCODER, image_key]),
+    encode,
+    device=pipeline._execution_device
+  )
+  return image_embeds
+
+def image_file_key(path):
+  return f"{os.path.abspath(path)}|{os.path.getmtime(path)}"
+
+def image_content_key(image):
+  """Embedding cache key for an in-memory image, e.g. the last frame of a previous segment."""
+  digest = hashlib.sha256(image.tobytes()).hexdigest()
+  return f"{image.mode}|{image.size[0]}x{image.size[1]}|{digest}"
+
+def last_frame_image(frames):
+  """The final frame of a pipeline output (PIL frames or a float/uint8 array) as an RGB image."""
+  frame = frames[-1]
+  if isinstance(frame, Image.Image):
+    return frame.convert("RGB")
+
+  frame = np.asarray(frame)
+  if frame.dtype != np.uint8:
+    frame = (np.clip(frame, 0, 1) * 255).round().astype(np.uint8)
+  return Image.fromarray(frame).convert("RGB")
+
+def get_cached_wan_pipe(gguf_path, loras, is_image):
+  """
+  Return the Wan pipeline for `gguf_path` from the model cache.
+  LoRAs are not part of the cache key, they are swapped in place on the cached pipeline.
+  """
+  def load():
+    with timed("model_load"):
+      return get_wan_pipe(gguf_path, loras, is_image)
+
+  pipeline = cache_get_or_load(wan_cache_key(gguf_path, is_image), load)
+  return load_loras(pipeline, loras)
+
 def get_wan_pipe(
   gguf_path,
   loras,
-  is_image,
-  segment_index
+  is_image
 ):
   if is_image:
     transformer = WanTransformer3DModel.from_single_file(
@@ -126,34 +211,16 @@ def get_wan_pipe(
       torch_dtype=torch.bfloat16
     )
 
-  return load_loras(pipeline, loras, segment_index)
-
-def load_loras(pipeline, loras, segment_index):
-  adapter_names = []
-  adapter_weights = []
-
-  if loras:
-    for i, lora in enumerate(loras):
-      if segment_index and segment_index > -1:
-        try:
-          pipeline.load_lora_weights(lora["path"], adapter_name=keep_alnum(f"lora-{i}"), hotswap=True)
-        except:
-          pipeline.load_lora_weights(lora["path"], adapter_name=keep_alnum(f"lora-{i}"))
+  return load_loras(pipeline, loras, move_to_device=True)
 
-        adapter_names.append(keep_alnum(f"lora-{i}"))
-      else:
-        pipeline.load_lora_weights(lora["path"], adapter_name=keep_alnum(lora["path"]))
-        adapter_names.append(keep_alnum(lora["path"]))
+def load_loras(pipeline, loras, move_to_device=False):
+  """
+  Swap the pipeline's LoRA adapters to match `loras`, keeping the base model resident.
+  The pipeline is only moved to the device again when adapters were loaded or removed.
+  """
+  changed = apply_loras(pipeline, loras)
 
-      adapter_weights.append(lora["strength"] / 100)
-
-    pipeline.set_adapters(adapter_names, adapter_weights=adapter_weights)
-    pipeline.set_lora_device(adapter_names=adapter_names, device="cuda:0")
-
-  pipeline.to(device="cuda", dtype=torch.bfloat16)
+  if changed or move_to_device:
+    pipeline.to(device="cuda", dtype=torch.bfloat16)
 
   return pipeline
-
-def keep_alnum(s: str) -> str:
-  """Return string with only ASCII letters and digits preserved."""
-  return "".join(ch for ch in s if ch.isalnum())
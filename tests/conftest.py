@@ -0,0 +1,98 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+class StubOllama:
+  """
+  Minimal Ollama /api/generate and /api/ps server on a free local port. Each generate
+  call answers `{"variation": "v<seed>"}` after `delay` seconds, or with `status` when
+  `fail(payload)` is true. Records every request and the peak number in flight.
+  """
+
+  def __init__(self, delay=0.0):
+    self.delay = delay
+    self.status = 500
+    self.fail = lambda payload: False
+    self.requests = []
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self._lock = threading.Lock()
+
+    stub = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def log_message(self, *args):
+        pass
+
+      def do_GET(self):
+        self._reply(200, {"models": []})
+
+      def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with stub._lock:
+          stub.requests.append(payload)
+        if payload.get("keep_alive") == 0 and "prompt" not in payload:
+          self._reply(200, {"done": True})
+          return
+
+        with stub._lock:
+          stub.in_flight += 1
+          stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+        try:
+          time.sleep(stub.delay)
+          if stub.fail(payload):
+            self._reply(stub.status, {"error": "stub failure"})
+            return
+          seed = (payload.get("options") or {}).get("seed")
+          self._reply(200, {"response": json.dumps({"variation": f"v{seed}"})})
+        finally:
+          with stub._lock:
+            stub.in_flight -= 1
+
+      def _reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self.server.daemon_threads = True
+    self.url = f"http://127.0.0.1:{self.server.server_port}"
+    self._thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    self._thread.start()
+
+  @property
+  def generate_calls(self):
+    return [r for r in self.requests if "prompt" in r]
+
+  @property
+  def unload_calls(self):
+    return [r for r in self.requests if "prompt" not in r and r.get("keep_alive") == 0]
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+@pytest.fixture
+def ollama_stub():
+  stub = StubOllama()
+  yield stub
+  stub.close()
+
+@pytest.fixture
+def ollama_stubs():
+  stubs = []
+
+  def make(delay=0.0):
+    stub = StubOllama(delay)
+    stubs.append(stub)
+    return stub
+
+  yield make
+  for stub in stubs:
+    stub.close()
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import pytest
+
+from src.utils.cache_util import ModelCache, measure_bytes
+
+class TinyTensor:
+  """CPU stand-in for a tensor: only what measure_bytes looks at."""
+
+  def __init__(self, numel, element_size=4):
+    self._numel = numel
+    self._element_size = element_size
+
+  def numel(self):
+    return self._numel
+
+  def element_size(self):
+    return self._element_size
+
+class TinyModel:
+  """CPU stand-in for a torch module with one weight and one buffer."""
+
+  def __init__(self, weights, buffers=0):
+    self.weight = TinyTensor(weights)
+    self.buffer = TinyTensor(buffers)
+
+  def parameters(self):
+    return [self.weight]
+
+  def buffers(self):
+    return [self.buffer]
+
+class TinyPipeline:
+  def __init__(self, **components):
+    self.components = components
+
+def test_measure_bytes_counts_shared_modules_once():
+  unet = TinyModel(100, 10)
+  pipe = TinyPipeline(unet=unet, vae=TinyModel(50), text_encoder=None)
+  other = TinyPipeline(unet=unet)
+
+  assert measure_bytes(pipe) == (100 + 10 + 50) * 4
+  assert measure_bytes({"txt2img": (pipe, None), "img2img": (other, None)}) == (100 + 10 + 50) * 4
+
+def test_lru_order_evicts_least_recently_used():
+  evicted = []
+  cache = ModelCache(max_slots=2, on_evict=evicted.append)
+
+  cache.get_or_load("a", lambda: TinyModel(1))
+  cache.get_or_load("b", lambda: TinyModel(1))
+  # touching "a" makes "b" the least recently used
+  cache.get_or_load("a", lambda: pytest.fail("a is cached"))
+  cache.get_or_load("c", lambda: TinyModel(1))
+
+  assert evicted == ["b"]
+  assert [e["key"] for e in cache.entries()] == ["a", "c"]
+  assert cache.stats()["hits"] == 1
+  assert cache.stats()["misses"] == 3
+
+def test_pinned_entries_are_never_evicted():
+  evicted = []
+  cache = ModelCache(max_slots=1, on_evict=evicted.append)
+
+  cache.get_or_load("a", lambda: TinyModel(1), pin=True)
+  cache.get_or_load("b", lambda: TinyModel(1))
+
+  assert evicted == []
+  assert "a" in cache and "b" in cache
+
+  cache.unpin("a")
+  assert evicted == ["a"]
+
+def test_byte_budget_evicts_until_within_budget():
+  evicted = []
+  cache = ModelCache(max_slots=10, max_bytes=1000, on_evict=evicted.append)
+
+  cache.get_or_load("a", lambda: TinyModel(100))
+  cache.get_or_load("b", lambda: TinyModel(100))
+  assert cache.total_bytes() == 800
+  cache.get_or_load("c", lambda: TinyModel(100))
+
+  assert evicted == ["a"]
+  assert cache.total_bytes() == 800
+
+  # an entry larger than the whole budget still loads, alone
+  cache.get_or_load("d", lambda: TinyModel(1000))
+  assert evicted == ["a", "b", "c"]
+  assert [e["key"] for e in cache.entries()] == ["d"]
+
+def test_failed_load_keeps_resident_entries():
+  evicted = []
+  cache = ModelCache(max_slots=1, on_evict=evicted.append)
+  cache.get_or_load("a", lambda: TinyModel(1))
+
+  def bad_checkpoint():
+    raise FileNotFoundError("missing.safetensors")
+
+  with pytest.raises(FileNotFoundError):
+    cache.get_or_load("b", bad_checkpoint)
+
+  assert evicted == []
+  assert "a" in cache and "b" not in cache
+  assert cache.stats()["loading"] == 0
+
+def test_concurrent_loads_of_one_key_run_the_loader_once():
+  cache = ModelCache(max_slots=2)
+  calls = []
+  started = threading.Event()
+
+  def loader():
+    calls.append(1)
+    started.set()
+    time.sleep(0.05)
+    return TinyModel(1)
+
+  results = []
+  threads = [threading.Thread(target=lambda: results.append(cache.get_or_load("a", loader))) for _ in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert len(calls) == 1
+  assert len(results) == 8
+  assert all(result is results[0] for result in results)
+
+def test_concurrent_waiters_see_the_load_error():
+  cache = ModelCache(max_slots=2)
+  release = threading.Event()
+
+  def loader():
+    release.wait()
+    raise RuntimeError("bad checkpoint")
+
+  errors = []
+
+  def load():
+    try:
+      cache.get_or_load("a", loader)
+    except RuntimeError as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=load) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  time.sleep(0.05)
+  release.set()
+  for thread in threads:
+    thread.join()
+
+  assert len(errors) == 4
+  assert "a" not in cache
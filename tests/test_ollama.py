@@ -0,0 +1,75 @@
+from flask import Flask
+
+import pytest
+
+from src.endpoints.ollama import ollama_bp
+from src.utils import ollama_util
+
+@pytest.fixture
+def client(monkeypatch):
+  monkeypatch.delenv("OLLAMA_BACKENDS", raising=False)
+  monkeypatch.delenv("OLLAMA_CACHE_PATH", raising=False)
+  # a fresh client so the concurrency limit is the one set here
+  monkeypatch.setattr(ollama_util, "_ollama_client", ollama_util.OllamaClient(max_concurrency=4))
+
+  app = Flask(__name__)
+  app.register_blueprint(ollama_bp)
+  return app.test_client()
+
+def request_variations(client, stub, **payload):
+  return client.post("/api/ollama/prompt_variation", json={
+    "base_prompt": "a cat",
+    "variation_prompt": "change the colors",
+    "ollama_url": f"{stub.url}/api/generate",
+    "ollama_model": "stub",
+    **payload
+  })
+
+def test_variations_run_concurrently_up_to_the_limit(client, ollama_stub):
+  ollama_stub.delay = 0.1
+
+  resp = request_variations(client, ollama_stub, num_variations=8, seed=10)
+
+  assert resp.status_code == 200
+  body = resp.get_json()
+  # results keep request order even though the calls finish in any order
+  assert body["variations"] == [f"v{10 + i}" for i in range(8)]
+  assert body["ollama_calls"] == 8
+  assert len(ollama_stub.generate_calls) == 8
+  assert ollama_stub.max_in_flight == 4
+  assert len(ollama_stub.unload_calls) == 1
+
+def test_each_variation_call_gets_its_own_seed(client, ollama_stub):
+  resp = request_variations(client, ollama_stub, num_variations=3, seed=5)
+
+  assert resp.status_code == 200
+  assert sorted(c["options"]["seed"] for c in ollama_stub.generate_calls) == [5, 6, 7]
+
+def test_failed_call_still_unloads_the_model(client, ollama_stub):
+  ollama_stub.fail = lambda payload: payload["options"]["seed"] == 1
+
+  resp = request_variations(client, ollama_stub, num_variations=3, seed=0)
+
+  assert resp.status_code == 502
+  assert "Ollama request failed" in resp.get_json()["error"]
+  assert len(ollama_stub.unload_calls) == 1
+
+def test_unload_can_be_turned_off(client, ollama_stub):
+  resp = request_variations(client, ollama_stub, num_variations=2, unload_model=False)
+
+  assert resp.status_code == 200
+  assert ollama_stub.unload_calls == []
+
+def test_single_call_returns_distinct_variations(client, ollama_stub, monkeypatch):
+  answers = iter([["one", "two", "one"], ["three"]])
+  monkeypatch.setattr(
+    ollama_util.OllamaClient,
+    "generate",
+    lambda self, *args, **kwargs: {"variations": next(answers)}
+  )
+
+  resp = request_variations(client, ollama_stub, num_variations=3, single_call=True, unload_model=False)
+
+  assert resp.status_code == 200
+  assert resp.get_json()["variations"] == ["one", "two", "three"]
+  assert resp.get_json()["ollama_calls"] == 2
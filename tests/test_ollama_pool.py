@@ -0,0 +1,94 @@
+from flask import Flask
+
+import pytest
+
+from src.endpoints.ollama import ollama_bp
+from src.utils import ollama_util
+from src.utils.ollama_pool_util import OllamaPool
+
+@pytest.fixture
+def make_client(monkeypatch):
+  monkeypatch.delenv("OLLAMA_CACHE_PATH", raising=False)
+  monkeypatch.setattr(ollama_util, "_ollama_client", ollama_util.OllamaClient(max_concurrency=4))
+
+  def make(stubs, max_failures=3):
+    # no health thread: backends change state only through the calls made in the test
+    pool = OllamaPool([stub.url for stub in stubs], max_failures=max_failures)
+    monkeypatch.setattr(ollama_util, "get_ollama_pool", lambda: pool)
+    app = Flask(__name__)
+    app.register_blueprint(ollama_bp)
+    return app.test_client(), pool
+
+  return make
+
+def request_variations(client, **payload):
+  return client.post("/api/ollama/prompt_variation", json={
+    "base_prompt": "a cat",
+    "variation_prompt": "change the colors",
+    "ollama_model": "stub",
+    **payload
+  })
+
+def test_5xx_fails_over_to_the_next_backend(make_client, ollama_stubs):
+  broken, working = ollama_stubs(), ollama_stubs()
+  broken.fail = lambda payload: True
+  client, pool = make_client([broken, working])
+
+  resp = request_variations(client, num_variations=4, seed=0)
+
+  assert resp.status_code == 200
+  assert resp.get_json()["variations"] == ["v0", "v1", "v2", "v3"]
+  assert len(working.generate_calls) == 4
+  assert len(broken.generate_calls) >= 1
+  assert pool.backends[0].consecutive_failures == len(broken.generate_calls)
+
+def test_backend_failing_every_call_is_ejected(make_client, ollama_stubs):
+  broken, working = ollama_stubs(), ollama_stubs()
+  broken.fail = lambda payload: True
+  client, pool = make_client([broken, working], max_failures=2)
+
+  for _ in range(4):
+    # the broken backend is preferred again while it is the only one with the model loaded
+    pool.backends[0].loaded_models = {"stub"}
+    pool.backends[1].loaded_models = set()
+    assert request_variations(client, num_variations=1, unload_model=False).status_code == 200
+
+  assert len(broken.generate_calls) == 2
+  assert not pool.backends[0].healthy
+
+def test_every_backend_failing_returns_a_json_error(make_client, ollama_stubs):
+  stubs = [ollama_stubs(), ollama_stubs()]
+  for stub in stubs:
+    stub.fail = lambda payload: True
+  client, pool = make_client(stubs, max_failures=10)
+
+  resp = request_variations(client, num_variations=1)
+
+  assert resp.status_code == 503
+  assert "All Ollama backends failed" in resp.get_json()["error"]
+  assert [len(stub.generate_calls) for stub in stubs] == [1, 1]
+
+def test_4xx_is_not_retried(make_client, ollama_stubs):
+  stubs = [ollama_stubs(), ollama_stubs()]
+  for stub in stubs:
+    stub.status = 404
+    stub.fail = lambda payload: True
+  client, pool = make_client(stubs)
+
+  resp = request_variations(client, num_variations=1)
+
+  assert resp.status_code == 502
+  assert sum(len(stub.generate_calls) for stub in stubs) == 1
+  assert all(backend.healthy and backend.consecutive_failures == 0 for backend in pool.backends)
+
+def test_unload_only_reaches_the_backends_the_request_used(make_client, ollama_stubs):
+  stubs = [ollama_stubs(), ollama_stubs(), ollama_stubs()]
+  client, pool = make_client(stubs)
+  # the warm backend is preferred for the model it already has loaded
+  pool.backends[1].loaded_models = {"stub"}
+
+  resp = request_variations(client, num_variations=1)
+
+  assert resp.status_code == 200
+  assert [len(stub.generate_calls) for stub in stubs] == [0, 1, 0]
+  assert [len(stub.unload_calls) for stub in stubs] == [0, 1, 0]
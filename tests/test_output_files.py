@@ -0,0 +1,21 @@
+import uuid
+
+from src.utils.input_util import iter_input_paths
+from src.utils.metadata_util import _walk_outputs
+from src.utils.output_store_util import is_temp_output, temp_output_path
+
+def test_temp_names_keep_the_extension():
+  tmp = temp_output_path("/out/image.png")
+
+  assert tmp.endswith(".png")
+  assert is_temp_output(tmp)
+  assert not is_temp_output("/out/image.png")
+  assert not is_temp_output("/out/my.tmp-notes.png")
+
+def test_orphaned_temp_files_are_not_treated_as_outputs(tmp_path):
+  (tmp_path / "image.png").write_bytes(b"png")
+  (tmp_path / f"image.tmp-{uuid.uuid4().hex}.png").write_bytes(b"partial")
+  (tmp_path / f"video.tmp-{uuid.uuid4().hex}.mp4").write_bytes(b"partial")
+
+  assert [p.split("/")[-1] for p in iter_input_paths(str(tmp_path), extensions=(".png", ".mp4"))] == ["image.png"]
+  assert [p.split("/")[-1] for p in _walk_outputs(str(tmp_path), True)] == ["image.png"]
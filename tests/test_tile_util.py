@@ -0,0 +1,93 @@
+from PIL import Image
+import numpy as np
+import pytest
+
+from src.utils.tile_util import TileBlender, compute_tiles, feather_weights, tile_starts, upscale_tiled
+
+def random_image(width, height, seed=0):
+  pixels = np.random.default_rng(seed).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+  return Image.fromarray(pixels)
+
+@pytest.mark.parametrize("width, height, tile_size, overlap", [
+  (1024, 1024, 512, 128),
+  (1536, 1024, 768, 64),
+  (2048, 1152, 1024, 256),
+  (96, 96, 128, 64),
+  (520, 264, 256, 0)
+])
+def test_tiles_have_one_size_and_cover_the_canvas(width, height, tile_size, overlap):
+  tiles = compute_tiles(width, height, tile_size, overlap)
+
+  sizes = {(w, h) for _, _, w, h in tiles}
+  assert len(sizes) == 1
+  tile_w, tile_h = sizes.pop()
+  assert tile_w <= tile_size and tile_h <= tile_size
+  assert tile_w % 8 == 0 and tile_h % 8 == 0
+
+  covered = np.zeros((height, width), dtype=bool)
+  for x, y, w, h in tiles:
+    assert x >= 0 and y >= 0 and x + w <= width and y + h <= height
+    covered[y:y + h, x:x + w] = True
+  assert covered.all()
+
+def test_tile_starts_end_flush_with_the_edge():
+  assert tile_starts(1024, 512, 128) == [0, 384, 512]
+  assert tile_starts(512, 512, 128) == [0]
+  assert tile_starts(100, 512, 128) == [0]
+
+def test_invalid_tile_inputs_are_rejected():
+  with pytest.raises(ValueError):
+    compute_tiles(100, 100, 128, 64)
+  with pytest.raises(ValueError):
+    tile_starts(1024, 128, 128)
+
+def test_identity_tiles_reconstruct_the_image_exactly():
+  image = random_image(264, 200)
+
+  result = upscale_tiled(image, lambda tiles: tiles, tile_size=96, overlap=32, batch_size=3)
+
+  assert result.size == image.size
+  assert np.array_equal(np.asarray(result), np.asarray(image))
+
+def test_stub_pipeline_gets_batches_of_same_size_tiles():
+  image = random_image(512, 512)
+  batches = []
+  progress = []
+
+  def stub_pipeline(tiles):
+    batches.append([tile.size for tile in tiles])
+    return tiles
+
+  upscale_tiled(image, stub_pipeline, tile_size=256, overlap=64, batch_size=4, on_tile=lambda done, total: progress.append((done, total)))
+
+  assert [len(batch) for batch in batches] == [4, 4, 1]
+  assert {size for batch in batches for size in batch} == {(256, 256)}
+  assert progress == [(4, 9), (8, 9), (9, 9)]
+
+def test_feather_weights_ramp_only_towards_neighbouring_tiles():
+  overlap = 16
+  # left tile of a two tile row: flat on the left edge, fading out towards the right neighbour
+  weights = feather_weights((0, 0, 64, 64), 112, 64, overlap)
+
+  row = weights[32]
+  assert np.all(row[:64 - overlap] == 1)
+  assert np.all(np.diff(row[64 - overlap:]) < 0)
+  assert row[-1] > 0
+  # top and bottom are canvas edges, so columns are flat
+  assert np.all(weights[:, 10] == 1)
+
+def test_seams_blend_smoothly_between_different_tiles():
+  width, height, tile, overlap = 112, 64, 64, 16
+  blender = TileBlender(width, height, overlap)
+  # two constant tiles that disagree completely, as a worst case for a visible seam
+  blender.add((0, 0, tile, height), np.zeros((height, tile, 3)))
+  blender.add((width - tile, 0, tile, height), np.full((height, tile, 3), 255.0))
+
+  row = blender.result()[32, :, 0]
+  seam = row[width - tile:tile]
+
+  assert np.all(row[:width - tile] == 0)
+  assert np.all(row[tile:] == 255)
+  # monotonic across the overlap, with no step larger than an even spread would give
+  assert np.all(np.diff(seam) > 0)
+  assert np.max(np.diff(row)) <= 255 / overlap * 1.5